@@ -0,0 +1,285 @@
+"""
+Generates structured meshes of any size for benchmarking.
+
+Meshes are unit-spaced grids of Hex8, Tet4 (six per grid cell) or Shell4
+elements.  They can either be built directly as FEproblems, complete with
+materials, sets, surfaces, contacts and switched constraints, or written out
+as Abaqus .inp files and Open Knee .cnfg files for benchmarking the readers.
+"""
+from __future__ import with_statement
+import sys, os
+
+# Find the library one directory up.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import febabel as f
+geo, mat, con = f.geometry, f.materials, f.constraints
+
+
+KINDS = ('hex8', 'tet4', 'shell4')
+
+
+def grid_size(kind, n_elements):
+    "Returns the number of grid cells along each side for about n_elements."
+    if kind == 'shell4':
+        return max(1, int(round(n_elements ** 0.5)))
+    elif kind == 'tet4':
+        return max(1, int(round((n_elements / 6.0) ** (1/3.0))))
+    else:
+        return max(1, int(round(n_elements ** (1/3.0))))
+
+
+# Node indices (in i,j,k offsets) of a grid cell's corners, ordered as Hex8.
+_hex_corners = [(0,0,0), (1,0,0), (1,1,0), (0,1,0),
+                (0,0,1), (1,0,1), (1,1,1), (0,1,1)]
+# Kuhn subdivision of a cube into six tetrahedra sharing the 0-6 diagonal.
+_kuhn_tets = [(0,1,2,6), (0,2,3,6), (0,3,7,6), (0,7,4,6), (0,4,5,6), (0,5,1,6)]
+
+
+def _cells(kind, n):
+    """Yields (i, j, k, corner node indices) for every grid cell, where node
+    indices count along x, then y, then z."""
+    m = n + 1
+    if kind == 'shell4':
+        for j in xrange(n):
+            for i in xrange(n):
+                yield i, j, 0, ( i + m*j, i+1 + m*j, i+1 + m*(j+1), i + m*(j+1) )
+    else:
+        for k in xrange(n):
+            for j in xrange(n):
+                for i in xrange(n):
+                    yield i, j, k, tuple( (i+a) + m*((j+b) + m*(k+c))
+                        for a,b,c in _hex_corners )
+
+
+def _coords(kind, n):
+    "Returns a list of the coordinates of every grid node."
+    m = n + 1
+    if kind == 'shell4':
+        return [ (float(i), float(j), 0.0) for j in xrange(m) for i in xrange(m) ]
+    return [ (float(i), float(j), float(k))
+        for k in xrange(m) for j in xrange(m) for i in xrange(m) ]
+
+
+
+def build_problem(kind, n_elements):
+    """Returns an FEproblem with a structured mesh of about n_elements.
+
+    The lowest layer of cells is a rigid body with switched constraints, and
+    the rest is a Mooney-Rivlin solid (or shell) whose top surface slides
+    against the bottom surface, with a tied contact switched on later.  The
+    top nodes have switched displacements and a rigid interface."""
+    n = grid_size(kind, n_elements)
+    p = f.problem.FEproblem()
+
+    nodes = [ geo.Node(c) for c in _coords(kind, n) ]
+    p.sets['allnodes'] = set(nodes)
+
+    soft = mat.MooneyRivlin(1.0, 0.0, 10.0)
+    rigid = mat.Rigid((0,0,0))
+    ramp = con.LoadCurve({0:0, 1:1})
+    for dof in ('x','y','Rx','Ry','Rz'):
+        rigid.constraints[dof] = con.SwitchConstraint({0:con.fixed, 1:con.free})
+    rigid.constraints['z'] = con.SwitchConstraint(
+        {0: con.Displacement(ramp, -0.1), 1: con.Force(ramp, 10)} )
+
+    elements = list()
+    bottom, top = list(), list()
+    top_k = 0 if kind == 'shell4' else n-1
+    for i, j, k, c in _cells(kind, n):
+        matl = rigid if (k == 0 and kind != 'shell4' and n > 1) else soft
+        if kind == 'hex8':
+            elements.append(geo.Hex8([nodes[x] for x in c], matl))
+        elif kind == 'tet4':
+            elements.extend( geo.Tet4([nodes[c[x]] for x in t], matl)
+                for t in _kuhn_tets )
+        else:
+            elements.append(geo.Shell4([nodes[x] for x in c], matl, 0.1))
+
+        # Faces on the bottom and top of the block, as surfaces.
+        if kind == 'shell4':
+            top.append(geo.Surface4([nodes[x] for x in c]))
+            bottom.append(geo.Surface4([nodes[x] for x in reversed(c)]))
+            continue
+        if k == 0:
+            face = [nodes[c[x]] for x in (0,3,2,1)]
+            if kind == 'tet4':
+                bottom.extend((geo.Surface3(face[:3]),
+                    geo.Surface3([face[0], face[2], face[3]])))
+            else:
+                bottom.append(geo.Surface4(face))
+        if k == top_k:
+            face = [nodes[c[x]] for x in (4,5,6,7)]
+            if kind == 'tet4':
+                top.extend((geo.Surface3(face[:3]),
+                    geo.Surface3([face[0], face[2], face[3]])))
+            else:
+                top.append(geo.Surface4(face))
+
+    p.sets['allelements'] = set(elements)
+    p.sets['rigid'] = set( e for e in elements if e.material is rigid )
+    p.sets['top'] = set(top)
+    p.sets['bottom'] = set(bottom)
+
+    top_nodes = set( n for s in top for n in s )
+    for node in top_nodes:
+        node.constraints['z'] = con.SwitchConstraint(
+            {0: con.free, 0.5: con.Displacement(ramp, -0.05)} )
+    p.sets['top_nodes'] = top_nodes
+
+    p.sets['interfaces'] = set([
+        con.SlidingContact(top, bottom, options={'penalty': '100'}),
+        con.SwitchContact({0: None, 0.5: con.TiedContact(top, bottom)}),
+        con.RigidInterface(rigid, list(top_nodes)[:len(top_nodes)//2 + 1]),
+    ])
+    p.timestepper = f.problem.TimeStepper(2, 0.1, 0.01, ramp)
+    return p
+
+
+
+def _write_ids(fileobj, ids):
+    "Write a list of IDs 16 per line, as Abaqus expects for sets."
+    for i in xrange(0, len(ids), 16):
+        line = ','.join(map(str, ids[i:i+16]))
+        fileobj.write(line + (',\n' if i+16 < len(ids) else '\n'))
+
+
+# Abaqus element types, and the corners (as indices into _hex_corners) and
+# faces (as for the element class) of the solids in each grid cell.
+_inp_types = {'hex8': 'C3D8', 'tet4': 'C3D4', 'shell4': 'S4'}
+_cell_solids = {
+    'hex8': [ (tuple(range(8)), geo.Hex8.faces) ],
+    'tet4': [ (t, geo.Tet4.faces) for t in _kuhn_tets ],
+}
+
+
+def write_inp(filename, kind, n_elements):
+    """Write a structured mesh of about n_elements to an Abaqus .inp file, as
+    C3D8, C3D4 (six per grid cell) or S4 elements.
+
+    The file defines the element sets "rigid" and "soft", the node sets
+    "top_nodes" and "anchor", and the surfaces "top" and "bottom"."""
+    if kind not in KINDS:
+        raise ValueError('Unknown mesh kind "%s".' % kind)
+    n = grid_size(kind, n_elements)
+    with open(filename, 'w') as fileobj:
+        fileobj.write('*NODE\n')
+        for i, c in enumerate(_coords(kind, n)):
+            fileobj.write('%s,%r,%r,%r\n' % ((i+1,) + c))
+
+        fileobj.write('*ELEMENT,TYPE=%s\n' % _inp_types[kind])
+        rigid, soft, top, bottom = list(), list(), list(), list()
+        top_nodes = set()
+        eid = 0
+        for i, j, k, c in _cells(kind, n):
+            if kind == 'shell4':
+                eid += 1
+                fileobj.write('%s,%s\n' % (eid, ','.join(str(x+1) for x in c)))
+                soft.append(eid)
+                top.append('%s,SPOS' % eid)
+                bottom.append('%s,SNEG' % eid)
+                top_nodes.update(x+1 for x in c)
+                continue
+            if k == n-1:
+                top_nodes.update(c[x]+1 for x in (4,5,6,7))
+            for corners, faces in _cell_solids[kind]:
+                eid += 1
+                fileobj.write('%s,%s\n' % (eid,
+                    ','.join(str(c[x]+1) for x in corners)))
+                (rigid if k == 0 and n > 1 else soft).append(eid)
+                # Faces lying wholly on the bottom or top of the block.
+                for face_id, face in enumerate(faces):
+                    z = set( _hex_corners[corners[x]][2] for x in face )
+                    if k == 0 and z == set([0]):
+                        bottom.append('%s,S%s' % (eid, face_id+1))
+                    if k == n-1 and z == set([1]):
+                        top.append('%s,S%s' % (eid, face_id+1))
+
+        for name, ids in (('rigid', rigid), ('soft', soft)):
+            if not ids:
+                continue
+            fileobj.write('*ELSET,ELSET=%s\n' % name)
+            _write_ids(fileobj, ids)
+        top_nodes = sorted(top_nodes)
+        for name, ids in (('top_nodes', top_nodes),
+                          ('anchor', top_nodes[:len(top_nodes)//2 + 1])):
+            fileobj.write('*NSET,NSET=%s\n' % name)
+            _write_ids(fileobj, ids)
+        for name, faces in (('top', top), ('bottom', bottom)):
+            fileobj.write('*SURFACE,NAME=%s\n' % name)
+            fileobj.write(''.join('%s\n' % x for x in faces))
+
+
+
+_cnfg_template = """\
+[options]
+mesh = %(mesh)s
+scale = 1
+lc = linear
+
+[solver]
+time_steps = 10
+step_size = 0.1
+dtmin = .001
+dtmax = lc="1"
+
+[loadcurves]
+1 = 0,0; .5,.1; 1,.1; 2,.1
+2 = 0,0;
+    1,-100;
+    2,-200
+
+[step 1]
+rigid = fixed,fixed,prescribed;2;0.01, fixed,fixed,fixed
+[step 2]
+rigid = fixed,fixed,force;2;1, free,fixed,fixed
+
+[material-rigid]
+type=rigid
+density=1.0e-6
+COM=0,0,0
+
+[material-soft]
+type=Mooney-Rivlin
+density=1.5e-9
+c1=.856
+c2=0
+K=8
+
+[rigid_int]
+anchor = anchor,rigid
+
+[contact]
+self = top,bottom
+
+[contact_settings]
+type=facet-to-facet sliding
+laugon=0
+penalty=100
+two_pass=1
+
+[springs]
+tether = top_nodes, 1, 600, 37.2
+
+[transform]
+medial_f_cond=114.510002,77.801003,24.441999
+lateral_f_cond=108.129997,78.456001,66.514
+proximal_femur=79.168999,29.436001,46.682999
+distal_femur=85.394997,74.856003,43.381001
+proximal_tibia=93.695,92.123001,44.549
+q_angle=0.0925025
+"""
+
+def write_cnfg(directory, n_elements):
+    """Write a hex8 mesh of about n_elements and an Open Knee configuration
+    using it into directory.  Returns the path of the configuration file.
+
+    All settings are in directory's defaults.cnfg, which the returned
+    model.cnfg INCLUDEs."""
+    mesh = 'mesh.inp'
+    write_inp(os.path.join(directory, mesh), 'hex8', n_elements)
+    with open(os.path.join(directory, 'defaults.cnfg'), 'w') as fileobj:
+        fileobj.write(_cnfg_template % {'mesh': mesh})
+    filename = os.path.join(directory, 'model.cnfg')
+    with open(filename, 'w') as fileobj:
+        fileobj.write('INCLUDE defaults.cnfg\n\n[solver]\ntime_steps = 20\n')
+    return filename
@@ -0,0 +1,231 @@
+#!/usr/bin/env python2
+"""
+Times FEbabel's readers and writers on generated meshes.
+
+Every case runs in a forked process of its own, so that neither memory nor
+caches carry over between cases.  Each case records its best wall time over
+the repeats, and the peak resident memory of the process running it.
+
+Results are compared with a stored baseline (by default, baseline.json beside
+this script) and the script exits with status 1 if any case is slower or
+bigger than the baseline by more than the tolerance.  Baselines depend on the
+machine, so record a new one with --save-baseline when moving elsewhere.
+
+Examples:
+    bench/run.py
+    bench/run.py --sizes 1e3,1e5,1e7 --cases read_inp,write_feb -o out.json
+    bench/run.py --save-baseline
+"""
+from __future__ import with_statement
+import sys, os, time, json, shutil, tempfile, subprocess, resource
+import multiprocessing
+
+import meshgen
+import febabel as f
+
+
+here = os.path.dirname(os.path.abspath(__file__))
+translateFE = os.path.join(os.path.dirname(here), 'translateFE')
+
+DEFAULT_SIZES = (1000, 8000)
+
+
+
+# Each case is a function taking a mesh kind, an element count and a scratch
+# directory.  It does any setup needed, then returns a function to be timed.
+
+def _read(filename):
+    def run():
+        f.problem.FEproblem().read(filename)
+    return run
+
+def case_read_inp(kind, size, tmp):
+    filename = os.path.join(tmp, 'mesh.inp')
+    meshgen.write_inp(filename, kind, size)
+    return _read(filename)
+
+def case_read_cnfg(kind, size, tmp):
+    return _read(meshgen.write_cnfg(tmp, size))
+
+def case_get_descendants_sorted(kind, size, tmp):
+    p = meshgen.build_problem(kind, size)
+    return p.get_descendants_sorted
+
+def case_write_feb(kind, size, tmp):
+    p = meshgen.build_problem(kind, size)
+    filename = os.path.join(tmp, 'out.feb')
+    return lambda: p.write(filename)
+
+def case_write_vtu(kind, size, tmp):
+    p = meshgen.build_problem(kind, size)
+    filename = os.path.join(tmp, 'out.vtu')
+    return lambda: p.write(filename)
+
+def case_translateFE(kind, size, tmp):
+    cnfg = meshgen.write_cnfg(tmp, size)
+    args = [sys.executable, translateFE, cnfg, os.path.join(tmp, 'out.feb')]
+    return lambda: subprocess.check_call(args)
+
+def case_startup(kind, size, tmp):
+    # A single element, so that the time is that of starting translateFE:
+    # importing FEbabel and the formats used.  The size is ignored.
+    inp = os.path.join(tmp, 'mesh.inp')
+    meshgen.write_inp(inp, kind, 1)
+    args = [sys.executable, translateFE, inp, os.path.join(tmp, 'out.feb')]
+    return lambda: subprocess.check_call(args)
+
+cases = {
+    'read_inp': (case_read_inp, meshgen.KINDS),
+    'read_cnfg': (case_read_cnfg, ('hex8',)),
+    'get_descendants_sorted': (case_get_descendants_sorted, meshgen.KINDS),
+    'write_feb': (case_write_feb, meshgen.KINDS),
+    'write_vtu': (case_write_vtu, meshgen.KINDS),
+    'translateFE': (case_translateFE, ('hex8',)),
+    'startup': (case_startup, ('hex8',)),
+}
+case_order = ('read_inp', 'read_cnfg', 'get_descendants_sorted', 'write_feb',
+    'write_vtu', 'translateFE', 'startup')
+
+
+
+def _max_rss_kb():
+    "Peak resident memory of this process and its finished children, in KB."
+    rss = max( resource.getrusage(who).ru_maxrss for who in
+        (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN) )
+    # Linux reports kilobytes; OS X reports bytes.
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def _run_case(name, kind, size, queue):
+    "Child process: set up a case, time it once, and report back."
+    tmp = tempfile.mkdtemp(prefix='febabel-bench-')
+    try:
+        run = cases[name][0](kind, size, tmp)
+        start = time.time()
+        run()
+        wall = time.time() - start
+        queue.put( {'wall': wall, 'peak_kb': _max_rss_kb()} )
+    except:
+        import traceback
+        queue.put( {'error': traceback.format_exc()} )
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def run_case(name, kind, size, repeat=1):
+    """Runs a case repeat times, each in a fresh process.
+    Returns a dict with the best wall time and the largest peak memory."""
+    result = {'wall': None, 'peak_kb': 0}
+    for i in xrange(repeat):
+        queue = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=_run_case,
+            args=(name, kind, size, queue))
+        proc.start()
+        r = queue.get()
+        proc.join()
+        if 'error' in r:
+            raise RuntimeError('Case %s/%s/%s failed:\n%s'
+                % (name, kind, size, r['error']))
+        if result['wall'] is None or r['wall'] < result['wall']:
+            result['wall'] = r['wall']
+        result['peak_kb'] = max(result['peak_kb'], r['peak_kb'])
+    return result
+
+
+
+def compare(results, baseline, tolerance, memory_tolerance,
+        min_wall=0.05, min_kb=1024):
+    """Compares results with a baseline, both dicts of case name to result.
+    Returns a list of (case name, description) for every regression.
+
+    A case regresses if it exceeds its baseline by more than the tolerance
+    ratio, and by more than min_wall seconds or min_kb kilobytes, so that
+    noise in tiny cases is ignored."""
+    regressions = list()
+    for name, r in sorted(results.iteritems()):
+        b = baseline.get(name)
+        if b is None:
+            continue
+        if r['wall'] > b['wall'] * tolerance and r['wall'] - b['wall'] > min_wall:
+            regressions.append( (name, 'wall time %.3fs vs. baseline %.3fs'
+                % (r['wall'], b['wall'])) )
+        if r['peak_kb'] > b['peak_kb'] * memory_tolerance and \
+                r['peak_kb'] - b['peak_kb'] > min_kb:
+            regressions.append( (name, 'peak memory %d KB vs. baseline %d KB'
+                % (r['peak_kb'], b['peak_kb'])) )
+    return regressions
+
+
+
+def main(argv=None):
+    from optparse import OptionParser
+    parser = OptionParser(usage='Usage: %prog [options]')
+    parser.add_option('-s', '--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+        help='Comma-separated approximate element counts [%default]')
+    parser.add_option('-c', '--cases', default=','.join(case_order),
+        help='Comma-separated cases to run [%default]')
+    parser.add_option('-k', '--kinds', default=','.join(meshgen.KINDS),
+        help='Comma-separated element kinds to run [%default]')
+    parser.add_option('-r', '--repeat', type='int', default=3,
+        help='Runs of each case; the best time is kept [%default]')
+    parser.add_option('-o', '--output', help='Write results to this JSON file')
+    parser.add_option('-b', '--baseline', default=os.path.join(here, 'baseline.json'),
+        help='Baseline JSON file to compare against [%default]')
+    parser.add_option('--save-baseline', action='store_true',
+        help='Store the results as the new baseline instead of comparing')
+    parser.add_option('-t', '--tolerance', type='float', default=1.25,
+        help='Allowed ratio of wall time to the baseline [%default]')
+    parser.add_option('-m', '--memory-tolerance', type='float', default=1.25,
+        help='Allowed ratio of peak memory to the baseline [%default]')
+    opts, args = parser.parse_args(argv)
+    if args:
+        parser.error('No arguments are expected.')
+
+    sizes = [ int(float(x)) for x in opts.sizes.split(',') ]
+    kinds = opts.kinds.split(',')
+    names = opts.cases.split(',')
+    for name in names:
+        if name not in cases:
+            parser.error('Unknown case "%s".' % name)
+
+    results = dict()
+    for name in names:
+        for kind in cases[name][1]:
+            if kind not in kinds:
+                continue
+            for size in sizes:
+                key = '%s/%s/%d' % (name, kind, size)
+                r = run_case(name, kind, size, opts.repeat)
+                results[key] = r
+                print('%-40s %9.3fs %10d KB' % (key, r['wall'], r['peak_kb']))
+                sys.stdout.flush()
+
+    doc = {'python': sys.version.split()[0], 'platform': sys.platform,
+        'cases': results}
+    if opts.output:
+        with open(opts.output, 'w') as fileobj:
+            json.dump(doc, fileobj, indent=1, sort_keys=True)
+
+    if opts.save_baseline:
+        with open(opts.baseline, 'w') as fileobj:
+            json.dump(doc, fileobj, indent=1, sort_keys=True)
+        print('Saved baseline to %s' % opts.baseline)
+        return 0
+
+    if not os.path.exists(opts.baseline):
+        print('No baseline at %s; nothing to compare.' % opts.baseline)
+        return 0
+    with open(opts.baseline) as fileobj:
+        baseline = json.load(fileobj)['cases']
+    regressions = compare(results, baseline, opts.tolerance,
+        opts.memory_tolerance)
+    for name, desc in regressions:
+        print('REGRESSION %s: %s' % (name, desc))
+    if regressions:
+        return 1
+    print('No regressions against %s' % opts.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1 +1,10 @@
 from . import constraints, geometry, materials, problem, _formats
+from .common import LazyModule
+
+# Analysis and utility modules are only imported when first used, so that
+# importing FEbabel stays quick.  The methods they add to FEproblem are
+# imported the same way (see FEproblem.__getattr__).
+for _name in ('sweep', 'memory', 'quality', 'adjacency', 'ordering',
+        'partition', 'compact', 'dedupe', 'refine', 'simplex'):
+    globals()[_name] = LazyModule('%s.%s' % (__name__, _name))
+del _name
@@ -1 +1,92 @@
-from . import feb, inp, cnfg
+"""
+Readers and writers for each file format.
+
+Each format's module adds its reader and writer to FEproblem (eg. read_inp
+and write_feb) when it is imported.  Modules are only imported when a file of
+their format is first read or written (see load), so importing FEbabel
+doesn't pay for every format.  A file's format is found from its extension,
+ignoring any compression suffix, or failing that, from the start of its
+contents (see sniff).
+"""
+from __future__ import with_statement
+import os
+from importlib import import_module
+
+from . import _common, _compress
+
+
+# Bytes read from the start of a file to recognize its format.
+SNIFF_SIZE = 4096
+
+# The module handling each format, by file extension, and a function telling
+# whether the start of a file's contents is in that format, or None.
+FORMATS = dict()
+
+def register(ext, module, sniffer=None):
+    """Registers the named module (a full module name) as reading and/or
+    writing files with the given extension (without its dot).  Importing the
+    module should add read_<ext> and/or write_<ext> methods to FEproblem.
+    sniffer, if given, is a function given the first SNIFF_SIZE bytes of a
+    file and returning whether they are in this format."""
+    FORMATS[ext] = (module, sniffer)
+
+
+def _first_line(head, comments=()):
+    "Returns the first line of text which isn't blank or a comment."
+    for line in head.splitlines():
+        line = line.strip()
+        if line and not line.startswith(comments):
+            return line
+    return ''
+
+def _sniff_inp(head):
+    # Every line of an .inp file outside of data lines is a keyword or
+    # comment, starting with "*".
+    return _first_line(head).startswith('*')
+
+def _sniff_cnfg(head):
+    line = _first_line(head, ('#', ';'))
+    return line.startswith('[') or line.startswith('INCLUDE ')
+
+register('feb', __name__ + '.feb', lambda head: '<febio_spec' in head)
+register('vtu', __name__ + '.vtu', lambda head: '<VTKFile' in head)
+register('inp', __name__ + '.inp', _sniff_inp)
+register('cnfg', __name__ + '.cnfg', _sniff_cnfg)
+
+
+
+def load(ext):
+    """Imports the module handling the given format (see FORMATS), adding its
+    reader and writer to FEproblem, and returns it.  Raises ValueError for
+    unknown formats."""
+    if ext not in FORMATS:
+        raise ValueError('Unknown file format "%s".' % ext)
+    return import_module(FORMATS[ext][0])
+
+
+def sniff(filename):
+    """Returns the format of the named file found from the start of its
+    contents, or None if no format recognizes it.  Compressed files are
+    decompressed first."""
+    with _compress.open(filename) as fileobj:
+        head = fileobj.read(SNIFF_SIZE)
+    for ext in sorted(FORMATS):
+        sniffer = FORMATS[ext][1]
+        if sniffer is not None and sniffer(head):
+            return ext
+    return None
+
+
+def format_of(filename, contents=True):
+    """Returns the format of the named file: its extension, ignoring any
+    compression suffix, if that is a known format.  Otherwise, if contents
+    is true, the file's contents are sniffed.  Raises ValueError if the
+    format isn't found."""
+    ext = os.path.splitext(_compress.split(filename)[0])[1][1:]
+    if ext in FORMATS:
+        return ext
+    if contents and os.path.isfile(filename):
+        found = sniff(filename)
+        if found is not None:
+            return found
+    raise ValueError('Unknown file format for "%s".' % filename)
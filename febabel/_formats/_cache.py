@@ -0,0 +1,183 @@
+"""
+A cache of parsed geometry files, shared by everything in the process.
+
+Configuration files often refer to the same large geometry file, and usually
+place it with the same transform.  Rather than parse and transform it again
+for each configuration, the resulting sets are kept here and each reader is
+handed a copy of them.
+
+Copies are made with tight loops rather than by re-parsing or deep-copying:
+every Node and Element is copied, since callers move and constrain nodes and
+give elements their own materials, but materials, constraints and other
+objects they refer to are shared.
+"""
+from __future__ import with_statement
+
+import os, hashlib
+from collections import OrderedDict
+try: import cPickle as pickle
+except ImportError: import pickle
+
+from .. import geometry as geo, constraints as con, common, instrument
+
+
+
+def file_key(filename):
+    """Returns a key identifying the current contents of a file: its absolute
+    path, size and modification time."""
+    st = os.stat(filename)
+    return (os.path.abspath(filename), st.st_size, st.st_mtime)
+
+
+
+def copy_sets(sets, nodes=True, memo=None):
+    """Returns a copy of a dict of sets, in which every Node and Element has
+    been replaced by a new copy, the Elements referring to the new Nodes.
+    Nodes' constraint dicts are copied, but all other objects (materials,
+    constraints, etc.) are shared with the original.
+    If nodes is false, only Elements are copied, and they refer to the same
+    Nodes.  memo, if given, is a dict to which each object copied is added,
+    relating it to its copy."""
+    # This is done in tight loops rather than with a generic recursive copy,
+    # since function call overhead would otherwise dominate.
+    if memo is None:
+        memo = dict()
+    contents = [ (name, s, list(s.itervalues() if isinstance(s, dict) else s))
+        for name, s in sets.iteritems() ]
+
+    Node, Element, ShellElement = geo.Node, geo.Element, geo.ShellElement
+    ConstraintDict = common.ConstraintDict
+    def copy_node(n):
+        new = Node.__new__(Node)
+        new._pos = n._pos[:]
+        new._constraints = ConstraintDict(n._constraints, new)
+        memo[n] = new
+        return new
+
+    for _, _, items in contents:
+        for e in items:
+            if e in memo:
+                continue
+            if isinstance(e, Node):
+                if nodes:
+                    copy_node(e)
+            elif isinstance(e, Element):
+                cls = e.__class__
+                new = cls.__new__(cls)
+                if nodes:
+                    new._nodes = [ memo[n] if n in memo else copy_node(n)
+                        for n in e._nodes ]
+                else:
+                    new._nodes = e._nodes[:]
+                new._material = e._material
+                if isinstance(e, ShellElement):
+                    new._thickness = e._thickness
+                if hasattr(e, '__dict__'):
+                    new.__dict__.update(e.__dict__)
+                memo[e] = new
+
+    get = memo.get
+    new_sets = dict()
+    for name, s, items in contents:
+        if isinstance(s, dict):
+            new = s.__class__()
+            for k,v in s.iteritems():
+                new[k] = get(v, v)
+        else:
+            new = s.__class__( get(x, x) for x in items )
+        new_sets[name] = new
+    return new_sets
+
+
+
+# Module-level objects that must keep their identity when pickled, since the
+# writers compare against them with "is".
+_persistent = {
+    'free': con.free,
+    'fixed': con.fixed,
+    'loadcurve_zero': con.loadcurve_zero,
+    'loadcurve_constant': con.loadcurve_constant,
+    'loadcurve_ramp': con.loadcurve_ramp,
+}
+_persistent_ids = dict( (id(v), k) for k,v in _persistent.iteritems() )
+
+
+class MeshCache(object):
+    """Keeps the sets produced by reading (and optionally transforming)
+    geometry files, and hands out copies of them while the file is unchanged
+    (same path, size and mtime).  At most size results are kept in memory,
+    the least recently used being dropped first, as are those of files which
+    have since changed.
+
+    If directory is given, the sets are also pickled into it, so they can be
+    reused by later processes."""
+
+    def __init__(self, directory=None, size=4):
+        self.directory = directory
+        self.size = size
+        self._sets = OrderedDict()
+
+    def clear(self):
+        "Forget all cached files.  Files on disk are left alone."
+        self._sets.clear()
+
+
+    def read(self, problem, filename, transform=None, transform_key=None):
+        """Add the sets of the given geometry file to problem, using the
+        cached copy if there is one.  The problem is given its own copy of
+        every node and element (see copy_sets), so they may be changed freely.
+
+        transform is an optional function taking a problem containing only
+        the freshly-read file, and modifying its nodes in place.
+        transform_key must then be a hashable value which is equal for equal
+        transforms, to tell cached results apart."""
+        key = (file_key(filename), transform_key)
+        # Results for earlier contents of the file won't be used again.
+        for old in self._sets.keys():
+            if old[0][0] == key[0][0] and old[0] != key[0]:
+                del self._sets[old]
+        sets = self._sets.pop(key, None)
+        if sets is None and self.directory is not None:
+            sets = self._load(key)
+        instrument.count('mesh cache hits', int(sets is not None))
+        if sets is None:
+            p = problem.__class__()
+            p.read(filename)
+            if transform is not None:
+                transform(p)
+            sets = p.sets
+            if self.directory is not None:
+                self._dump(key, sets)
+        self._sets[key] = sets
+        while len(self._sets) > self.size:
+            self._sets.popitem(last=False)
+        with instrument.phase('copy'):
+            problem.sets.update(copy_sets(sets))
+
+
+    def _path(self, key):
+        return os.path.join(self.directory,
+            '%s.pickle' % hashlib.md5(repr(key)).hexdigest())
+
+    def _load(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            up = pickle.Unpickler(f)
+            up.persistent_load = _persistent.__getitem__
+            return up.load()
+
+    def _dump(self, key, sets):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = self._path(key)
+        with open(path + '.tmp', 'wb') as f:
+            pk = pickle.Pickler(f, 2)
+            pk.persistent_id = lambda obj: _persistent_ids.get(id(obj))
+            pk.dump(sets)
+        os.rename(path + '.tmp', path)
+
+
+# The cache used by readers.  Set to None to disable caching.
+mesh_cache = MeshCache()
@@ -1,6 +1,7 @@
 """
 Data and structures that are useful to multiple format handling modules.
 """
+from .. import geometry as g
 
 
 # String used to combine filename and setname when reading in a file.
@@ -17,3 +18,55 @@ class ValsDict(dict):
     access to its values."""
     def __iter__(self):
         return self.itervalues()
+
+
+
+def _numbered(objects, sets, group):
+    """Returns a list of the given objects, numbered as in the files they
+    were read from where possible (ie: in the order of the integer keys of
+    ValsDicts named "<file>:<group>"), followed by any others."""
+    objects = set(objects)
+    ordered = list()
+    for name in sorted(sets):
+        s = sets[name]
+        if isinstance(s, ValsDict) and name.rsplit(SETSEP, 1)[-1] == group:
+            keys = sorted( (k for k in s.iterkeys() if k.isdigit()), key=int )
+            found = [ v for v in map(s.__getitem__, keys) if v in objects ]
+            ordered.extend(found)
+            objects.difference_update(found)
+    ordered.extend(objects)
+    return ordered
+
+
+def _nodes_and_elements(problem, element_nodes=True):
+    """Returns sets of all Nodes and Elements in the problem, as would be
+    found by get_descendants_sorted.  Sets usually hold nodes and elements
+    directly, so this is much faster than walking every object's children.
+    If element_nodes is False, only Nodes held outside of Elements are
+    returned."""
+    nodes, elements, others = set(), set(), set()
+    Node, Element = g.Node, g.Element
+    for s in problem.sets.itervalues():
+        for x in s:
+            if isinstance(x, Element):
+                elements.add(x)
+            elif isinstance(x, Node):
+                nodes.add(x)
+            elif x not in others:
+                # Search other objects (eg. contacts) for the nodes and
+                # elements they hold, without looking any further into those.
+                others.add(x)
+                stack = [x]
+                while stack:
+                    for d in stack.pop().get_children() or ():
+                        if isinstance(d, Element):
+                            elements.add(d)
+                        elif isinstance(d, Node):
+                            nodes.add(d)
+                        elif d not in others:
+                            others.add(d)
+                            stack.append(d)
+    if element_nodes:
+        for e in elements:
+            nodes.update(e._nodes)
+    return nodes, elements
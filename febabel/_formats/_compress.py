@@ -0,0 +1,140 @@
+"""
+Opens files which may be compressed, choosing the compression from their names.
+
+A file named eg. "knee.feb.gz" is a gzip-compressed .feb file; the compression
+suffix is stripped to find the format (see split), and the file is read or
+written through a gzip, bz2 or lzma stream (see open).  gzip output is
+compressed in blocks by several threads, as zlib runs without the GIL.
+"""
+from __future__ import with_statement
+import os, io, gzip, bz2, zlib, struct, time
+import __builtin__
+from collections import deque
+
+try: import lzma
+except ImportError:
+    try: from backports import lzma
+    except ImportError: lzma = None
+
+
+# Compression suffixes, and the default compression level for each.
+SUFFIXES = {'.gz': 6, '.bz2': 9, '.xz': 6}
+
+# Bytes of uncompressed data in each block compressed by a thread.
+BLOCK_SIZE = 1 << 20
+# Number of threads compressing gzip output; None for one per CPU.
+THREADS = None
+
+
+
+def split(filename):
+    """Returns the given file name without any compression suffix, and the
+    suffix (eg. ".gz"), or None if the file isn't compressed."""
+    base, ext = os.path.splitext(filename)
+    if ext.lower() in SUFFIXES:
+        return base, ext.lower()
+    return filename, None
+
+
+def open(filename, mode='rb', level=None, threads=None):
+    """Opens a file for reading (mode "r" or "rb") or writing ("w" or "wb"),
+    decompressing or compressing it if its name has a compression suffix.
+    level is the compression level used when writing, from 1 to 9, or None
+    for the default for the compression used.  gzip files are written by the
+    given number of threads (see THREADS).  Files are always binary."""
+    mode = mode.replace('b', '') + 'b'
+    if mode not in ('rb', 'wb'):
+        raise ValueError('Unsupported file mode "%s".' % mode)
+    suffix = split(filename)[1]
+    if suffix is None:
+        return __builtin__.open(filename, mode, 1<<20)
+    if level is None:
+        level = SUFFIXES[suffix]
+    elif not 1 <= level <= 9:
+        raise ValueError('Compression level must be from 1 to 9.')
+
+    if suffix == '.gz':
+        if mode == 'rb':
+            return io.BufferedReader(gzip.GzipFile(filename, mode), 1<<20)
+        if threads is None:
+            from multiprocessing import cpu_count
+            threads = THREADS or cpu_count()
+        if threads > 1:
+            return _GzipWriter(filename, level, threads)
+        return gzip.GzipFile(filename, mode, level)
+    elif suffix == '.bz2':
+        return bz2.BZ2File(filename, mode, 1<<20, level)
+    else:
+        if lzma is None:
+            raise ImportError('Reading or writing .xz files requires the '
+                'lzma module (backports.lzma with Python 2).')
+        if mode == 'rb':
+            return lzma.LZMAFile(filename, mode)
+        return lzma.LZMAFile(filename, mode, preset=level)
+
+
+
+def _member(data, level, mtime):
+    """Returns data compressed as a complete gzip member.  Members can be
+    joined into one gzip file, which decompresses to their data joined."""
+    c = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return b''.join(( b'\x1f\x8b\x08\x00', struct.pack('<I', mtime),
+        b'\x02' if level == 9 else b'\x04' if level == 1 else b'\x00',
+        b'\xff', c.compress(data), c.flush(),
+        struct.pack('<II', zlib.crc32(data) & 0xffffffff,
+            len(data) & 0xffffffff) ))
+
+
+class _GzipWriter(object):
+    """A file object writing a gzip file, with blocks of the data compressed
+    in parallel by a pool of threads, as by pigz.  Each block is written as
+    its own gzip member, so the result is read as usual by any gzip
+    reader."""
+
+    def __init__(self, filename, level, threads):
+        from multiprocessing.pool import ThreadPool
+        self.name = filename
+        self.level = level
+        self.closed = False
+        self._file = __builtin__.open(filename, 'wb')
+        self._pool = ThreadPool(threads)
+        self._threads = threads
+        self._mtime = int(time.time())
+        self._buffer, self._buffered = list(), 0
+        # Blocks being compressed, in the order they are to be written.
+        self._pending = deque()
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= BLOCK_SIZE:
+            self._flush_block()
+
+    def _flush_block(self):
+        data = b''.join(self._buffer)
+        self._buffer, self._buffered = list(), 0
+        self._pending.append(self._pool.apply_async(_member,
+            (data, self.level, self._mtime)))
+        # Bound the memory used when writing is faster than compressing.
+        while len(self._pending) > 2 * self._threads:
+            self._file.write(self._pending.popleft().get())
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self._buffered or not self._pending:
+                self._flush_block()
+            while self._pending:
+                self._file.write(self._pending.popleft().get())
+        finally:
+            self._pool.close()
+            self._pool.join()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -16,8 +16,10 @@ else:
     cp_kwargs = {}
 
 
-from .. import problem, geometry as geo, materials as mat, constraints as con
+from .. import problem, geometry as geo, materials as mat, constraints as con, \
+    instrument
 from ._common import SETSEP, NSET, ESET
+from . import _cache, _compress
 
 SEPCHAR = ','
 SEPCHAR2 = ';'
@@ -25,7 +27,7 @@ SEPCHAR2 = ';'
 MATL_HEADER = 'material-'
 
 DEFAULTS = 'defaults.cnfg'
-INCL_KEY = '\nINCLUDE '
+INCL_KEY = 'INCLUDE '
 
 
 # Relates each material type name that can appear in a cnfg file to a function
@@ -56,34 +58,100 @@ material_read_map = {
 
 
 
-def _accrue_cnfg(filename, visited=frozenset()):
-    "Returns the text of the given file, with all INCLUDEs swapped in."
-    # FIXME: This would really be better if it just used cp.read on each file.
+# Parsed configuration files, by absolute path: the key of the file parsed (see
+# _cache.file_key), and its contents as returned by _parse.  Batches of
+# configurations usually share files (at least defaults.cnfg), which are then
+# only parsed once.
+_parsed = dict()
+
+# The section given by _parse to options before any section header, which
+# belong to the section the file is INCLUDEd in.
+OUTER_SECTION = '<including section>'
+
+
+def _parse(filename):
+    """Returns the contents of a .cnfg file, in order, as a list of the files
+    it INCLUDEs, and of lists of (section, options) pairs for the text
+    between INCLUDEs, where options is a list of (name, value) pairs.  Each
+    INCLUDE is given as a (filename, section) pair, with the section it is
+    in.  Options before any section header are given in OUTER_SECTION.
+    Files are only parsed again once changed."""
+    key = _cache.file_key(filename)
+    cached = _parsed.get(key[0])
+    instrument.count('cnfg cache hits', int(cached is not None
+        and cached[0] == key))
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    with _compress.open(filename) as f:
+        lines = f.read().splitlines(True)
+    contents = list()
+    # Text following an INCLUDE continues the section it was in.
+    section = start_section = None
+    start = 0
+    for i, l in enumerate(lines + [INCL_KEY]):
+        if l.startswith(INCL_KEY):
+            segment = ['[%s]\n' % (start_section or OUTER_SECTION)] \
+                + lines[start:i]
+            contents.append(_parse_options(segment, filename))
+            if i < len(lines):
+                contents.append( (l[len(INCL_KEY):].strip(), section) )
+            start, start_section = i+1, section
+        else:
+            mo = ConfigParser.RawConfigParser.SECTCRE.match(l)
+            if mo:
+                section = mo.group('header')
+    _parsed[key[0]] = (key, contents)
+    return contents
+
+
+def _parse_options(lines, filename):
+    "Returns the (section, options) pairs given by lines of a .cnfg file."
+    cp = ConfigParser.RawConfigParser(**cp_kwargs)
+    cp.readfp(StringIO(''.join(lines)), filename)
+    options = list()
+    if cp.defaults():
+        options.append( (ConfigParser.DEFAULTSECT, cp.defaults().items()) )
+    for s in cp.sections():
+        options.append( (s, [ (k,v) for k,v in cp._sections[s].iteritems()
+            if k != '__name__' ]) )
+    return options
+
 
+def _load(cp, filename, visited=frozenset(), outer=None):
+    """Adds the options of a .cnfg file to the parser cp, with those of the
+    files it INCLUDEs in their place.  Options given again replace those
+    given earlier, as if the files' text were joined.  outer is the section
+    the file is INCLUDEd in, which takes any options before its first
+    section header."""
     # Check if this file has been seen already, which would indicate a loop.
-    if filename in visited:
+    path = os.path.abspath(filename)
+    if path in visited:
         warn('INCLUDE loop found in "%s".  Breaking out.' % filename)
-        return ''
-    visited = visited.union([filename])
-
-    with open(filename) as f:
-        text = '\n%s' % f.read()
-
-    incl_start = text.find(INCL_KEY)
-    while incl_start != -1:
-        # Parse out the filename, and find it relative to the current filename.
-        fname_start = incl_start + len(INCL_KEY)
-        incl_end = text.index('\n', fname_start)
-        incl_file = os.path.join( os.path.dirname(filename),
-            text[fname_start:incl_end].strip() )
-
-        # Insert file, along with all of its includes, in place of INCLUDE line.
-        text = '\n'.join( (text[:incl_start],
-            _accrue_cnfg(incl_file, visited), text[incl_end:]) )
-
-        incl_start = text.find(INCL_KEY)
-
-    return text
+        return
+    visited = visited.union([path])
+
+    for part in _parse(filename):
+        if isinstance(part, tuple):
+            # Included files are found relative to the including file.
+            name, section = part
+            _load(cp, os.path.join(os.path.dirname(filename), name), visited,
+                outer if section is None else section)
+            continue
+        for section, options in part:
+            if section == OUTER_SECTION:
+                if not options:
+                    continue
+                if outer is None:
+                    raise ConfigParser.MissingSectionHeaderError(filename, 1,
+                        '%s = %s' % options[0])
+                section = outer
+            if (section != ConfigParser.DEFAULTSECT
+                    and not cp.has_section(section)):
+                cp.add_section(section)
+            for k,v in options:
+                # Values are set raw, as if read from a file.
+                ConfigParser.RawConfigParser.set(cp, section, k, v)
 
 
 
@@ -91,35 +159,12 @@ def read(self, filename):
     """Read an Open Knee .cnfg file into the current problem."""
     import numpy as np
 
-    with open(os.path.join(os.path.dirname(filename), DEFAULTS)) as f:
-        text = '\n'.join(( f.read(), _accrue_cnfg(filename) ))
-    cp = ConfigParser.SafeConfigParser(**cp_kwargs)
-    cp.readfp(StringIO(text), filename=filename)
+    with instrument.phase('parse'):
+        cp = ConfigParser.SafeConfigParser(**cp_kwargs)
+        _load(cp, os.path.join(os.path.dirname(filename), DEFAULTS))
+        _load(cp, filename)
 
 
-    # Read in listed geometry source files.
-    geo_files = map(str.strip, cp.get('options', 'mesh').split(SEPCHAR))
-    for f in geo_files:
-        self.read(os.path.join(os.path.dirname(filename),f))
-
-    # If only one geometry file is specified, then its sets can be accessed
-    # in the config file directly by set name.  Otherwise, all sets must be
-    # accessed as "filename:setname".
-    # Note that str.startswith('') is always True.
-    geo_default = '%s:'%geo_files[0] if len(geo_files)==1 else ''
-
-
-    # The string that precedes all objects created in the cnfg file.
-    filename_key = os.path.basename(filename)
-
-
-    # Collect all nodes in the geometry source files.
-    # FIXME: Go through all sets created by each geo file, not just allnodes?
-    nodeset = set()
-    for f in geo_files:
-        nodeset.update( self.sets[SETSEP.join((f, NSET))] )
-    nodeset = list(nodeset)
-
     # Get transform points from config.
     trans = dict()
     for k in ('medial_f_cond', 'lateral_f_cond', 'proximal_femur',
@@ -147,35 +192,70 @@ def read(self, filename):
     RM = np.array( [e1_prime, e2_prime, e3_prime] ) / scale
     # Translation vector to bring to new origin.
     trans_vec = -(trans['distal_femur'] + trans['proximal_tibia']) / 2
-    # Now transform all those points!
-    # All points are offset by the translation vector.  The resulting point
-    # matrix is transposed, so each column represents one point.  This allows
-    # all points to be simultaneously multiplied by the rotation matrix.  The
-    # result is then transposed again to bring it back to one point per row.
-    new_nodeset = np.dot( RM, (np.array(nodeset) + trans_vec).T ).T
 
-    # Set all nodes to their new coordinates.
-    for node, pos in zip(nodeset, new_nodeset):
-        node.x, node.y, node.z = pos
+    def transform(p, geo_file):
+        "Transform all nodes read from geo_file into problem p."
+        # FIXME: Go through all sets created by each geo file, not just allnodes?
+        with instrument.phase('transform'):
+            nodeset = list(p.sets[SETSEP.join((geo_file, NSET))])
+            # All points are offset by the translation vector.  The resulting
+            # point matrix is transposed, so each column represents one point.
+            # This allows all points to be simultaneously multiplied by the
+            # rotation matrix.  The result is then transposed again to bring
+            # it back to one point per row.
+            new_nodeset = np.dot( RM,
+                (np.array([n._pos for n in nodeset]) + trans_vec).T ).T
+
+            # Set all nodes to their new coordinates.
+            for node, pos in zip(nodeset, new_nodeset):
+                node.x, node.y, node.z = pos
+
+
+    # Read in listed geometry source files, and transform them.  Many
+    # configurations share the same geometry and transform, so go through the
+    # mesh cache if it's enabled.
+    geo_files = map(str.strip, cp.get('options', 'mesh').split(SEPCHAR))
+    transform_key = (tuple(map(float, RM.flat)), tuple(map(float, trans_vec)))
+    for f in geo_files:
+        path = os.path.join(os.path.dirname(filename),f)
+        with instrument.phase('geometry'):
+            if _cache.mesh_cache is None:
+                self.read(path)
+                transform(self, f)
+            else:
+                _cache.mesh_cache.read(self, path,
+                    lambda p, f=f: transform(p, f), transform_key)
+
+    # If only one geometry file is specified, then its sets can be accessed
+    # in the config file directly by set name.  Otherwise, all sets must be
+    # accessed as "filename:setname".
+    # Note that str.startswith('') is always True.
+    geo_default = '%s:'%geo_files[0] if len(geo_files)==1 else ''
+
+
+    # The string that precedes all objects created in the cnfg file.
+    filename_key = os.path.basename(filename)
 
 
     # Create materials and apply to sets.
     materials = dict()
-    for s in cp.sections():
-        if s.startswith(MATL_HEADER):
-            params = dict(cp.items(s))
-            matl = material_read_map[ params['type'] ](params)
-
-            # Get the set name to which the material is being applied.
-            # If the given set name already specifies its originating file, go
-            # with it.  Otherwise (in a single-geometry config), add the geo
-            # file name to the set name.
-            eset = s[len(MATL_HEADER):]
-            materials[eset] = matl # For lookup when setting rigid constraints.
-            if not eset.startswith(geo_default):
-                eset = geo_default + eset
-            for elem in self.sets[eset]:
-                elem.material = matl
+    with instrument.phase('materials'):
+        for s in cp.sections():
+            if s.startswith(MATL_HEADER):
+                params = dict(cp.items(s))
+                matl = material_read_map[ params['type'] ](params)
+
+                # Get the set name to which the material is being applied.
+                # If the given set name already specifies its originating
+                # file, go with it.  Otherwise (in a single-geometry config),
+                # add the geo file name to the set name.
+                eset = s[len(MATL_HEADER):]
+                # For lookup when setting rigid constraints.
+                materials[eset] = matl
+                if not eset.startswith(geo_default):
+                    eset = geo_default + eset
+                for elem in self.sets[eset]:
+                    elem.material = matl
 
 
     # Set constraints.
@@ -282,7 +362,7 @@ def read(self, filename):
         except ValueError: pass
 
         values = map(str.strip, value.split(SEPCHAR))
-        nset = self.sets[geo_default + values[0]]
+        nset = list(self.sets[geo_default + values[0]])
         # Find given numbered node in the "allnodes" set of the given geometry
         # file.  If no geometry file is given (ie: there's only one), search
         # the geo_default allnodes set.
@@ -296,11 +376,17 @@ def read(self, filename):
         stiffness = float(values[2]) / len(nset)
         area = float(values[3])
 
-        springs = set(
-            geo.Spring([node, n],
-                mat.LinearIsotropic(area * stiffness/node.distance_to(n), 0))
-            for n in nset )
-        self.sets[SETSEP.join((filename_key, name))] = springs
+        # The springs join the node to each node in the set, and are kept as
+        # one block, with their stiffnesses as a field of their material.
+        with instrument.phase('springs'):
+            coords = np.array([ n._pos for n in nset ], float).reshape(-1, 3)
+            lengths = np.sqrt(((coords - node._pos)**2).sum(axis=1))
+            pairs = np.zeros( (len(nset), 2), np.intp )
+            pairs[:,1] = np.arange(1, len(nset)+1)
+            springs = geo.SpringBlock([node] + nset, pairs,
+                mat.LinearIsotropic(mat.Field(area * stiffness/lengths), 0))
+        instrument.count('spring elements', len(springs))
+        self.sets[SETSEP.join((filename_key, name))] = set([springs])
 
 
     # Set time controls.
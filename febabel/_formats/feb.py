@@ -1,13 +1,19 @@
 """
-Contains a method for writing an FEproblem to FEBio's .feb format.
+Contains methods for writing an FEproblem to FEBio's .feb format, and for
+reading .feb files into one.
 
 Supports .feb version 1.1.
 """
 
+from __future__ import with_statement
+import os, warnings
 from warnings import warn
-from itertools import chain
+from itertools import chain, count, izip
 
-from .. import geometry as geo, materials as mat, constraints as con, problem, common
+from .. import geometry as geo, materials as mat, constraints as con, problem, \
+    common, instrument
+from ._common import ValsDict, SETSEP, NSET, ESET, _numbered
+from . import _compress
 
 
 # Data for converting internal objects to FEBio's form.
@@ -69,9 +75,21 @@ loadcurve_extrap_map = {
 # Note that all current materials have their parameters named in the same way
 # as FEBio, so no conversions are yet necessary.
 def _params_feb(self):
-    return dict( (k, str(getattr(self, k))) for k in self.parameters )
+    d = dict()
+    for k in self.parameters:
+        v = getattr(self, k)
+        if isinstance(v, mat.Field):
+            _field_error(self, k)
+        d[k] = str(v)
+    return d
 mat.Material._params_feb = _params_feb
 
+def _field_error(material, name):
+    "Raises the error for a Field parameter where only a value can be written."
+    raise ValueError('Parameter %s of %s is a Field, which can only be '
+        'written for the material of a SpringBlock.'
+        % (name, material.__class__.__name__))
+
 # Ogden's parameters list requires it have a slightly different approach.
 def _params_feb_Ogden(self):
     d = dict()
@@ -134,180 +152,565 @@ mat.OrthoMaterial._params_feb = _params_Ortho
 
 
 
-def write(self, file_name_or_obj):
-    """Write out the current problem state to an FEBio .feb file.
-    NOTE: Not all nuances of the state can be fully represented."""
-
-    import xml.etree.ElementTree as etree
-
-    descendants = self.get_descendants_sorted()
-
-    e_root = etree.Element('febio_spec',
-        {'version': '1.1'})
-
-    e_control = etree.SubElement(e_root, 'Control')
-    # TODO: Control stuff.
-
-
-    e_material = etree.SubElement(e_root, 'Material')
-    matl_ids = dict()
-    matl_ids[None] = '0'
-    # Set of materials requiring per-element orientation data in ElementData.
-    matl_user_orient = set()
-
-    # FIXME: These material removals could potentially break something if the
-    # material is used both as a TransIsoElastic base and directly in an
-    # element.  If that happens, a KeyError will probably result.
-    #
-    # TransIsoElastic materials are not treated as wrappers in FEBio, so don't
-    # add their base materials to FEBio's list.
-    top_materials = set(descendants[mat.Material])
-    for m in descendants[mat.Material]:
-        if isinstance(m, mat.TransIsoElastic):
-            top_materials.discard(m.base)
-    # Spring elements have a very different approach to materials, so don't
-    # add them to FEBio's list either.
-    for e in descendants[geo.Element]:
-        if isinstance(e, geo.Spring):
+# Each rigid body degree of freedom and its corresponding FEBio tag.
+_rigid_dofs = zip(('x','y','z','Rx','Ry','Rz'),
+    ('trans_x', 'trans_y', 'trans_z', 'rot_x', 'rot_y', 'rot_z'))
+
+
+
+class _NoCache(dict):
+    "A section cache which never stores anything."
+    def __setitem__(self, key, value):
+        pass
+
+
+
+def _stable_order(objects, previous):
+    """Returns a list of objects, with any found in the previous list kept in
+    their previous order at the start, and any new ones appended after."""
+    objects = set(objects)
+    kept = [ o for o in previous if o in objects ]
+    if len(kept) < len(objects):
+        kept_set = set(kept)
+        kept.extend( o for o in objects if o not in kept_set )
+    return kept
+
+
+
+# The number of objects in each chunk of a section serialized in parallel.
+CHUNK_SIZE = 1 << 15
+
+# These format chunks of the Geometry section exactly as ElementTree would,
+# from plain lists which are cheap to send to other processes.
+
+def _format_nodes(first, coords):
+    """Returns the XML for a run of nodes numbered from first, given their
+    coordinates as one flat list."""
+    c = iter(coords)
+    return b''.join([ b'<node id="%d">%s,%s,%s</node>' % (i, x, y, z)
+        for i, x, y, z in izip(count(first), c, c, c) ])
+
+def _format_elements(first, kinds, table, connectivity):
+    """Returns the XML for a run of elements numbered from first.  kinds
+    gives each element's (tag, material ID, number of nodes) as a position
+    in table, and connectivity lists all their node IDs in turn."""
+    parts = list()
+    pos = 0
+    for i, kind in enumerate(kinds):
+        tag, mid, k = table[kind]
+        parts.append(b'<%s id="%d" mat="%s">%s</%s>' % (tag, first + i, mid,
+            ','.join(connectivity[pos:pos+k]), tag))
+        pos += k
+    return b''.join(parts)
+
+def _format_element_data(rows):
+    """Returns the XML for a run of ElementData elements, given each as (ID,
+    fiber vector or None, (shell thickness, number of nodes) or None)."""
+    parts = list()
+    for eid, fiber, thickness in rows:
+        parts.append(b'<element id="%s">' % eid)
+        if fiber is not None:
+            parts.append(b'<fiber>%s</fiber>' % ','.join(map(str, fiber)))
+        if thickness is not None:
+            parts.append(b'<thickness>%s</thickness>'
+                % ','.join( [str(thickness[0])]*thickness[1] ))
+        parts.append(b'</element>')
+    return b''.join(parts)
+
+
+def _format_springs(kind, ends, stiffness):
+    """Returns the XML for a run of springs of the given type, given the IDs
+    of the nodes at both ends of each spring in turn, and each spring's
+    stiffness."""
+    template = (b'<spring type="%s"><node>%%s,%%s</node><E>%%r</E></spring>'
+        % kind)
+    ends = iter(ends)
+    return b''.join( template % (a, b, E)
+        for (a, b), E in izip(izip(ends, ends), stiffness) )
+
+
+def _contents(x):
+    """Returns a copy of the attributes of x, including the contents of any
+    lists, dicts, sets and Fields among them, to compare with later."""
+    attrs = dict(getattr(x, '__dict__', ()))
+    for cls in type(x).__mro__:
+        for name in cls.__dict__.get('__slots__', ()):
+            if hasattr(x, name):
+                attrs[name] = getattr(x, name)
+    return dict( (k, _copied(v)) for k,v in attrs.iteritems() )
+
+def _copied(v):
+    "Returns a copy of any containers in v, which can be compared with v."
+    if isinstance(v, mat.Field):
+        v = v.values
+    if hasattr(v, 'tolist'):
+        return v.tolist()
+    if isinstance(v, dict):
+        return dict( (k, _copied(i)) for k,i in v.iteritems() )
+    if isinstance(v, (set, frozenset)):
+        return frozenset(v)
+    if isinstance(v, (list, tuple)):
+        return [ _copied(i) for i in v ]
+    return v
+
+
+def _stiffness(block):
+    "Returns a list of the stiffness of each spring in a SpringBlock."
+    E = block.material.E
+    if not isinstance(E, mat.Field):
+        return [E] * len(block)
+    E = E.values
+    return E.tolist() if hasattr(E, 'tolist') else list(E)
+
+
+
+class _Writer(object):
+    """Renders an FEproblem into the sections of a .feb file.
+
+    All IDs are assigned when the writer is created, so that each section can
+    then be rendered (or re-used from an earlier rendering) independently of
+    the others."""
+
+    # Top-level sections, in the order they appear in the file.  Each renders
+    # as a list of XML elements (or of strings of XML already serialized);
+    # empty sections render as an empty list, and Step renders as one element
+    # per step.
+    sections = ('Control', 'Material', 'Geometry', 'Boundary', 'Constraints',
+        'LoadData', 'Step')
+
+    # The parts of a problem (see FEproblem.generations) whose changes can
+    # alter each section.
+    section_parts = {
+        'Control': (),
+        'Material': ('materials',),
+        'Geometry': ('geometry',),
+        'Boundary': ('geometry', 'boundary'),
+        'Constraints': ('boundary',),
+        'LoadData': ('loaddata',),
+        'Step': ('geometry', 'boundary', 'steps'),
+    }
+
+    # The objects whose contents (see _contents) can alter each section, as
+    # their lists and dicts can be changed in place without being counted.
+    section_contents = {
+        'Material': ('materials', 'axes'),
+        'Geometry': ('axes',),
+        'Boundary': ('materials', 'contacts', 'spring_blocks'),
+        'LoadData': ('loadcurves',),
+        'Step': ('contacts', 'switches'),
+    }
+
+    # A multiprocessing pool, if sections with a _chunks_ method are to be
+    # serialized in parallel.
+    pool = None
+
+    def __init__(self, problem, previous=None, node_order=None,
+            element_order=None):
+        """If previous is the writer used for an earlier write of the same
+        problem, its IDs are kept for any objects still present, and new
+        objects are numbered after them.  If no objects have been added or
+        removed since, its rendered sections are also re-used wherever they
+        are still valid.
+
+        If node_order is "rcm", nodes are numbered in Reverse Cuthill-McKee
+        order (see ordering.rcm) instead, starting from the order they were
+        read in.  If element_order is "morton", elements, springs and the
+        facets of contact surfaces are sorted along a Morton curve (see
+        ordering.morton) instead."""
+        if node_order not in (None, 'rcm'):
+            raise ValueError('Unknown node order "%s".' % node_order)
+        if element_order not in (None, 'morton'):
+            raise ValueError('Unknown element order "%s".' % element_order)
+        self.element_order = element_order
+        import xml.etree.ElementTree as etree
+        self.etree = etree
+        with instrument.phase('descendants'):
+            descendants = self.descendants = problem.get_descendants_sorted()
+        self.generations = problem.generations
+
+        # Serialized sections, keyed by section name.  Each is stored with the
+        # key it was rendered under (see _section_key).
+        if previous is not None and previous.descendants == descendants:
+            self.cache = previous.cache
+        else:
+            self.cache = dict()
+        order = ( (lambda objects, attr: list(objects)) if previous is None
+            else (lambda objects, attr:
+                _stable_order(objects, getattr(previous, attr))) )
+
+        # FIXME: These material removals could potentially break something if
+        # the material is used both as a TransIsoElastic base and directly in
+        # an element.  If that happens, a KeyError will probably result.
+        #
+        # TransIsoElastic materials are not treated as wrappers in FEBio, so
+        # don't add their base materials to FEBio's list.
+        top_materials = set(descendants[mat.Material])
+        for m in descendants[mat.Material]:
+            if isinstance(m, mat.TransIsoElastic):
+                top_materials.discard(m.base)
+        # Spring elements have a very different approach to materials, so
+        # don't add them to FEBio's list either.
+        self.springs = [ e for e in descendants[geo.Element]
+            if isinstance(e, geo.Spring) ]
+        for e in self.springs:
             top_materials.discard(e.material)
-
-    for i,m in enumerate(top_materials):
-        mid = str(i+1)
-        # TODO: Some materials will have submaterials.  These will need to be
-        # created first (maybe?), then referenced by the wrapper material.
-        matl_ids[m] = mid
-
-        # Create matl, set its name and ID number.
-        e_mat = etree.SubElement(e_material, 'material', {'id':mid,
-            'type': m._name_feb})
-        # Create matl parameters.
-        # The _params_feb method returns a dictionary, with string keys.
-        for k,v in m._params_feb().iteritems():
-            e_param = etree.SubElement(e_mat, k)
-            if isinstance(v, basestring):
-                e_param.text = v
-
-            # If value is a tuple, first entry is 'type' attrib, second is text.
+        # Blocks of springs are written straight from their arrays.
+        self.spring_blocks = order( (x for x in descendants[None]
+            if isinstance(x, geo.SpringBlock)), 'spring_blocks' )
+        for b in self.spring_blocks:
+            top_materials.discard(b.material)
+
+        self.matl_ids = dict()
+        self.matl_ids[None] = '0'
+        self.top_materials = order(top_materials, 'top_materials')
+        for i,m in enumerate(self.top_materials):
+            self.matl_ids[m] = str(i+1)
+
+        # Set of materials requiring per-element orientation data in
+        # ElementData.  The parameters are only checked here, not kept, so
+        # don't warn about them until the Material section is rendered.
+        self.matl_user_orient = set()
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for m in self.top_materials:
+                for v in m._params_feb().itervalues():
+                    if not isinstance(v, basestring) and v[0] == 'user':
+                        self.matl_user_orient.add(m)
+
+        # Store the ID of each node in a dictionary indexed by node object for
+        # fast retrieval later.
+        self.nodes = order(descendants[geo.Node], 'nodes')
+        self.node_ids = dict( (n, str(i+1)) for i,n in enumerate(self.nodes) )
+
+        # Get list of only those elements that FEBio lists in the Elements
+        # section.
+        self.elements = order( (e for e in descendants[geo.Element]
+            if isinstance(e, (geo.SolidElement, geo.ShellElement))),
+            'elements' )
+        if element_order == 'morton':
+            from .. import ordering
+            with instrument.phase('sort elements'):
+                self.elements = ordering.morton(self.elements)
+                self.springs = ordering.morton(self.springs)
+        self.elem_ids = dict( (e, str(i+1))
+            for i,e in enumerate(self.elements) )
+
+        if node_order == 'rcm':
+            with instrument.phase('renumber'):
+                self._renumber_nodes(problem)
+        # Sections can only be re-used if every node and element kept its ID.
+        if previous is not None and (self.nodes != previous.nodes
+                or self.elements != previous.elements):
+            self.cache = dict()
+
+        # The free and fixed constraints are written without their loadcurve,
+        # so loadcurve_zero is only needed if something else uses it.
+        loadcurves = set(descendants[con.LoadCurve])
+        if con.loadcurve_zero in loadcurves and not any(
+                con.loadcurve_zero in (x.get_children() or ())
+                for x in chain(descendants[None], descendants[common.Switch])
+                if x is not con.free and x is not con.fixed ):
+            loadcurves.discard(con.loadcurve_zero)
+        self.loadcurves = order(loadcurves, 'loadcurves')
+        self.loadcurve_ids = dict( (lc, str(i+1))
+            for i,lc in enumerate(self.loadcurves) )
+
+        # Nodes and rigid bodies with switched constraints are written in each
+        # Step rather than globally.
+        self.switched_nodes = set( n for n in self.nodes if any(
+            isinstance(c, con.SwitchConstraint)
+            for c in n.constraints.itervalues() ) )
+        self.switched_rigid = set( m for m in self.top_materials
+            if isinstance(m, common.Constrainable) and any(
+                isinstance(c, con.SwitchConstraint)
+                for c in m.constraints.itervalues() ) )
+
+        # Separate switched contact interfaces from global ones.
+        self.switched_contact = ( descendants[con.Contact]
+            & descendants[common.Switch] )
+        self.global_contact = descendants[con.Contact] - self.switched_contact
+        for s in self.switched_contact:
+            for c in s.points.itervalues():
+                self.global_contact.discard(c)
+
+        self.tracked = {
+            'materials': descendants[mat.Material],
+            'axes': [ x for x in descendants[None]
+                if isinstance(x, mat.AxisOrientation) ],
+            'contacts': descendants[con.Contact],
+            'spring_blocks': self.spring_blocks,
+            'loadcurves': descendants[con.LoadCurve],
+            'switches': descendants[common.Switch],
+        }
+
+
+    def _renumber_nodes(self, problem):
+        """Renumbers the nodes in Reverse Cuthill-McKee order, reporting the
+        bandwidth and profile before and after as counts.  Nodes are left in
+        the order they were read in if that already has a smaller profile,
+        as with structured meshes."""
+        from .. import ordering
+        nodes = _numbered(self.nodes, problem.sets, NSET)
+        graph = ordering._Graph(nodes, self.elements + self.springs
+            + [ e for b in self.spring_blocks for e in b.springs() ])
+        before = graph.bandwidth()
+        order = graph.rcm()
+        after = graph.bandwidth(order)
+        if after[1] >= before[1]:
+            order, after = None, before
+        for when, (bandwidth, profile) in (('before', before),
+                ('after', after)):
+            instrument.count('bandwidth %s' % when, bandwidth)
+            instrument.count('profile %s' % when, profile)
+        self.nodes = nodes if order is None else [ nodes[i] for i in order ]
+        self.node_ids = dict( (n, str(i+1)) for i,n in enumerate(self.nodes) )
+
+
+    def render(self, section):
+        "Returns a list of the XML elements making up the given section."
+        return getattr(self, '_render_%s' % section)()
+
+    def serialize(self, section):
+        """Returns the given section as a UTF-8 encoded string, re-using an
+        earlier one if nothing it depends on has changed since."""
+        key = self._section_key(section)
+        if section in self.cache and self.cache[section][0] == key:
+            instrument.count('cached', 1)
+            return self.cache[section][1]
+        if self.pool is not None and hasattr(self, '_chunks_%s' % section):
+            with instrument.phase('parallel'):
+                text = self._serialize_parallel(section)
+        else:
+            tostring = self.etree.tostring
+            with instrument.phase('build'):
+                elements = self.render(section)
+            with instrument.phase('serialize'):
+                text = b''.join( e if isinstance(e, bytes)
+                    else tostring(e, 'utf-8') for e in elements )
+        self.cache[section] = (key, text)
+        return text
+
+    def _serialize_parallel(self, section):
+        """Returns the given section as a UTF-8 encoded string, with its
+        chunks formatted by the process pool while later ones are gathered."""
+        pieces = list()
+        for piece in getattr(self, '_chunks_%s' % section)():
+            if isinstance(piece, bytes):
+                pieces.append(piece)
             else:
-                e_param.set('type', v[0])
-                # Note if this material needs user orientation data.
-                if v[0] == 'user': matl_user_orient.add(m)
-
-                if isinstance(v[1], basestring):
-                    e_param.text = v[1]
-                # If second tuple value is a dict, these are parameters for the
-                # parameter (only vector ortho materials need this).
+                pieces.append(self.pool.apply_async(*piece))
+        return b''.join( p if isinstance(p, bytes) else p.get()
+            for p in pieces )
+
+    def _section_key(self, section):
+        """Returns a value which changes whenever anything the given section
+        depends on has changed."""
+        key = tuple( self.generations[p]
+            for p in self.section_parts[section] )
+        return key + tuple( dict( (x, _contents(x))
+            for x in self.tracked[name] )
+            for name in self.section_contents.get(section, ()) )
+
+    def write(self, file_name_or_obj, cached=None):
+        """Write out the .feb file to a file name or object.
+        cached is an optional dict of previously serialized sections, keyed
+        by section name, to use instead of rendering them again."""
+        if isinstance(file_name_or_obj, basestring):
+            with _compress.open(file_name_or_obj, 'wb') as fileobj:
+                return self.write(fileobj, cached)
+        if cached is None:
+            cached = dict()
+
+        write = file_name_or_obj.write
+        write(b"<?xml version='1.0' encoding='UTF-8'?>\n")
+        write(b'<febio_spec version="1.1">')
+        for section in self.sections:
+            with instrument.phase(section):
+                if section in cached:
+                    text = cached[section]
                 else:
-                    for kk, vv in v[1].iteritems():
-                        e_pp = etree.SubElement(e_param, kk)
-                        e_pp.text = vv
-
-
-    e_geometry = etree.SubElement(e_root, 'Geometry')
-    node_ids = dict()
-    elem_ids = dict()
-
-    # Write out all nodes.  In the process, store the ID of each in a
-    # dictionary indexed by node object for fast retrieval later.
-    e_nodes = etree.SubElement(e_geometry, 'Nodes')
-    for i,n in enumerate(descendants[geo.Node]):
-        nid = str(i+1)
-        e_node = etree.SubElement(e_nodes, 'node', {'id':nid})
-        e_node.text = ','.join( map(str,iter(n)) )
-        node_ids[n] = nid
-
-    e_elements = etree.SubElement(e_geometry, 'Elements')
-    # Get list of only those elements that FEBio lists in the Elements section.
-    elements = [ e for e in descendants[geo.Element]
-        if isinstance(e, (geo.SolidElement, geo.ShellElement)) ]
-    for i,e in enumerate(elements):
-        eid = str(i+1)
-        elem_ids[e] = eid
-        e_elem = etree.SubElement(e_elements, e._name_feb,
-            {'id':eid, 'mat':matl_ids[e.material]})
-        e_elem.text = ','.join( node_ids[n] for n in iter(e) )
-
-    e_elemdata = etree.SubElement(e_geometry, 'ElementData')
-    for e in ( e for e in descendants[geo.Element]
-        if isinstance(e, geo.ShellElement) or e.material in matl_user_orient ):
-
-        e_elem = etree.SubElement(e_elemdata, 'element', {'id':elem_ids[e]})
-        if e.material in matl_user_orient:
-            e_fiber = etree.SubElement(e_elem, 'fiber')
-            e_fiber.text = ','.join(map(str,e.material.axis.get_at_element(e)[0]))
-        if isinstance(e, geo.ShellElement):
-            # TODO: Per-node thickness.  Currently forces constant thickness
-            # throughout shell.
-            e_thick = etree.SubElement(e_elem, 'thickness')
-            e_thick.text = ','.join( [str(e.thickness)]*len(e) )
-    if len(e_elemdata) == 0:
-        e_geometry.remove(e_elemdata)
-
-
-    # Loadcurves must be processed before constraints, but the LoadData element
-    # comes later in the feb file.  Create the element here, then append later.
-    e_loaddata = etree.Element('LoadData')
-    loadcurve_ids = dict()
-    # FIXME: Includes loadcurve_zero, which is typically not necessary (but how
-    # do you know for certain?)
-    # FIXME: FEBio's behaviour with step interpolation is weird.  Possibly
-    # translate values to use a more sane form of step interpolation.
-    # TODO: A loadcurve is needed to set must points.  This will probably
-    # involve having some kind of must point object taking a loadcurve.
-    for i,lc in enumerate(descendants[con.LoadCurve]):
-        lcid = str(i+1)
-        loadcurve_ids[lc] = lcid
-        e_loadcurve = etree.SubElement( e_loaddata, 'loadcurve',
-            {'id': lcid,
-            'type': loadcurve_interp_map[lc.interpolation],
-            'extend': loadcurve_extrap_map[lc.extrapolation]} )
-        for time in sorted(lc.points.iterkeys()):
-            e_loadpoint = etree.SubElement(e_loadcurve, 'loadpoint')
-            e_loadpoint.text = '%s,%s' % (time, lc.points[time])
-
-
-    e_boundary = etree.SubElement(e_root, 'Boundary')
-
-    # Apply constraints on nodes.
-    e_prescribe = etree.SubElement(e_boundary, 'prescribe')
-    e_fix = etree.SubElement(e_boundary, 'fix')
-    e_force = etree.SubElement(e_boundary, 'force')
-    # TODO: All boundary conditions related to surfaces (pressure, flux, etc.)
-
-    switched_nodes = set()
-    for node,nid in node_ids.iteritems():
-        for dof,constraint in node.constraints.iteritems():
-            if constraint is con.free:
-                pass
-            elif constraint is con.fixed:
-                etree.SubElement(e_fix, 'node', {'id':nid, 'bc':dof})
-            elif isinstance(constraint, con.Displacement):
-                e = etree.SubElement(e_prescribe, 'node', {'id':nid, 'bc':dof,
-                    'lc':loadcurve_ids[constraint.loadcurve]})
-                e.text = repr(constraint.multiplier)
-            elif isinstance(constraint, con.Force):
-                e = etree.SubElement(e_force, 'node', {'id':nid, 'bc':dof,
-                    'lc':loadcurve_ids[constraint.loadcurve]})
-                e.text = repr(constraint.multiplier)
-            elif isinstance(constraint, con.SwitchConstraint):
-                switched_nodes.add(node) # We'll deal with this farther down.
-            else:
-                warn("Don't recognize constraint on node.")
-
+                    text = self.serialize(section)
+                write(text)
+                instrument.wrote('written', len(text))
+        write(b'</febio_spec>')
+
+
+    def _render_Control(self):
+        e_control = self.etree.Element('Control')
+        # TODO: Control stuff.
+        return [e_control]
+
+
+    def _render_Material(self):
+        etree = self.etree
+        e_material = etree.Element('Material')
+
+        for m in self.top_materials:
+            # TODO: Some materials will have submaterials.  These will need to
+            # be created first (maybe?), then referenced by the wrapper
+            # material.
+
+            # Create matl, set its name and ID number.
+            e_mat = etree.SubElement(e_material, 'material',
+                {'id':self.matl_ids[m], 'type': m._name_feb})
+            # Create matl parameters.
+            # The _params_feb method returns a dictionary, with string keys.
+            for k,v in m._params_feb().iteritems():
+                e_param = etree.SubElement(e_mat, k)
+                if isinstance(v, basestring):
+                    e_param.text = v
+
+                # If value is a tuple, first entry is 'type' attrib, second is
+                # text.
+                else:
+                    e_param.set('type', v[0])
+
+                    if isinstance(v[1], basestring):
+                        e_param.text = v[1]
+                    # If second tuple value is a dict, these are parameters for
+                    # the parameter (only vector ortho materials need this).
+                    else:
+                        for kk, vv in v[1].iteritems():
+                            e_pp = etree.SubElement(e_param, kk)
+                            e_pp.text = vv
+
+        return [e_material]
+
+
+    def _render_Geometry(self):
+        etree = self.etree
+        node_ids, elem_ids, matl_ids = (self.node_ids, self.elem_ids,
+            self.matl_ids)
+        e_geometry = etree.Element('Geometry')
+
+        # Write out all nodes.
+        e_nodes = etree.SubElement(e_geometry, 'Nodes')
+        for n in self.nodes:
+            e_node = etree.SubElement(e_nodes, 'node', {'id':node_ids[n]})
+            e_node.text = ','.join( map(str,iter(n)) )
+
+        e_elements = etree.SubElement(e_geometry, 'Elements')
+        for e in self.elements:
+            e_elem = etree.SubElement(e_elements, e._name_feb,
+                {'id':elem_ids[e], 'mat':matl_ids[e.material]})
+            e_elem.text = ','.join( node_ids[n] for n in iter(e) )
+
+        e_elemdata = etree.SubElement(e_geometry, 'ElementData')
+        matl_user_orient = self.matl_user_orient
+        for e in ( e for e in self.descendants[geo.Element]
+            if isinstance(e, geo.ShellElement) or e.material in matl_user_orient ):
+
+            e_elem = etree.SubElement(e_elemdata, 'element',
+                {'id':elem_ids[e]})
+            if e.material in matl_user_orient:
+                e_fiber = etree.SubElement(e_elem, 'fiber')
+                e_fiber.text = ','.join(map(str,
+                    e.material.axis.get_at_element(e)[0]))
+            if isinstance(e, geo.ShellElement):
+                # TODO: Per-node thickness.  Currently forces constant
+                # thickness throughout shell.
+                e_thick = etree.SubElement(e_elem, 'thickness')
+                e_thick.text = ','.join( [str(e.thickness)]*len(e) )
+        if len(e_elemdata) == 0:
+            e_geometry.remove(e_elemdata)
+
+        return [e_geometry]
+
+    def _chunks_Geometry(self):
+        """Yields the Geometry section in order, as strings and as (function,
+        arguments) giving the strings for chunks of nodes and elements.
+        Gives the same result as _render_Geometry."""
+        node_ids, elem_ids, matl_ids = (self.node_ids, self.elem_ids,
+            self.matl_ids)
+        yield b'<Geometry>'
+
+        # Nodes and elements are numbered in order, from 1.
+        if self.nodes:
+            yield b'<Nodes>'
+            for start in xrange(0, len(self.nodes), CHUNK_SIZE):
+                chunk = self.nodes[start:start+CHUNK_SIZE]
+                yield _format_nodes, (start + 1,
+                    list(chain.from_iterable( n._pos for n in chunk )))
+            yield b'</Nodes>'
+        else:
+            yield b'<Nodes />'
+
+        if self.elements:
+            yield b'<Elements>'
+            table, kinds = list(), dict()
+            for start in xrange(0, len(self.elements), CHUNK_SIZE):
+                chunk = self.elements[start:start+CHUNK_SIZE]
+                chunk_kinds = list()
+                for e in chunk:
+                    kind = kinds.get( (e.__class__, e._material) )
+                    if kind is None:
+                        kind = kinds[e.__class__, e._material] = len(table)
+                        table.append( (e._name_feb, matl_ids[e.material],
+                            len(e)) )
+                    chunk_kinds.append(kind)
+                yield _format_elements, (start + 1, chunk_kinds, list(table),
+                    [ node_ids[n] for e in chunk for n in e._nodes ])
+            yield b'</Elements>'
+        else:
+            yield b'<Elements />'
+
+        matl_user_orient = self.matl_user_orient
+        rows = list()
+        started = False
+        for e in ( e for e in self.descendants[geo.Element]
+            if isinstance(e, geo.ShellElement) or e.material in matl_user_orient ):
+            rows.append( (elem_ids[e],
+                e.material.axis.get_at_element(e)[0]
+                    if e.material in matl_user_orient else None,
+                (e.thickness, len(e)) if isinstance(e, geo.ShellElement)
+                    else None) )
+            if len(rows) == CHUNK_SIZE:
+                if not started:
+                    yield b'<ElementData>'
+                    started = True
+                yield _format_element_data, (rows,)
+                rows = list()
+        if rows:
+            if not started:
+                yield b'<ElementData>'
+                started = True
+            yield _format_element_data, (rows,)
+        if started:
+            yield b'</ElementData>'
+        yield b'</Geometry>'
+
+
+    def _render_node_constraint(self, nid, dof, constraint, e_prescribe,
+                                e_fix, e_force):
+        """Add the XML for one constraint on one node's degree of freedom to
+        the given prescribe, fix and force elements.
+        Returns False if the constraint is not recognized."""
+        etree = self.etree
+        if constraint is con.free:
+            pass
+        elif constraint is con.fixed:
+            etree.SubElement(e_fix, 'node', {'id':nid, 'bc':dof})
+        elif isinstance(constraint, con.Displacement):
+            e = etree.SubElement(e_prescribe, 'node', {'id':nid, 'bc':dof,
+                'lc':self.loadcurve_ids[constraint.loadcurve]})
+            e.text = repr(constraint.multiplier)
+        elif isinstance(constraint, con.Force):
+            e = etree.SubElement(e_force, 'node', {'id':nid, 'bc':dof,
+                'lc':self.loadcurve_ids[constraint.loadcurve]})
+            e.text = repr(constraint.multiplier)
+        else:
+            return False
+        return True
 
-    # Separate switched contact interfaces from global ones.
-    switched_contact = descendants[con.Contact] & descendants[common.Switch]
-    global_contact = descendants[con.Contact] - switched_contact
-    for s in switched_contact:
-        for c in s.points.itervalues():
-            global_contact.discard(c)
 
-    # Apply global contact interfaces.
-    for contact in global_contact:
-        e_contact = etree.SubElement(e_boundary, 'contact',
+    def _render_contact(self, parent, contact):
+        "Add the XML for a contact interface to the given parent element."
+        etree = self.etree
+        node_ids = self.node_ids
+        e_contact = etree.SubElement(parent, 'contact',
                                      {'type': contact._name_feb})
         if isinstance(contact, con.RigidInterface):
-            mid = matl_ids[contact.rigid_body]
+            mid = self.matl_ids[contact.rigid_body]
             for node in contact.nodes:
                 etree.SubElement(e_contact, 'node',
                                  {'id': node_ids[node], 'rb': mid})
@@ -318,216 +721,700 @@ def write(self, file_name_or_obj):
                 e.text = val
 
             # Define both contact surfaces.
-            e_master = etree.SubElement(e_contact, 'surface',{'type':'master'})
-            for i,elem in enumerate(contact.master):
-                e = etree.SubElement(e_master, elem._name_feb,
-                                     {'id': str(i+1)})
-                e.text = ','.join(node_ids[n] for n in iter(elem))
-
-            e_slave = etree.SubElement(e_contact, 'surface', {'type': 'slave'})
-            for i,elem in enumerate(contact.slave):
-                e = etree.SubElement(e_slave, elem._name_feb,
-                                     {'id': str(i+1)})
-                e.text = ','.join(node_ids[n] for n in iter(elem))
-
-
-    # Create spring elements.
-    for e in descendants[geo.Element] :
-        if not isinstance(e, geo.Spring):
-            continue
-        # TODO: Support for nonlinear springs.
-        e_spring = etree.SubElement(e_boundary, 'spring',
-            {'type': 'tension-only linear' if e.tension_only else 'linear'})
-        e_node = etree.SubElement(e_spring, 'node')
-        e_node.text = ','.join(node_ids[n] for n in iter(e))
-        if not isinstance(e.material, mat.LinearIsotropic):
-            warn('Support for nonlinear springs is not yet implemented.')
-        e_E = etree.SubElement(e_spring, 'E')
-        e_E.text = repr(e.material.E)
+            for surf_type, surface in (('master', contact.master),
+                                       ('slave', contact.slave)):
+                e_surf = etree.SubElement(e_contact, 'surface',
+                                          {'type': surf_type})
+                if self.element_order == 'morton':
+                    from .. import ordering
+                    surface = ordering.morton(surface)
+                for i,elem in enumerate(surface):
+                    e = etree.SubElement(e_surf, elem._name_feb,
+                                         {'id': str(i+1)})
+                    e.text = ','.join(node_ids[n] for n in iter(elem))
+
+
+    def _render_rigid_constraint(self, e_rigid, tag, constraint):
+        "Add the XML for one constraint on a rigid body to e_rigid."
+        e = self.etree.SubElement(e_rigid, tag)
+        if constraint is con.fixed:
+            e.set('type', 'fixed')
+        elif isinstance(constraint, con.Displacement):
+            e.set('type', 'prescribed')
+            e.set('lc', self.loadcurve_ids[constraint.loadcurve])
+            e.text = repr(constraint.multiplier)
+        elif isinstance(constraint, con.Force):
+            e.set('type', 'force')
+            e.set('lc', self.loadcurve_ids[constraint.loadcurve])
+            e.text = repr(constraint.multiplier)
+        else:
+            return False
+        return True
 
 
-    # Remove any sections that aren't needed.
-    for e in (e_prescribe, e_fix, e_force):
-        if len(e) == 0:
-            e_boundary.remove(e)
-    if len(e_boundary) == 0:
-        e_root.remove(e_boundary)
+    def _render_Boundary(self):
+        etree = self.etree
+        node_ids = self.node_ids
+        e_boundary = etree.Element('Boundary')
 
+        # Apply constraints on nodes.
+        e_prescribe = etree.SubElement(e_boundary, 'prescribe')
+        e_fix = etree.SubElement(e_boundary, 'fix')
+        e_force = etree.SubElement(e_boundary, 'force')
+        # TODO: All boundary conditions related to surfaces (pressure, flux,
+        # etc.)
 
-    # Apply constraints on rigid bodies.
-    e_constraints = etree.SubElement(e_root, 'Constraints')
+        for node in self.nodes:
+            nid = node_ids[node]
+            for dof,constraint in node.constraints.iteritems():
+                # Switched constraints are dealt with in each Step.
+                if isinstance(constraint, con.SwitchConstraint):
+                    continue
+                if not self._render_node_constraint(nid, dof, constraint,
+                                                    e_prescribe, e_fix, e_force):
+                    warn("Don't recognize constraint on node.")
+
+        # Apply global contact interfaces.
+        for contact in self.global_contact:
+            self._render_contact(e_boundary, contact)
+
+        # Create spring elements.
+        for e in self.springs:
+            # TODO: Support for nonlinear springs.
+            e_spring = etree.SubElement(e_boundary, 'spring',
+                {'type': 'tension-only linear' if e.tension_only else 'linear'})
+            e_node = etree.SubElement(e_spring, 'node')
+            e_node.text = ','.join(node_ids[n] for n in iter(e))
+            if not isinstance(e.material, mat.LinearIsotropic):
+                warn('Support for nonlinear springs is not yet implemented.')
+            if isinstance(e.material.E, mat.Field):
+                _field_error(e.material, 'E')
+            e_E = etree.SubElement(e_spring, 'E')
+            e_E.text = repr(e.material.E)
 
-    switched_rigid = set()
-    for matl,mid in matl_ids.iteritems():
-        if not isinstance(matl, common.Constrainable):
-            continue
-        e_rigid = etree.SubElement(e_constraints, 'rigid_body', {'mat':mid})
+        # Remove any sections that aren't needed.
+        for e in (e_prescribe, e_fix, e_force):
+            if len(e) == 0:
+                e_boundary.remove(e)
+
+        # Springs in blocks are formatted directly, after all the others.
+        blocks = [ self._format_spring_block(b) for b in self.spring_blocks
+            if len(b) ]
+        if blocks:
+            return [b'<Boundary>'] + list(e_boundary) + blocks + [
+                b'</Boundary>']
+        return [e_boundary] if len(e_boundary) else []
+
+    def _format_spring_block(self, block):
+        "Returns the XML for the springs in a SpringBlock."
+        if not isinstance(block.material, mat.LinearIsotropic):
+            warn('Support for nonlinear springs is not yet implemented.')
+        ids = [ self.node_ids[n] for n in block.nodes ]
+        pairs = block.pairs
+        if hasattr(pairs, 'ravel'):
+            pairs = pairs.ravel().tolist()
+        else:
+            pairs = chain.from_iterable(pairs)
+        return _format_springs(
+            'tension-only linear' if block.tension_only else 'linear',
+            [ ids[i] for i in pairs ], _stiffness(block) )
 
-        for dof,tag in zip(('x','y','z','Rx','Ry','Rz'),
-            ('trans_x', 'trans_y', 'trans_z', 'rot_x', 'rot_y', 'rot_z') ):
 
-            constraint = matl.constraints[dof]
+    def _render_Constraints(self):
+        # Apply constraints on rigid bodies.
+        etree = self.etree
+        e_constraints = etree.Element('Constraints')
 
-            if constraint is con.free:
-                continue
-            elif isinstance(constraint, con.SwitchConstraint):
-                switched_rigid.add(matl) # We'll deal with this farther down.
+        for matl in self.top_materials:
+            if not isinstance(matl, common.Constrainable):
                 continue
+            e_rigid = etree.SubElement(e_constraints, 'rigid_body',
+                {'mat':self.matl_ids[matl]})
 
-            e = etree.SubElement(e_rigid, tag)
-            if constraint is con.fixed:
-                e.set('type', 'fixed')
-            elif isinstance(constraint, con.Displacement):
-                e.set('type', 'prescribed')
-                e.set('lc', loadcurve_ids[constraint.loadcurve])
-                e.text = repr(constraint.multiplier)
-            elif isinstance(constraint, con.Force):
-                e.set('type', 'force')
-                e.set('lc', loadcurve_ids[constraint.loadcurve])
-                e.text = repr(constraint.multiplier)
-            else:
-                warn("Don't recognize constraint on rigid body.")
+            for dof,tag in _rigid_dofs:
+                constraint = matl.constraints[dof]
+                # Switched constraints are dealt with in each Step.
+                if (constraint is con.free or
+                    isinstance(constraint, con.SwitchConstraint)):
+                    continue
+                if not self._render_rigid_constraint(e_rigid, tag, constraint):
+                    warn("Don't recognize constraint on rigid body.")
 
-        # Remove rigid body constraints section if not needed.
-        if len(e_rigid) == 0:
-            e_constraints.remove(e_rigid)
+            # Remove rigid body constraints section if not needed.
+            if len(e_rigid) == 0:
+                e_constraints.remove(e_rigid)
 
-    # Remove Constraints section if not needed.
-    if len(e_constraints) == 0:
-        e_root.remove(e_constraints)
+        # Remove Constraints section if not needed.
+        return [e_constraints] if len(e_constraints) else []
 
 
-    # After Constraints element, insert LoadData element.
-    e_root.append(e_loaddata)
+    def _render_LoadData(self):
+        etree = self.etree
+        e_loaddata = etree.Element('LoadData')
+        # FIXME: FEBio's behaviour with step interpolation is weird.  Possibly
+        # translate values to use a more sane form of step interpolation.
+        # TODO: A loadcurve is needed to set must points.  This will probably
+        # involve having some kind of must point object taking a loadcurve.
+        for lc in self.loadcurves:
+            e_loadcurve = etree.SubElement( e_loaddata, 'loadcurve',
+                {'id': self.loadcurve_ids[lc],
+                'type': loadcurve_interp_map[lc.interpolation],
+                'extend': loadcurve_extrap_map[lc.extrapolation]} )
+            for time in sorted(lc.points.iterkeys()):
+                e_loadpoint = etree.SubElement(e_loadcurve, 'loadpoint')
+                e_loadpoint.text = '%s,%s' % (time, lc.points[time])
+        return [e_loaddata]
 
 
-    # Write out Steps.
+    def _render_Step(self):
+        etree = self.etree
+        steps = list()
 
-    # Parse all Switch objects to determine all the times at which they change
-    # state.  Iterate through all those time changes in order.
-    for time in sorted(set(chain(
-            *[s.points.iterkeys() for s in descendants[common.Switch]] ))):
+        # Parse all Switch objects to determine all the times at which they
+        # change state.  Iterate through all those time changes in order.
+        for time in sorted(set(chain( *[s.points.iterkeys()
+                for s in self.descendants[common.Switch]] ))):
 
-        e_step = etree.SubElement(e_root, 'Step')
+            e_step = etree.Element('Step')
+            steps.append(e_step)
 
-        # TODO: Control section.
+            # TODO: Control section.
 
 
-        # Boundary section for this step.
-        # (Mostly copy-pasted from global Boundary section.)
-        eS_boundary = etree.SubElement(e_step, 'Boundary')
+            # Boundary section for this step.
+            eS_boundary = etree.SubElement(e_step, 'Boundary')
 
-        eS_prescribe = etree.SubElement(eS_boundary, 'prescribe')
-        eS_fix = etree.SubElement(eS_boundary, 'fix')
-        eS_force = etree.SubElement(eS_boundary, 'force')
+            eS_prescribe = etree.SubElement(eS_boundary, 'prescribe')
+            eS_fix = etree.SubElement(eS_boundary, 'fix')
+            eS_force = etree.SubElement(eS_boundary, 'force')
 
-        for node in switched_nodes:
-            nid = node_ids[node]
-            for dof,constraint in node.constraints.iteritems():
-                if not isinstance(constraint, con.SwitchConstraint):
-                    continue
+            for node in self.switched_nodes:
+                nid = self.node_ids[node]
+                for dof,constraint in node.constraints.iteritems():
+                    if not isinstance(constraint, con.SwitchConstraint):
+                        continue
 
-                active = constraint.get_active(time)
-                if active is con.free:
-                    pass
-                elif active is con.fixed:
-                    etree.SubElement(eS_fix, 'node', {'id':nid, 'bc':dof})
-                elif isinstance(active, con.Displacement):
-                    e = etree.SubElement(eS_prescribe, 'node', {'id':nid,
-                        'bc':dof, 'lc':loadcurve_ids[active.loadcurve]})
-                    e.text = repr(active.multiplier)
-                elif isinstance(active, con.Force):
-                    e = etree.SubElement(eS_force, 'node', {'id':nid,
-                        'bc':dof, 'lc':loadcurve_ids[active.loadcurve]})
-                    e.text = repr(active.multiplier)
-                else:
-                    warn("Don't recognize constraint in switch on node.")
+                    active = constraint.get_active(time)
+                    if not self._render_node_constraint(nid, dof, active,
+                            eS_prescribe, eS_fix, eS_force):
+                        warn("Don't recognize constraint in switch on node.")
 
+            for contact in self.switched_contact:
+                active = contact.get_active(time)
+                if active is not None:
+                    self._render_contact(eS_boundary, active)
 
-        for contact in switched_contact:
-            active = contact.get_active(time)
-            if active is None:
-                continue
-            e_contact = etree.SubElement(eS_boundary, 'contact',
-                                         {'type': active._name_feb})
-            if isinstance(active, con.RigidInterface):
-                mid = matl_ids[active.rigid_body]
-                for node in active.nodes:
-                    etree.SubElement(e_contact, 'node',
-                                     {'id': node_ids[node], 'rb': mid})
-            else:
-                # Apply solution-specific options.
-                for opt,val in active.options.iteritems():
-                    e = etree.SubElement(e_contact, opt)
-                    e.text = val
-
-                # Define both contact surfaces.
-                e_master = etree.SubElement(e_contact, 'surface',{'type':'master'})
-                for i,elem in enumerate(active.master):
-                    e = etree.SubElement(e_master, elem._name_feb,
-                                         {'id': str(i+1)})
-                    e.text = ','.join(node_ids[n] for n in iter(elem))
+            # Remove any sections that aren't needed.
+            for e in (eS_prescribe, eS_fix, eS_force):
+                if len(e) == 0:
+                    eS_boundary.remove(e)
+            if len(eS_boundary) == 0:
+                e_step.remove(eS_boundary)
 
-                e_slave = etree.SubElement(e_contact, 'surface', {'type': 'slave'})
-                for i,elem in enumerate(active.slave):
-                    e = etree.SubElement(e_slave, elem._name_feb,
-                                         {'id': str(i+1)})
-                    e.text = ','.join(node_ids[n] for n in iter(elem))
 
+            # Constraints section for this step.
+            eS_constraints = etree.SubElement(e_step, 'Constraints')
 
-        # Remove any sections that aren't needed.
-        for e in (eS_prescribe, eS_fix, eS_force):
-            if len(e) == 0:
-                eS_boundary.remove(e)
-        if len(eS_boundary) == 0:
-            e_step.remove(eS_boundary)
+            for matl in self.switched_rigid:
+                eS_rigid = etree.SubElement(eS_constraints, 'rigid_body',
+                    {'mat':self.matl_ids[matl]})
 
+                for dof,tag in _rigid_dofs:
+                    constraint = matl.constraints[dof]
+                    if not isinstance(constraint, con.SwitchConstraint):
+                        continue
+                    active = constraint.get_active(time)
+                    if active is con.free:
+                        continue
+                    if not self._render_rigid_constraint(eS_rigid, tag, active):
+                        warn("Don't recognize constraint in switch on rigid body.")
 
-        # Constraints section for this step.
-        # (Mostly copy-pasted from global Constraints section.)
-        eS_constraints = etree.SubElement(e_step, 'Constraints')
+                # Remove rigid body constraints section if not needed.
+                if len(eS_rigid) == 0:
+                    eS_constraints.remove(eS_rigid)
 
-        for matl in switched_rigid:
-            mid = matl_ids[matl]
-            eS_rigid = etree.SubElement(eS_constraints, 'rigid_body', {'mat':mid})
+            # Remove Constraints section if not needed.
+            if len(eS_constraints) == 0:
+                e_step.remove(eS_constraints)
 
-            for dof,tag in zip(('x','y','z','Rx','Ry','Rz'),
-                ('trans_x', 'trans_y', 'trans_z', 'rot_x', 'rot_y', 'rot_z') ):
+        return steps
 
-                constraint = matl.constraints[dof]
-                if not isinstance(constraint, con.SwitchConstraint):
-                    continue
-                active = constraint.get_active(time)
-                if active is con.free:
-                    continue
 
-                e = etree.SubElement(eS_rigid, tag)
-                if active is con.fixed:
-                    e.set('type', 'fixed')
-                elif isinstance(active, con.Displacement):
-                    e.set('type', 'prescribed')
-                    e.set('lc', loadcurve_ids[active.loadcurve])
-                    e.text = repr(active.multiplier)
-                elif isinstance(active, con.Force):
-                    e.set('type', 'force')
-                    e.set('lc', loadcurve_ids[active.loadcurve])
-                    e.text = repr(active.multiplier)
-                else:
-                    warn("Don't recognize constraint in switch on rigid body.")
 
-            # Remove rigid body constraints section if not needed.
-            if len(eS_rigid) == 0:
-                eS_constraints.remove(eS_rigid)
+def write(self, file_name_or_obj, incremental=False, node_order=None,
+        element_order=None, processes=None):
+    """Write out the current problem state to an FEBio .feb file.
+    NOTE: Not all nuances of the state can be fully represented.
+
+    If incremental is True, the assigned IDs and rendered sections are kept
+    with the problem.  The next incremental write then keeps the same IDs for
+    the same objects, and only renders again those sections that depend on
+    objects changed since (see common.touch), or on lists and dicts whose
+    contents have changed.
+
+    If node_order is "rcm", nodes are renumbered to reduce the bandwidth of
+    the stiffness matrix, which speeds up FEBio's skyline and direct solvers.
+    The bandwidth and profile before and after are reported as instrument
+    counts.  If element_order is "morton", elements are sorted so that
+    neighbouring elements have nearby IDs, and so that their order is the
+    same from one run to the next.  Both options require NumPy.
+
+    If processes is given, the nodes, elements and element data are formatted
+    in chunks by a pool of that many processes (or one per CPU, if 0), which
+    is much faster for large problems on machines with several cores.  The
+    file written is the same either way."""
+    with instrument.phase('prepare'):
+        options = dict(node_order=node_order, element_order=element_order)
+        if incremental:
+            writer = _Writer(self, getattr(self, '_feb_writer', None),
+                **options)
+            self._feb_writer = writer
+            common.watch(self, 'feb', writer.descendants.values())
+        else:
+            writer = _Writer(self, **options)
+            # Nothing will be re-used, so don't keep rendered sections around.
+            writer.cache = _NoCache()
+    if processes is None:
+        writer.write(file_name_or_obj)
+        return
+    import multiprocessing
+    writer.pool = multiprocessing.Pool(processes or None)
+    try:
+        writer.write(file_name_or_obj)
+    except:
+        writer.pool.terminate()
+        raise
+    else:
+        writer.pool.close()
+    finally:
+        writer.pool.join()
+        writer.pool = None
 
-        # Remove Constraints section if not needed.
-        if len(eS_constraints) == 0:
-            e_step.remove(eS_constraints)
 
 
 
-    etree.ElementTree(e_root).write(file_name_or_obj, encoding='UTF-8')
+problem.FEproblem.write_feb = write
 
 
 
 
-problem.FEproblem.write_feb = write
+# Data for converting FEBio's names back to internal objects.
+
+element_read_map = {
+    'tet4': geo.Tet4,
+    'pent6': geo.Pent6,
+    'hex8': geo.Hex8,
+    'tri3': geo.Shell3,
+    'quad4': geo.Shell4,
+}
+surface_read_map = {
+    'tri3': geo.Surface3,
+    'quad4': geo.Surface4,
+}
+# TransIsoElastic is named after its base material, so isn't included.
+material_read_map = dict( (cls._name_feb, cls) for cls in (
+    mat.LinearIsotropic, mat.NeoHookean, mat.HolmesMow, mat.MooneyRivlin,
+    mat.VerondaWestmann, mat.ArrudaBoyce, mat.Ogden, mat.Rigid,
+    mat.LinearOrthotropic, mat.FungOrthotropic) )
+loadcurve_interp_read_map = dict( (v,k)
+    for k,v in loadcurve_interp_map.iteritems() )
+loadcurve_extrap_read_map = dict( (v,k)
+    for k,v in loadcurve_extrap_map.iteritems() )
+_rigid_dofs_read = dict( (tag,dof) for dof,tag in _rigid_dofs )
+_sliding_read_map = {
+    # Contact type: (biphasic, solute)
+    'facet-to-facet sliding': (False, False),
+    'sliding_with_gaps': (False, False),
+    'sliding2': (True, False),
+    'sliding3': (True, True),
+}
+
+
+def _floats(text):
+    return [ float(x) for x in text.split(',') ]
+
+def _arbitrary_axis(v):
+    "Returns a coordinate axis which is not parallel to vector v."
+    i = min(xrange(3), key=lambda i: abs(v[i]))
+    axis = [0,0,0]
+    axis[i] = 1
+    return axis
+
+
+
+class _Reader(object):
+    """Streams the sections of a .feb file into an FEproblem.
+
+    Each record (a node, an element, a material, a constraint, etc.) is
+    handled as soon as it has been parsed, then discarded, so only one record
+    is held in memory at a time rather than the whole document.
+
+    Constraints and contacts within Steps are collected as the file is read,
+    and turned into SwitchConstraints and SwitchContacts once it's done.  Each
+    Step starts when the last one ended, if their Control sections give their
+    durations, or one time unit after it if not."""
+
+    # Methods handling each record, by its path below the root element.  An
+    # element named '*' matches any element.
+    handlers = {
+        ('Control',): '_read_Control',
+        ('Material', 'material'): '_read_material',
+        ('Geometry', 'Nodes', 'node'): '_read_node',
+        ('Geometry', 'Elements', '*'): '_read_element',
+        ('Geometry', 'ElementData', 'element'): '_read_element_data',
+        ('Boundary', '*', 'node'): '_read_node_constraint',
+        ('Boundary', 'contact'): '_read_contact',
+        ('Boundary', 'spring'): '_read_spring',
+        ('Constraints', 'rigid_body'): '_read_rigid_body',
+        ('LoadData', 'loadcurve'): '_read_loadcurve',
+        ('Step', 'Control'): '_read_step_Control',
+        ('Step', 'Boundary', '*', 'node'): '_read_node_constraint',
+        ('Step', 'Boundary', 'contact'): '_read_contact',
+        ('Step', 'Constraints', 'rigid_body'): '_read_rigid_body',
+    }
+
+    def __init__(self, problem, name):
+        self.problem = problem
+        self.name = name
+
+        self.nodes = ValsDict()
+        self.elements = ValsDict()
+        self.materials = {'0': None}
+        self.loadcurves = dict()
+        self.springs = set()
+        self.contact = set()
+        # Elements whose material is defined after them, by material ID.
+        self.pending_materials = dict()
+
+        # Step start times, and the constraints and contacts active in each.
+        self.step = None
+        self.step_times = list()
+        self.step_duration = None
+        self.next_step_time = 0
+        self.switched = dict()
+        self.switched_contact = dict()
+
+
+    def read(self, source):
+        "Read the file name or object source into the problem."
+        if isinstance(source, basestring):
+            with _compress.open(source) as fileobj:
+                return self.read(fileobj)
+        try: from xml.etree.cElementTree import iterparse
+        except ImportError: from xml.etree.ElementTree import iterparse
+        handlers = self.handlers
+
+        path = list()
+        parents = list()
+        # Depth of the record currently being parsed, if any.  Its children
+        # are kept until the whole record has been parsed.
+        record_depth = None
+        for event, e in iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                if parents:
+                    path.append(e.tag)
+                    if record_depth is None and self._handler(path):
+                        record_depth = len(path)
+                    elif len(path) == 1 and e.tag == 'Step':
+                        self._start_Step()
+                parents.append(e)
+                continue
+
+            parents.pop()
+            if not parents:
+                break
+            if record_depth is None or record_depth == len(path):
+                if record_depth is not None:
+                    getattr(self, self._handler(path))(e, path)
+                    record_depth = None
+                elif len(path) == 1 and e.tag == 'Step':
+                    self._end_Step()
+                # Nothing more is needed from this element.
+                parents[-1].remove(e)
+            path.pop()
+
+        self._finish()
+
+    def _handler(self, path):
+        path = tuple(path)
+        return ( self.handlers.get(path) or
+            self.handlers.get(path[:-1] + ('*',)) or
+            self.handlers.get(path[:-2] + ('*', path[-1])) )
+
+
+    def _loadcurve(self, lc_id):
+        """Returns the loadcurve with the given ID.  Loadcurves are usually
+        defined after they are used, so an empty one is made to be filled in
+        later if it hasn't been seen yet."""
+        lc = self.loadcurves.get(lc_id)
+        if lc is None:
+            lc = self.loadcurves[lc_id] = con.LoadCurve(dict())
+        return lc
+
+    def _constraint(self, kind, e):
+        "Returns the constraint of the given kind described by XML element e."
+        if kind == 'fix' or kind == 'fixed':
+            return con.fixed
+        elif kind == 'prescribe' or kind == 'prescribed':
+            return con.Displacement(self._loadcurve(e.get('lc')), float(e.text))
+        elif kind == 'force':
+            return con.Force(self._loadcurve(e.get('lc')), float(e.text))
+        return None
+
+    def _set_constraint(self, obj, dof, constraint):
+        "Apply a constraint globally, or in the current step."
+        if self.step is None:
+            obj.constraints[dof] = constraint
+        else:
+            self.switched.setdefault((obj, dof), dict())[self.step] = constraint
+
+
+    def _read_Control(self, e, path):
+        time_steps = e.findtext('time_steps')
+        step_size = e.findtext('step_size')
+        if time_steps is None or step_size is None:
+            return
+        stepper = e.find('time_stepper')
+        min_step = max_step = None
+        if stepper is not None:
+            if stepper.findtext('dtmin') is not None:
+                min_step = float(stepper.findtext('dtmin'))
+            dtmax = stepper.find('dtmax')
+            if dtmax is not None:
+                if dtmax.get('lc') is not None:
+                    max_step = self._loadcurve(dtmax.get('lc'))
+                else:
+                    max_step = float(dtmax.text)
+        self.problem.timestepper = problem.TimeStepper(
+            float(time_steps) * float(step_size), float(step_size),
+            min_step, max_step )
+
+    def _read_step_Control(self, e, path):
+        time_steps = e.findtext('time_steps')
+        step_size = e.findtext('step_size')
+        if time_steps is not None and step_size is not None:
+            self.step_duration = float(time_steps) * float(step_size)
+
+    def _start_Step(self):
+        self.step = self.next_step_time
+        self.step_times.append(self.step)
+        self.step_duration = None
+
+    def _end_Step(self):
+        self.next_step_time = self.step + (self.step_duration
+            if self.step_duration is not None else 1)
+        self.step = None
+
+
+    def _read_axis(self, e):
+        "Returns the AxisOrientation described by a fiber or mat_axis element."
+        kind = e.get('type')
+        if kind == 'vector':
+            if e.find('a') is not None:
+                return mat.VectorOrientation(
+                    _floats(e.findtext('a')), _floats(e.findtext('d')) )
+            v = _floats(e.text)
+            return mat.VectorOrientation(v, _arbitrary_axis(v))
+        elif kind == 'spherical':
+            return mat.SphericalOrientation(_floats(e.text), (0,0,1))
+        elif kind == 'local':
+            n = [ int(x)-1 for x in e.text.split(',') ]
+            # Fibers only give one edge; the second is then arbitrary.
+            return mat.NodalOrientation( (n[0], n[1]),
+                (n[0], n[2] if len(n) > 2 else n[1]+1) )
+        elif kind == 'user':
+            return mat.ElementOrientation()
+        warn('Unrecognized axis type "%s".' % kind)
+        return None
+
+    def _make_material(self, name, params):
+        "Returns a material of the given FEBio type from its parameters."
+        cls = material_read_map.get(name)
+        if cls is None:
+            warn('Unrecognized material type "%s".' % name)
+            return None
+        value = lambda k: float(params[k].text)
+        if cls is mat.Ogden:
+            ci = [ value('c%s' % i) for i in xrange(1,7) if 'c%s' % i in params ]
+            mi = [ value('m%s' % i) for i in xrange(1,7) if 'm%s' % i in params ]
+            return mat.Ogden(ci, mi, value('k'))
+        elif cls is mat.Rigid:
+            com = params.get('center_of_mass')
+            return mat.Rigid( _floats(com.text) if com is not None else None,
+                value('density') if 'density' in params else None )
+
+        import inspect
+        args = inspect.getargspec(cls.__init__)[0][1:]
+        if issubclass(cls, mat.OrthoMaterial):
+            args.remove('axis')
+            return cls( axis=self._read_axis(params['mat_axis']),
+                **dict( (k, value(k)) for k in args ) )
+        return cls( **dict( (k, value(k)) for k in args ) )
+
+    def _read_material(self, e, path):
+        params = dict( (c.tag, c) for c in e )
+        name = e.get('type')
+        if name.startswith('trans iso '):
+            base = self._make_material(name[len('trans iso '):], params)
+            m = mat.TransIsoElastic( *[ float(params[k].text)
+                for k in ('c3', 'c4', 'c5', 'lam_max') ],
+                axis=self._read_axis(params['fiber']), base=base )
+        else:
+            m = self._make_material(name, params)
+        mid = e.get('id')
+        self.materials[mid] = m
+        for elem in self.pending_materials.pop(mid, ()):
+            elem.material = m
+
+
+    def _read_node(self, e, path):
+        self.nodes[e.get('id')] = geo.Node(_floats(e.text))
+
+    def _read_element(self, e, path):
+        nodes = self.nodes
+        mid = e.get('mat')
+        elem = element_read_map[e.tag]( [ nodes[i] for i in e.text.split(',') ],
+            self.materials.get(mid) )
+        if mid not in self.materials:
+            self.pending_materials.setdefault(mid, list()).append(elem)
+        self.elements[e.get('id')] = elem
+
+    def _read_element_data(self, e, path):
+        elem = self.elements[e.get('id')]
+        fiber = e.findtext('fiber')
+        if fiber is not None:
+            axis = getattr(elem.material, 'axis', None)
+            if isinstance(axis, mat.ElementOrientation):
+                axis.vectors[elem] = _floats(fiber)
+            else:
+                warn('Fiber given for element %s, whose material does not '
+                    'take them.' % e.get('id'))
+        thickness = e.findtext('thickness')
+        if thickness is not None:
+            # TODO: Per-node thickness.  Only the first node's is kept.
+            elem.thickness = _floats(thickness)[0]
+
+
+    def _read_node_constraint(self, e, path):
+        node = self.nodes[e.get('id')]
+        constraint = self._constraint(path[-2], e)
+        if constraint is None:
+            warn('Unrecognized boundary condition type "%s".' % path[-2])
+            return
+        bc = e.get('bc')
+        for dof in (bc if not bc.strip('xyz') else [bc]):
+            if dof not in node.constraints:
+                warn('Unsupported degree of freedom "%s" on node.' % dof)
+                continue
+            self._set_constraint(node, dof, constraint)
+
+    def _read_rigid_body(self, e, path):
+        matl = self.materials[e.get('mat')]
+        for c in e:
+            dof = _rigid_dofs_read.get(c.tag)
+            constraint = self._constraint(c.get('type'), c)
+            if dof is None or constraint is None:
+                warn('Unrecognized rigid body constraint "%s".' % c.tag)
+                continue
+            self._set_constraint(matl, dof, constraint)
+
+
+    def _read_contact(self, e, path):
+        if self.step is not None:
+            # The same contact appears in each step it is active, so identify
+            # it by its contents.
+            key = ( e.get('type'), tuple( (c.tag, tuple(sorted(c.items())),
+                c.text, tuple( (f.tag, f.text) for f in c )) for c in e ) )
+            if key in self.switched_contact:
+                self.switched_contact[key][1].add(self.step)
+                return
+        nodes = self.nodes
+        kind = e.get('type')
+        if kind == 'rigid':
+            node_list = e.findall('node')
+            contact = con.RigidInterface(
+                self.materials[node_list[0].get('rb')],
+                [ nodes[n.get('id')] for n in node_list ] )
+        else:
+            options = dict( (c.tag, c.text) for c in e if c.tag != 'surface' )
+            surfaces = dict( (s.get('type'), [ surface_read_map[f.tag](
+                    [ nodes[i] for i in f.text.split(',') ] ) for f in s ])
+                for s in e.findall('surface') )
+            master, slave = surfaces['master'], surfaces['slave']
+            if kind == 'tied':
+                contact = con.TiedContact(master, slave, options)
+            elif kind in _sliding_read_map:
+                biphasic, solute = _sliding_read_map[kind]
+                contact = con.SlidingContact(master, slave,
+                    float(options.get('fric_coeff', 0)), biphasic, solute,
+                    options)
+            else:
+                warn('Unrecognized contact type "%s".' % kind)
+                return
+
+        if self.step is None:
+            self.contact.add(contact)
+        else:
+            self.switched_contact[key] = (contact, set([self.step]))
+
+    def _read_spring(self, e, path):
+        nodes = self.nodes
+        self.springs.add(geo.Spring(
+            [ nodes[i] for i in e.findtext('node').split(',') ],
+            mat.LinearIsotropic(float(e.findtext('E')), 0),
+            tension_only=(e.get('type') == 'tension-only linear') ))
+
+
+    def _read_loadcurve(self, e, path):
+        lc = self._loadcurve(e.get('id'))
+        lc.points = dict( _floats(p.text) for p in e.findall('loadpoint') )
+        if e.get('type') is not None:
+            lc.interpolation = loadcurve_interp_read_map[e.get('type')]
+        if e.get('extend') is not None:
+            lc.extrapolation = loadcurve_extrap_read_map[e.get('extend')]
+
+
+    def _finish(self):
+        "Build switches from the steps, and add all sets to the problem."
+        for mid in self.pending_materials:
+            warn('Material %s is used but never defined.' % mid)
+
+        # Constraints not given in a step are free in that step.
+        for (obj, dof), points in self.switched.iteritems():
+            obj.constraints[dof] = con.SwitchConstraint( dict(
+                (t, points.get(t, con.free)) for t in self.step_times ) )
+        for contact, times in self.switched_contact.itervalues():
+            self.contact.add(con.SwitchContact( dict(
+                (t, contact if t in times else None)
+                for t in self.step_times ) ))
+
+        sets = self.problem.sets
+        name = self.name
+        sets[SETSEP.join((name, NSET))] = self.nodes
+        sets[SETSEP.join((name, ESET))] = self.elements
+        if self.springs:
+            sets[SETSEP.join((name, 'springs'))] = self.springs
+        if self.contact:
+            sets[SETSEP.join((name, 'contact'))] = self.contact
+        instrument.count('nodes', len(self.nodes))
+        instrument.count('elements', len(self.elements) + len(self.springs))
+
+
+
+def read(self, file_name_or_obj):
+    """Read an FEBio .feb file into the current problem.
+
+    The file is streamed, so that even very large files can be read without
+    holding them in memory.  Nodes and elements are kept in the sets
+    "<filename>:allnodes" and "<filename>:allelements", with the IDs from the
+    file as keys, and springs and contact interfaces are kept in
+    "<filename>:springs" and "<filename>:contact".
+    NOTE: Only what write_feb writes can be read, along with global time
+    stepping controls."""
+    if isinstance(file_name_or_obj, basestring):
+        name = os.path.basename(file_name_or_obj)
+    else:
+        name = os.path.basename(getattr(file_name_or_obj, 'name', 'feb'))
+    _Reader(self, name).read(file_name_or_obj)
+
+problem.FEproblem.read_feb = read
@@ -1,122 +1,395 @@
 """
-Contains a method for reading Abaqus's .inp format and to add to an FEproblem.
+Contains methods for reading Abaqus's .inp format and to add to an FEproblem,
+and for writing an FEproblem's geometry and sets to one.
 """
 from __future__ import with_statement
 import os
 from warnings import warn
+from array import array
+from itertools import izip
+from collections import namedtuple
 
-from .. import geometry as g, problem
-from ._common import ValsDict, SETSEP, NSET, ESET
+from .. import geometry as g, problem, instrument
+from ._common import ValsDict, SETSEP, NSET, ESET, _numbered, \
+    _nodes_and_elements
+from . import _compress
 
 
 element_read_map = {
+    'C3D4': g.Tet4,
+    'C3D6': g.Pent6,
     'C3D8': g.Hex8,
+    'S3': g.Shell3,
     'S4': g.Shell4,
-    # TODO: Add support for tetrahedra, triangular shells, others needed?
 }
+element_write_map = dict( (v,k) for k,v in element_read_map.iteritems() )
+
+# The nodes covered by each face of each element type, by face label.  Faces
+# are ordered with their normals pointing out of the element.
+# NOTE: Both sides of a shell give the same face.
+face_map = dict( (cls, dict( ('S%d' % (i+1), f)
+    for i,f in enumerate(cls.faces) )) for cls in (g.Tet4, g.Pent6, g.Hex8) )
+face_map[g.Shell3] = {'SPOS': (0,2,1), 'SNEG': (0,2,1)}
+face_map[g.Shell4] = {'SPOS': (0,3,2,1), 'SNEG': (0,3,2,1)}
+surface_map = {3: g.Surface3, 4: g.Surface4}
+
+
+def _keyword(line):
+    """Returns the keyword of a keyword line, and a dict of its parameters.
+    Keywords and parameter names are returned in upper case, as Abaqus
+    ignores their case."""
+    parts = line.strip()[1:].split(',')
+    params = dict()
+    for p in parts[1:]:
+        k, _, v = p.partition('=')
+        if k.strip():
+            params[k.strip().upper()] = v.strip()
+    return parts[0].strip().upper(), params
+
+
+def _set_ids(lines, generate):
+    """Returns the IDs listed in the data lines of a set.  If generate is
+    True, each line gives the first and last IDs of a range, and optionally
+    the increment between them."""
+    if not generate:
+        return [ i for i in ( i.strip() for i in ','.join(lines).split(',') )
+            if i ]
+    ids = list()
+    for l in lines:
+        v = [ int(i) for i in l.split(',') if i.strip() ]
+        ids.extend( str(i) for i in
+            xrange(v[0], v[1]+1, v[2] if len(v) > 2 else 1) )
+    return ids
+
+
+
+# Number of nodes or elements in each record given by iter_inp.
+READ_CHUNK = 1 << 12
+
+# The records given by iter_inp, with keyword parameters (params) as given by
+# _keyword.  A node, element or surface section gives a record for each chunk
+# of up to READ_CHUNK of its lines.  coords gives the nodes' coordinates in
+# turn, three to a node, and nodes gives the IDs of the elements' nodes in
+# turn, as many to an element as its type has.  keyword is "NSET" or "ELSET",
+# and faces gives the ID of the element and the face label of each surface
+# element.
+Nodes = namedtuple('Nodes', 'params ids coords')
+Elements = namedtuple('Elements', 'type params ids nodes')
+Set = namedtuple('Set', 'keyword name params ids')
+Surface = namedtuple('Surface', 'name params faces')
+Unrecognized = namedtuple('Unrecognized', 'keyword params line')
+
+
+def iter_inp(filename, chunk_size=READ_CHUNK):
+    """Parses a file in Abaqus's .inp format, generating a record (see
+    above) for each section, as read finds them, without building any nodes
+    or elements.  IDs are given as strings, as in the file.  Parsing stops
+    after giving an Unrecognized record for the first section that can't be
+    read.  Raises KeyError for unknown element types."""
+    with _compress.open(filename) as fileobj:
+        readline = fileobj.readline
+        l = readline()
+        while l != '':
+            # Skip comments.
+            if l.startswith('**'):
+                l = readline()
+                continue
+
+            # Time the parsing of each keyword's section separately, outside
+            # of whatever is done with the records.
+            line = l.strip()
+            keyword, params = _keyword(l)
+            l = readline()
+            if keyword == 'NODE' or (keyword == 'ELEMENT' and
+                    'TYPE' in params):
+                if keyword == 'ELEMENT':
+                    etype = params['TYPE'].upper()
+                    k = element_read_map[etype].n_nodes
+                while True:
+                    with instrument.phase(keyword):
+                        ids, data = list(), array('d') if keyword == 'NODE' \
+                            else list()
+                        while not (l.startswith('*') or l=='' or
+                                len(ids) == chunk_size):
+                            if keyword == 'NODE':
+                                v = l.split(',')
+                                ids.append(v[0].strip())
+                                data.extend(map(float, v[1:4]))
+                            else:
+                                v = [ i.strip() for i in l.split(',') ]
+                                ids.append(v[0])
+                                nodes = [ i for i in v[1:] if i ]
+                                if len(nodes) < k:
+                                    raise ValueError('Element %s has too few '
+                                        'nodes.' % v[0])
+                                data.extend(nodes[:k])
+                            l = readline()
+                    if keyword == 'NODE':
+                        yield Nodes(params, ids, data)
+                    else:
+                        yield Elements(etype, params, ids, data)
+                    if l.startswith('*') or l=='':
+                        break
+
+            elif (keyword == 'NSET' and 'NSET' in params) or (
+                    keyword == 'ELSET' and 'ELSET' in params):
+                with instrument.phase(keyword):
+                    lines = list()
+                    while not (l.startswith('*') or l==''):
+                        lines.append(l.strip())
+                        l = readline()
+                    ids = _set_ids(lines, 'GENERATE' in params)
+                yield Set(keyword, params[keyword], params, ids)
+
+            elif keyword == 'SURFACE' and 'NAME' in params:
+                # Each surface element is given by the element to which it's
+                # attached, and the specific face it covers.
+                while True:
+                    with instrument.phase(keyword):
+                        faces = list()
+                        while not (l.startswith('*') or l=='' or
+                                len(faces) == chunk_size):
+                            faces.append(tuple( i.strip()
+                                for i in l.split(',')[:2] ))
+                            l = readline()
+                    yield Surface(params['NAME'], params, faces)
+                    if l.startswith('*') or l=='':
+                        break
+
+            else:
+                yield Unrecognized(keyword, params, line)
+                return
+
 
 
 def read(self, filename):
     """Read a file in Abaqus's .inp format into the current problem.
-    NOTE: This cannot yet handle anything beyond brick and shell elements, and
-    who knows what other crazy features of the format."""
+    The file is parsed by iter_inp.
+    NOTE: This cannot yet handle anything beyond solid and shell elements,
+    and who knows what other crazy features of the format."""
 
     # TODO: Test if name is already used; modify it if so?
     name = os.path.basename(filename)
+    nset_name, eset_name = SETSEP.join((name,NSET)), SETSEP.join((name,ESET))
 
     # Store all sets defined in this file under a sub-dict.
     self.sets[name] = dict()
 
-    with open(filename) as fileobj:
-        l = fileobj.readline()
-        while l != '':
+    Node = g.Node
+    for record in iter_inp(filename):
+        kind = record.__class__
+        if kind is Nodes:
+            with instrument.phase('NODE'):
+                # Add nodes to the file's default nodeset.  Store them in a
+                # ValsDict so they can individually be accessed by the IDs
+                # given to them in the file.  Nodes (like elements) may be
+                # defined in multiple sections.
+                nodelist = self.sets.get(nset_name)
+                if nodelist is None:
+                    nodelist = self.sets[nset_name] = ValsDict()
+                c = iter(record.coords)
+                for file_id, x, y, z in izip(record.ids, c, c, c):
+                    nodelist[file_id] = Node((x, y, z))
 
-            if l.startswith('*NODE'):
-                # Parse node coordinates and add to file's default nodeset.
-                # Store nodes in a ValsDict so they can individually be accessed by
-                # the IDs given to them in the file.
-                nodelist = ValsDict()
-                self.sets[SETSEP.join((name,NSET))] = nodelist
-
-                l = fileobj.readline()
-                while not (l.startswith('*') or l==''):
-                    v = l.split(',')
-                    nodelist[v[0]] = g.Node( map(float, v[1:4]) )
-                    l = fileobj.readline()
-
-            elif l.startswith('*ELEMENT,TYPE='):
-                # Parse element.  Determine its type and nodes.
-                # Elements are defined in multiple sections, so don't overwrite the
-                # ValsDict if it already exists.
-                eset_name = SETSEP.join((name,ESET))
-                if eset_name in self.sets:
-                    elemlist = self.sets[eset_name]
-                else:
-                    elemlist = ValsDict()
-                    self.sets[eset_name] = elemlist
-                nodelist = self.sets[SETSEP.join((name,NSET))]
+        elif kind is Elements:
+            with instrument.phase('ELEMENT'):
+                elemlist = self.sets.get(eset_name)
+                if elemlist is None:
+                    elemlist = self.sets[eset_name] = ValsDict()
+                nodelist = self.sets[nset_name]
 
                 # TODO: Can shell element thickness be read from .inp files?
-                etype = element_read_map[ l.strip().split('=')[1] ]
-                l = fileobj.readline()
-                while not (l.startswith('*') or l==''):
-                    v = l.strip().split(',')
-                    elemlist[v[0]] = etype( nodelist[i] for i in v[1:] )
-                    l = fileobj.readline()
-
-            elif l.startswith('*NSET,NSET=') or l.startswith('*ELSET,ELSET='):
-                # Parse the named node and element sets.
-                # FIXME: Check that xset_name is not NSET or ESET.
-                xset_name = SETSEP.join((name, l.strip().split('=',1)[1]))
-                group = SETSEP.join((name, NSET if l.startswith('*NSET') else ESET))
-
-                l = fileobj.readline()
-                lines = list()
-                while not (l.startswith('*') or l==''):
-                    lines.append(l.strip())
-                    l = fileobj.readline()
-
-                self.sets[xset_name] = set( self.sets[group][i] for i in
-                    ''.join(lines).split(',') )
-
-            elif l.startswith('*SURFACE,NAME='):
-                # Parse surface set.
-                # Each surface element is defined by the element to which it's
-                # attached, and the specific face it covers.
-                # TODO: Support tetrahedra, triangular shells.
-                surflist = set()
-                self.sets[SETSEP.join((name, l.strip().split('=',1)[1]))] = surflist
-                elemlist = self.sets[SETSEP.join((name, ESET))]
+                etype = element_read_map[record.type]
+                k = etype.n_nodes
+                nodes = map(nodelist.__getitem__, record.nodes)
+                for i, file_id in enumerate(record.ids):
+                    elemlist[file_id] = etype(nodes[i*k:i*k+k])
+
+        elif kind is Set:
+            with instrument.phase(record.keyword):
+                # FIXME: Check that the set's name is not NSET or ESET.
+                group = self.sets[nset_name if record.keyword == 'NSET'
+                    else eset_name]
+                self.sets[SETSEP.join((name, record.name))] = set(
+                    map(group.__getitem__, record.ids) )
 
+        elif kind is Surface:
+            with instrument.phase('SURFACE'):
                 # Pick off the nodes covered by each surface element, then
                 # construct the surface element and add to the set.
-                l = fileobj.readline()
-                while not (l.startswith('*') or l==''):
-                    element, side = l.strip().split(',')
+                surflist = self.sets.setdefault(
+                    SETSEP.join((name, record.name)), set())
+                elemlist = self.sets[eset_name]
+                for element, side in record.faces:
                     e = elemlist[element]
-                    if side == 'S1' or side == 'SPOS' or side == 'SNEG':
-                        face = [ e[0], e[3], e[2], e[1] ]
-                    elif side == 'S2':
-                        face = [ e[4], e[5], e[6], e[7] ]
-                    elif side == 'S3':
-                        face = [ e[0], e[1], e[5], e[4] ]
-                    elif side == 'S4':
-                        face = [ e[1], e[2], e[6], e[5] ]
-                    elif side == 'S5':
-                        face = [ e[2], e[3], e[7], e[6] ]
-                    elif side == 'S6':
-                        face = [ e[0], e[4], e[7], e[3] ]
-                    else:
+                    face = face_map[e.__class__].get(side.upper())
+                    if face is None:
                         warn('Bad face identifier: %s' % side)
                         continue
                     # TODO: Have it detect and reuse Surface elements?
-                    surflist.add( g.Surface4(face) )
-                    l = fileobj.readline()
+                    surflist.add( surface_map[len(face)](
+                        [ e[i] for i in face ] ) )
 
+        else:
+            warn('Unrecognized section "%s".  Skipping remainder of file.'
+                % record.line)
 
-            else:
-                warn('Unrecognized section "%s".  Skipping remainder of file.'
-                    % l.strip())
-                break
+    for label, group in (('nodes', NSET), ('elements', ESET)):
+        instrument.count(label,
+            len(self.sets.get(SETSEP.join((name, group)), ())))
 
 problem.FEproblem.read_inp = read
+
+
+
+# Number of lines formatted at once when writing.
+CHUNK = 4096
+# Number of IDs per line in sets, which is the most Abaqus allows.
+IDS_PER_LINE = 16
+
+
+def _write_lines(fileobj, lines):
+    "Write an iterable of lines, formatting and writing CHUNK at a time."
+    chunk = list()
+    for l in lines:
+        chunk.append(l)
+        if len(chunk) == CHUNK:
+            fileobj.write(''.join(chunk))
+            del chunk[:]
+    fileobj.write(''.join(chunk))
+
+
+def _write_set(fileobj, keyword, name, ids):
+    """Write a *NSET or *ELSET of the given integer IDs.  Runs of consecutive
+    IDs are written as ranges with GENERATE, if that takes fewer lines."""
+    ids = sorted(ids)
+    runs = list()
+    for i in ids:
+        if runs and runs[-1][1] == i-1:
+            runs[-1][1] = i
+        else:
+            runs.append([i, i])
+    if len(runs) < (len(ids) + IDS_PER_LINE - 1) // IDS_PER_LINE:
+        fileobj.write('*%s,%s=%s,GENERATE\n' % (keyword, keyword, name))
+        _write_lines(fileobj, ( '%d,%d,1\n' % (a, b) for a,b in runs ))
+    else:
+        fileobj.write('*%s,%s=%s\n' % (keyword, keyword, name))
+        ids = map(str, ids)
+        _write_lines(fileobj, ( ','.join(ids[i:i+IDS_PER_LINE]) + '\n'
+            for i in xrange(0, len(ids), IDS_PER_LINE) ))
+
+
+def _set_names(names):
+    """Returns a dict giving the name to write for each set name.  Names are
+    written without the file name they were read from if that leaves them
+    unique; otherwise SETSEP is replaced."""
+    short = dict( (n, n.split(SETSEP, 1)[-1]) for n in names )
+    if len(set(short.itervalues())) < len(short):
+        return dict( (n, n.replace(SETSEP, '_')) for n in names )
+    return short
+
+
+
+def write(self, file_name_or_obj, element_order=None):
+    """Write the current problem's nodes, solid and shell elements, and sets
+    of nodes, elements and surfaces to an Abaqus .inp file.
+
+    Nodes and elements are numbered from 1, those read from .inp files in the
+    order of the IDs they were read with, so IDs with gaps are closed up.
+    Each set of only nodes, only solid and shell elements, or only surface
+    elements is written as a *NSET, *ELSET or *SURFACE.  Other sets, and the
+    "allnodes" and "allelements" sets made when reading files, are left out.
+
+    If element_order is "morton", elements are renumbered, and surfaces'
+    faces listed, along a Morton curve through their centroids instead (see
+    ordering.morton), which requires NumPy.
+    NOTE: Materials, constraints, contacts and springs are not written."""
+    if element_order not in (None, 'morton'):
+        raise ValueError('Unknown element order "%s".' % element_order)
+    if isinstance(file_name_or_obj, basestring):
+        with _compress.open(file_name_or_obj, 'wb') as fileobj:
+            return write(self, fileobj, element_order)
+    fileobj = file_name_or_obj
+    if element_order == 'morton':
+        from ..ordering import morton
+
+    with instrument.phase('numbering'):
+        nodes, elements = _nodes_and_elements(self)
+        nodes = _numbered(nodes, self.sets, NSET)
+        node_ids = dict( (n, str(i+1)) for i,n in enumerate(nodes) )
+        elements = _numbered( (e for e in elements
+            if e.__class__ in element_write_map), self.sets, ESET )
+        if element_order == 'morton':
+            elements = morton(elements)
+        elem_ids = dict( (e, i+1) for i,e in enumerate(elements) )
+
+    with instrument.phase('*NODE'):
+        fileobj.write('*NODE\n')
+        _write_lines(fileobj, ( '%s,%r,%r,%r\n' % (node_ids[n], x, y, z)
+            for n in nodes for x,y,z in (n._pos,) ))
+
+    # Write each type of element in a separate section.
+    with instrument.phase('*ELEMENT'):
+        by_type = dict()
+        for e in elements:
+            by_type.setdefault(e.__class__, list()).append(e)
+        for cls in sorted(by_type, key=lambda cls: element_write_map[cls]):
+            fileobj.write('*ELEMENT,TYPE=%s\n' % element_write_map[cls])
+            _write_lines(fileobj, ( '%d,%s\n' % (elem_ids[e],
+                ','.join([ node_ids[n] for n in e._nodes ]))
+                for e in by_type[cls] ))
+
+    # Sort sets by their contents.
+    nsets, esets, surfaces = list(), list(), list()
+    for name, s in sorted(self.sets.iteritems()):
+        if (not s or name.rsplit(SETSEP, 1)[-1] in (NSET, ESET)
+                or name in (NSET, ESET)):
+            continue
+        if all( isinstance(x, g.Node) for x in s ):
+            nsets.append(name)
+        elif all( x in elem_ids for x in s ):
+            esets.append(name)
+        elif all( isinstance(x, g.SurfaceElement) for x in s ):
+            surfaces.append(name)
+    names = _set_names(nsets + esets + surfaces)
+
+    with instrument.phase('*NSET'):
+        for name in nsets:
+            _write_set(fileobj, 'NSET', names[name],
+                [ int(node_ids[n]) for n in self.sets[name] ])
+    with instrument.phase('*ELSET'):
+        for name in esets:
+            _write_set(fileobj, 'ELSET', names[name],
+                [ elem_ids[e] for e in self.sets[name] ])
+
+    if not surfaces:
+        return
+    with instrument.phase('*SURFACE'):
+        # Find each surface element's face by its nodes, checking only those
+        # elements touching a surface.
+        surface_nodes = set()
+        for name in surfaces:
+            for s in self.sets[name]:
+                surface_nodes.update(s)
+        faces = dict()
+        for e in elements:
+            if surface_nodes.isdisjoint(e._nodes):
+                continue
+            for label, face in sorted(face_map[e.__class__].iteritems()):
+                if label != 'SNEG':
+                    faces.setdefault(frozenset( e[i] for i in face ),
+                        '%d,%s\n' % (elem_ids[e], label))
+        for name in surfaces:
+            fileobj.write('*SURFACE,NAME=%s\n' % names[name])
+            lines = list()
+            for s in ( morton(self.sets[name]) if element_order == 'morton'
+                    else self.sets[name] ):
+                face = faces.get(frozenset(s))
+                if face is None:
+                    warn('Surface element %r is not the face of any element.'
+                        % s)
+                else:
+                    lines.append(face)
+            _write_lines(fileobj, lines)
+
+problem.FEproblem.write_inp = write
@@ -0,0 +1,174 @@
+"""
+Converts Abaqus .inp files to FEBio .feb files without building a problem.
+
+A reader process parses the .inp file and passes chunks of plain node and
+element data through a bounded queue, while this process formats each chunk
+and writes it out.  Parsing and writing so overlap, and conversion takes little
+longer than the slower of the two.
+
+The result is the same as reading the file into an empty problem and writing
+that (see inp.read and feb.write), except that nodes and elements are numbered
+in the order they appear in the .inp file.  .inp files give no materials,
+constraints or contact, so every section but Geometry is as for an empty
+problem.
+"""
+from __future__ import with_statement
+import os
+from warnings import warn
+
+from .. import geometry as g, problem, instrument
+from . import feb, inp, _compress
+
+
+# Number of nodes or elements in each chunk passed between processes.
+CHUNK_SIZE = 1 << 14
+# Number of chunks which may wait in the queue, bounding the memory used when
+# reading is faster than writing.
+QUEUE_SIZE = 16
+
+
+
+def _read_chunks(filename, queue):
+    """Parses an .inp file with inp.iter_inp, putting chunks of its nodes and
+    elements on the queue, as read.inp would read them.  Puts ('nodes', IDs,
+    coordinates), ('elements', type, IDs, node IDs), ('warning', message) or
+    ('error', exception), and None once done."""
+    def put(kind, *args):
+        queue.put( (kind,) + args )
+
+    try:
+        # Sets aren't written to .feb files.
+        for record in inp.iter_inp(filename, CHUNK_SIZE):
+            if isinstance(record, inp.Nodes):
+                put('nodes', record.ids, record.coords)
+            elif isinstance(record, inp.Elements):
+                put('elements', record.type, record.ids, record.nodes)
+            elif isinstance(record, inp.Unrecognized):
+                put('warning', 'Unrecognized section "%s".  Skipping '
+                    'remainder of file.' % record.line)
+    except Exception as e:
+        put('error', e)
+    queue.put(None)
+
+
+
+def convert(inp_filename, file_name_or_obj, compresslevel=None):
+    """Converts an .inp file to a .feb file, given by name or file object,
+    reading the .inp file in another process while the .feb file is
+    written.  Either file may be compressed (see _compress.open), and
+    compresslevel is the level the .feb file is compressed at, if it is.
+    A .feb file given by name is written under a temporary name, and only
+    renamed once complete, so a failed conversion leaves no file behind."""
+    if isinstance(file_name_or_obj, basestring):
+        # The temporary name keeps any compression suffix.
+        base, suffix = _compress.split(file_name_or_obj)
+        temp = base + '.tmp' + (suffix or '')
+        try:
+            with _compress.open(temp, 'wb', compresslevel) as fileobj:
+                convert(inp_filename, fileobj)
+        except:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        os.rename(temp, file_name_or_obj)
+        return
+
+    import multiprocessing
+    queue = multiprocessing.Queue(QUEUE_SIZE)
+    reader = multiprocessing.Process(target=_read_chunks,
+        args=(inp_filename, queue))
+    reader.daemon = True
+    reader.start()
+    try:
+        _write(queue, file_name_or_obj.write)
+    except:
+        # The reader may be waiting for room in the queue.
+        reader.terminate()
+        raise
+    finally:
+        reader.join()
+
+
+def _format_elements(chunk, table, node_ids):
+    """Returns the XML for a chunk of elements, given as the ID of the first,
+    their kinds and the file IDs of their nodes, as for feb._format_elements.
+    Raises KeyError if any of their nodes hasn't been given an ID yet."""
+    first, kinds, nodes = chunk
+    return feb._format_elements(first, kinds, table,
+        [ node_ids[i] for i in nodes ])
+
+
+def _write(queue, write):
+    "Writes the .feb file from the chunks put on the queue by _read_chunks."
+    # Everything but the nodes and elements is as for an empty problem.
+    writer = feb._Writer(problem.FEproblem())
+    write(b"<?xml version='1.0' encoding='UTF-8'?>\n")
+    write(b'<febio_spec version="1.1">')
+    for section in ('Control', 'Material'):
+        write(writer.serialize(section))
+
+    # Nodes are written as they arrive, but elements are kept until every
+    # node has been.  Chunks of elements are formatted as they arrive if all
+    # their nodes have been, and otherwise once every node has, as .inp files
+    # can define nodes after elements.
+    node_ids = dict()
+    elements, shells = list(), list()
+    table, kinds = list(), dict()
+    n_elements = 0
+    write(b'<Geometry>')
+    with instrument.phase('convert'):
+        for chunk in iter(queue.get, None):
+            kind = chunk[0]
+            if kind == 'nodes':
+                ids, coords = chunk[1:]
+                if not ids:
+                    continue
+                first = len(node_ids) + 1
+                if first == 1:
+                    write(b'<Nodes>')
+                for i, file_id in enumerate(ids):
+                    node_ids[file_id] = str(first + i)
+                write(feb._format_nodes(first, coords))
+            elif kind == 'elements':
+                etype, ids, nodes = chunk[1:]
+                cls = inp.element_read_map[etype]
+                if cls not in kinds:
+                    kinds[cls] = len(table)
+                    table.append( (cls._name_feb, '0', cls.n_nodes) )
+                first = n_elements + 1
+                n_elements += len(ids)
+                pending = (first, [kinds[cls]] * len(ids), nodes)
+                try:
+                    elements.append(_format_elements(pending, table,
+                        node_ids))
+                except KeyError:
+                    elements.append(pending)
+                if issubclass(cls, g.ShellElement):
+                    shells.extend( (str(i), None, (0.0, cls.n_nodes))
+                        for i in xrange(first, first + len(ids)) )
+            elif kind == 'warning':
+                warn(chunk[1])
+            else:
+                raise chunk[1]
+
+    write(b'</Nodes>' if node_ids else b'<Nodes />')
+    if n_elements:
+        write(b'<Elements>')
+        for text in elements:
+            if not isinstance(text, bytes):
+                text = _format_elements(text, table, node_ids)
+            write(text)
+        write(b'</Elements>')
+    else:
+        write(b'<Elements />')
+    if shells:
+        write(b'<ElementData>')
+        write(feb._format_element_data(shells))
+        write(b'</ElementData>')
+    write(b'</Geometry>')
+    instrument.count('nodes', len(node_ids))
+    instrument.count('elements', n_elements)
+
+    for section in ('Boundary', 'Constraints', 'LoadData', 'Step'):
+        write(writer.serialize(section))
+    write(b'</febio_spec>')
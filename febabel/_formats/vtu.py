@@ -0,0 +1,198 @@
+"""
+Contains a method for writing an FEproblem's mesh to a VTK XML unstructured
+grid (.vtu) file, for viewing in ParaView and other VTK-based tools.
+
+All arrays are stored as raw binary in the file's appended data section,
+optionally compressed with zlib, so that large meshes are written without
+formatting each value as text.
+"""
+from __future__ import with_statement
+import sys, struct, zlib
+from array import array
+from itertools import chain
+from xml.sax.saxutils import quoteattr
+
+from .. import geometry as g, materials as mat, problem, instrument
+from ._common import SETSEP, NSET, ESET, _numbered, _nodes_and_elements
+from . import _compress
+
+
+# VTK cell type of each element type.  Springs are not written.
+cell_type_map = {
+    g.Tet4: 10,
+    g.Pent6: 13,
+    g.Hex8: 12,
+    g.Shell3: 5,
+    g.Shell4: 9,
+    g.Surface3: 5,
+    g.Surface4: 9,
+}
+
+# Order in which to write each element's nodes, where it differs from VTK's.
+# VTK's wedges have their first face pointing away from the second.
+node_order_map = {
+    g.Pent6: (0,2,1,3,5,4),
+}
+
+# VTK names for the types of array used.
+_vtk_types = {'d': 'Float64', 'i': 'Int32', 'B': 'UInt8'}
+
+# Size of each block of compressed data, before compression.
+BLOCK_SIZE = 1 << 16
+
+
+def _tobytes(a):
+    "Returns the contents of an array as a string of bytes."
+    return a.tobytes() if hasattr(a, 'tobytes') else a.tostring()
+
+
+def _block(data, level):
+    """Returns an array's data as a block of appended data: a header giving
+    its size, followed by the data itself.  If level is not None, the data is
+    split into blocks each compressed at that zlib level, and the header lists
+    the compressed size of each."""
+    if level is None:
+        return struct.pack('=Q', len(data)) + data
+    blocks = [ zlib.compress(data[i:i+BLOCK_SIZE], level)
+        for i in xrange(0, len(data), BLOCK_SIZE) ]
+    header = struct.pack('=%dQ' % (3 + len(blocks)), len(blocks), BLOCK_SIZE,
+        len(data) % BLOCK_SIZE, *map(len, blocks))
+    return header + b''.join(blocks)
+
+
+
+def write(self, file_name_or_obj, compress=False, element_order=None):
+    """Write the current problem's nodes and solid, shell and surface
+    elements to a VTK XML unstructured grid (.vtu) file.
+
+    Each element is given these cell fields:
+        material    1-based index of its material in order of first use, or 0
+                    if it has none.
+        fiber       The primary material axis, for materials with an axis.
+        <set name>  1 for elements in the set, otherwise 0; for each set of
+                    only elements.
+    Sets of only nodes are written as point fields in the same way.  The
+    "allnodes" and "allelements" sets made when reading files are left out.
+
+    If compress is True, or a zlib compression level from 1 to 9, the data is
+    compressed.  If element_order is "morton", cells are sorted along a Morton
+    curve through their centroids (see ordering.morton).
+    NOTE: Springs, materials' other parameters and constraints are not
+    written."""
+    if element_order not in (None, 'morton'):
+        raise ValueError('Unknown element order "%s".' % element_order)
+    if isinstance(file_name_or_obj, basestring):
+        with _compress.open(file_name_or_obj, 'wb') as fileobj:
+            return write(self, fileobj, compress, element_order)
+    fileobj = file_name_or_obj
+    if compress is True:
+        level = zlib.Z_DEFAULT_COMPRESSION
+    elif compress:
+        level = int(compress)
+    else:
+        level = None
+
+    with instrument.phase('numbering'):
+        nodes, elements = _nodes_and_elements(self)
+        nodes = _numbered(nodes, self.sets, NSET)
+        node_index = dict( (n, i) for i,n in enumerate(nodes) )
+        elements = _numbered( (e for e in elements
+            if e.__class__ in cell_type_map), self.sets, ESET )
+        if element_order == 'morton':
+            from ..ordering import morton
+            elements = morton(elements)
+    instrument.count('nodes', len(nodes))
+    instrument.count('elements', len(elements))
+
+    # Each array is built straight from the mesh into a typed buffer.
+    with instrument.phase('points'):
+        points = array('d', chain.from_iterable( n._pos for n in nodes ))
+
+    with instrument.phase('cells'):
+        connectivity = array('i', map(node_index.__getitem__,
+            chain.from_iterable( e._nodes if e.__class__ not in node_order_map
+                else [ e._nodes[i] for i in node_order_map[e.__class__] ]
+                for e in elements )))
+        offsets = array('i', ( len(e._nodes) for e in elements ))
+        for i in xrange(1, len(offsets)):
+            offsets[i] += offsets[i-1]
+        types = array('B', ( cell_type_map[e.__class__] for e in elements ))
+
+    with instrument.phase('fields'):
+        cell_data = list()
+        matl_ids = {None: 0}
+        for e in elements:
+            if e.material not in matl_ids:
+                matl_ids[e.material] = len(matl_ids)
+        cell_data.append( ('material', 1,
+            array('i', ( matl_ids[e.material] for e in elements ))) )
+
+        if any( isinstance(getattr(m, 'axis', None), mat.AxisOrientation)
+                for m in matl_ids ):
+            zero = (0.0, 0.0, 0.0)
+            fibers = array('d')
+            for e in elements:
+                axis = getattr(e.material, 'axis', None)
+                fibers.extend( axis.get_at_element(e)[0]
+                    if isinstance(axis, mat.AxisOrientation) else zero )
+            cell_data.append( ('fiber', 3, fibers) )
+
+        point_data = list()
+        for name, s in sorted(self.sets.iteritems()):
+            if (not s or name.rsplit(SETSEP, 1)[-1] in (NSET, ESET)
+                    or name in (NSET, ESET)):
+                continue
+            if all( isinstance(x, g.Node) for x in s ):
+                data, objects = point_data, nodes
+            elif all( x.__class__ in cell_type_map for x in s ):
+                data, objects = cell_data, elements
+            else:
+                continue
+            s = s if isinstance(s, (set, frozenset)) else set(s)
+            data.append( (name, 1,
+                array('B', ( x in s for x in objects ))) )
+
+    with instrument.phase('serialize'):
+        # The header refers to each array by its offset in the appended data,
+        # so the data must all be ready before the header is written.
+        blocks = list()
+        offset = [0]
+        def data_array(name, components, a):
+            blocks.append( _block(_tobytes(a), level) )
+            tag = ('<DataArray type="%s" Name=%s NumberOfComponents="%d" '
+                'format="appended" offset="%d"/>\n' % (_vtk_types[a.typecode],
+                quoteattr(name), components, offset[0]))
+            offset[0] += len(blocks[-1])
+            return tag
+
+        header = ['<?xml version="1.0"?>\n'
+            '<VTKFile type="UnstructuredGrid" version="1.0" '
+            'byte_order="%s" header_type="UInt64"%s>\n'
+            % ('LittleEndian' if sys.byteorder == 'little' else 'BigEndian',
+            ' compressor="vtkZLibDataCompressor"' if level is not None else ''),
+            '<UnstructuredGrid>\n',
+            '<Piece NumberOfPoints="%d" NumberOfCells="%d">\n'
+            % (len(nodes), len(elements)),
+            '<Points>\n', data_array('Points', 3, points), '</Points>\n',
+            '<Cells>\n',
+            data_array('connectivity', 1, connectivity),
+            data_array('offsets', 1, offsets),
+            data_array('types', 1, types),
+            '</Cells>\n']
+        header.append('<PointData>\n')
+        header.extend( data_array(*d) for d in point_data )
+        header.append('</PointData>\n<CellData>\n')
+        header.extend( data_array(*d) for d in cell_data )
+        header.append('</CellData>\n</Piece>\n</UnstructuredGrid>\n'
+            '<AppendedData encoding="raw">\n_')
+        header = ''.join(header).encode('utf-8')
+
+    with instrument.phase('write'):
+        fileobj.write(header)
+        for b in blocks:
+            fileobj.write(b)
+        footer = b'\n</AppendedData>\n</VTKFile>\n'
+        fileobj.write(footer)
+    instrument.wrote('written', len(header) + offset[0] + len(footer))
+
+problem.FEproblem.write_vtu = write
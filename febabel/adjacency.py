@@ -0,0 +1,223 @@
+"""
+Contains functions for building adjacency structures of a mesh as arrays.
+
+Structures are stored in compressed sparse row (CSR) form: a pair of integer
+NumPy arrays (offsets, indices), where the entries of row i are
+indices[offsets[i]:offsets[i+1]].  Nodes and elements are referred to by
+their positions in given lists, so the structures are compact even for
+millions of nodes.  NumPy is only needed when these functions are used.
+
+FEproblem.adjacency gives the elements of each node and the neighbours of
+each element in a problem, kept until the problem's connectivity changes.
+"""
+from itertools import chain, imap
+
+from . import problem, common, geometry as geo, instrument
+from ._formats._common import _nodes_and_elements, _numbered, NSET, ESET
+
+np = common.optional_module('numpy')
+
+
+# The nodes of each face of each element type, through which elements are
+# joined to their neighbours.  Shells and surfaces are joined at their edges.
+face_map = dict( (cls, cls.faces or cls.edges) for cls in (geo.Tet4,
+    geo.Pent6, geo.Hex8, geo.Shell3, geo.Shell4, geo.Surface3, geo.Surface4) )
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('Building adjacency arrays requires NumPy.')
+
+
+def connectivity(elements, node_index):
+    """Returns the nodes of each element as CSR arrays.  node_index is a dict
+    giving the position of each node."""
+    _require_numpy()
+    sizes = np.fromiter( imap(len, elements), np.intp, len(elements) )
+    offsets = np.zeros(len(elements) + 1, np.intp)
+    np.cumsum(sizes, out=offsets[1:])
+    indices = np.fromiter( imap(node_index.__getitem__,
+        chain.from_iterable( e._nodes for e in elements )),
+        np.intp, offsets[-1] )
+    return offsets, indices
+
+
+def transpose(offsets, indices, n):
+    """Returns the transpose of CSR arrays with n columns, eg. giving the
+    elements of each node from the nodes of each element.  Each row lists its
+    entries in increasing order."""
+    _require_numpy()
+    m = len(offsets) - 1
+    rows = np.repeat(np.arange(m), np.diff(offsets))
+    # Sorting by column then row is much faster with a single key than with
+    # a stable sort by column.
+    order = np.argsort(indices * m + rows)
+    t_offsets = np.zeros(n + 1, np.intp)
+    np.cumsum(np.bincount(indices, minlength=n), out=t_offsets[1:])
+    return t_offsets, rows[order]
+
+
+def gather(offsets, indices, rows):
+    """Returns the entries of the given rows, concatenated in order, and for
+    each entry the position in rows of the row it came from."""
+    starts = offsets[rows]
+    sizes = offsets[rows + 1] - starts
+    source = np.repeat(np.arange(len(rows)), sizes)
+    # Position of each entry within its own row.
+    within = np.arange(len(source)) - np.repeat(np.cumsum(sizes) - sizes,
+        sizes)
+    return indices[starts[source] + within], source
+
+
+def face_neighbours(elements, offsets, indices):
+    """Returns the neighbours of each element as CSR arrays, given the nodes
+    of each element as CSR arrays.  Elements are neighbours if they share a
+    face, or for shells and surfaces an edge.  Types not in face_map (eg.
+    springs) have no neighbours."""
+    _require_numpy()
+    by_type = dict()
+    for i,e in enumerate(elements):
+        if e.__class__ in face_map:
+            by_type.setdefault(e.__class__, list()).append(i)
+
+    # Each face is listed by its sorted nodes, padded to four with -1s.
+    faces, owners = list(), list()
+    for cls, rows in by_type.iteritems():
+        rows = np.array(rows)
+        k = cls.n_nodes
+        nodes = indices[offsets[rows][:,None] + np.arange(k)]
+        for face in face_map[cls]:
+            f = np.sort(nodes[:,face], axis=1)
+            if len(face) < 4:
+                f = np.hstack( (np.full( (len(rows), 4 - len(face)), -1,
+                    np.intp), f) )
+            faces.append(f)
+            owners.append(rows)
+    n = len(elements)
+    if not faces:
+        return np.zeros(n + 1, np.intp), np.zeros(0, np.intp)
+    faces = np.concatenate(faces)
+    owners = np.concatenate(owners)
+
+    # Sorting brings the copies of each face together.  Faces are sorted by
+    # one key made from their nodes' ranks, as sorting by several keys is far
+    # slower.
+    m = max(indices.max() + 2, 1) if len(indices) else 1
+    low = _rank(faces[:,0] * m + faces[:,1])
+    high = _rank(faces[:,2] * m + faces[:,3])
+    keys = low * (high.max() + 1) + high
+    order = np.argsort(keys)
+    keys, owners = keys[order], owners[order]
+    # Faces are almost always shared by at most two elements, but more are
+    # joined pairwise.
+    first, second = list(), list()
+    step = 1
+    while step < len(keys):
+        pairs = np.flatnonzero(keys[step:] == keys[:-step])
+        if not len(pairs):
+            break
+        first.append(owners[pairs])
+        second.append(owners[pairs + step])
+        step += 1
+    first = np.concatenate(first + [np.zeros(0, np.intp)])
+    second = np.concatenate(second + [np.zeros(0, np.intp)])
+
+    rows = np.concatenate( (first, second) )
+    cols = np.concatenate( (second, first) )
+    keep = rows != cols
+    rows, cols = rows[keep], cols[keep]
+    # Neighbours are listed once each, in increasing order.
+    keys = np.unique(rows * n + cols)
+    rows, cols = keys // n, keys % n
+    nb_offsets = np.zeros(n + 1, np.intp)
+    np.cumsum(np.bincount(rows, minlength=n), out=nb_offsets[1:])
+    return nb_offsets, cols
+
+
+def _rank(values):
+    """Returns the rank of each value among the distinct values given, from
+    0 up."""
+    order = np.argsort(values)
+    ordered = values[order]
+    new = np.ones(len(values), np.intp)
+    new[0] = 0
+    np.not_equal(ordered[1:], ordered[:-1], out=new[1:])
+    rank = np.empty(len(values), np.intp)
+    rank[order] = np.cumsum(new)
+    return rank
+
+
+
+class Adjacency(object):
+    """The nodes of each element, the elements of each node and the face
+    neighbours of each element (see face_neighbours) of a mesh, as CSR
+    arrays.  Nodes and elements are referred to by their positions in the
+    nodes and elements lists, which are given by node_index and
+    element_index."""
+
+    def __init__(self, nodes, elements):
+        _require_numpy()
+        self.nodes, self.elements = nodes, elements
+        self.node_index = dict( (n, i) for i,n in enumerate(nodes) )
+        self.element_index = dict( (e, i) for i,e in enumerate(elements) )
+        self.elem_offsets, self.elem_nodes = connectivity(elements,
+            self.node_index)
+        self.node_offsets, self.node_elems = transpose(self.elem_offsets,
+            self.elem_nodes, len(nodes))
+        self._neighbours = None
+
+    def neighbour_arrays(self):
+        """Returns the face neighbours of each element as CSR arrays, finding
+        them on first use."""
+        if self._neighbours is None:
+            self._neighbours = face_neighbours(self.elements,
+                self.elem_offsets, self.elem_nodes)
+        return self._neighbours
+
+    def elements_of(self, node):
+        "Returns a list of the elements using a node."
+        i = self.node_index[node]
+        return [ self.elements[j] for j in
+            self.node_elems[self.node_offsets[i]:self.node_offsets[i+1]] ]
+
+    def neighbours_of(self, element):
+        "Returns a list of the elements sharing a face with an element."
+        offsets, indices = self.neighbour_arrays()
+        i = self.element_index[element]
+        return [ self.elements[j] for j in
+            indices[offsets[i]:offsets[i+1]] ]
+
+
+
+def adjacency(self):
+    """Returns the Adjacency of all nodes and elements in the problem, with
+    nodes and elements listed as numbered in the files they were read from
+    where possible.
+
+    It is kept and returned again until elements are added to or removed from
+    the problem's sets, or the nodes of an element are changed (moving nodes
+    doesn't matter).  Checking this takes a little time for large problems,
+    so keep the result while making many queries."""
+    # Nodes of unchanged elements are unchanged, so only nodes held outside
+    # of elements need checking.
+    with instrument.phase('gather'):
+        free, elements = _nodes_and_elements(self, False)
+    generation = self.generations['connectivity']
+    cached = getattr(self, '_adjacency', None)
+    if cached is not None and cached[0] == generation:
+        result = cached[2]
+        if (len(result.elements) == len(elements) and cached[1] == free
+                and elements.issuperset(result.elements)):
+            instrument.count('cached', 1)
+            return result
+    with instrument.phase('adjacency'):
+        nodes = set(free)
+        for e in elements:
+            nodes.update(e._nodes)
+        result = Adjacency(_numbered(nodes, self.sets, NSET),
+            _numbered(elements, self.sets, ESET))
+    common.watch(self, 'adjacency', [elements])
+    self._adjacency = (generation, free, result)
+    return result
+
+problem.FEproblem.adjacency = adjacency
@@ -1,6 +1,72 @@
+import imp
+import weakref
+
 import febabel as feb
 
 
+# The parts of a problem whose changes are counted, each in its own counter
+# (see FEproblem.generations).  Any change to an object increments the
+# counters of the parts it appears in, in each problem watching it, so
+# writers can tell whether output they rendered earlier is still valid.
+# 'connectivity' counts only changes to which nodes elements use, which alter
+# adjacency (see FEproblem.adjacency) but not node positions.
+# NOTE: Only changes made through the objects' own attributes and item setters
+# are counted.  Changing a container in place (eg. a LoadCurve's points dict)
+# isn't, so anything relying on the counters must also compare the contents
+# of such containers (as the .feb writer does).
+parts = ('geometry', 'connectivity', 'materials', 'boundary', 'loaddata',
+    'steps')
+
+# The problems whose changes are being counted, each with the collections of
+# objects it watches, by name (see watch).
+_watched = weakref.WeakKeyDictionary()
+
+def watch(problem, name, collections):
+    """Count changes to the objects in the given collections (eg. sets of
+    descendants) in problem.generations, replacing any earlier collections
+    watched under the same name.  The collections are held until the problem
+    is deleted."""
+    _watched.setdefault(problem, dict())[name] = collections
+
+def touch(obj, *parts):
+    """Record a change to obj in the given parts of each problem watching it.
+    obj may also be a problem itself, for changes made to the whole problem."""
+    if not _watched:
+        return
+    for problem, watching in _watched.items():
+        if obj is problem or any( obj in objects
+                for collections in watching.itervalues()
+                for objects in collections ):
+            generations = problem.generations
+            for p in parts:
+                generations[p] += 1
+
+
+
+class LazyModule(object):
+    """Stands in for a module, which is only imported when one of its
+    attributes is first used.  Optional dependencies (eg. NumPy) are held
+    this way, so importing FEbabel doesn't pay for importing them."""
+
+    def __init__(self, name):
+        self.__name__ = name
+
+    def __getattr__(self, attr):
+        module = __import__(self.__name__, fromlist=['__name__'])
+        # Later lookups find the module's attributes directly.
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+def optional_module(name):
+    """Returns a LazyModule for the named top-level module, or None if it
+    isn't installed."""
+    try:
+        imp.find_module(name)
+    except ImportError:
+        return None
+    return LazyModule(name)
+
+
 
 class Base(object):
     """The base class for all objects used in FEbabel.
@@ -69,17 +135,58 @@ class Base(object):
 
 
 
+class ConstraintDict(dict):
+    """A dict relating degrees of freedom to their constraints, which records
+    any changes made to it (see touch) as changes to its owner, the object
+    whose constraints it holds."""
+
+    __slots__ = ['owner']
+
+    def __init__(self, items=(), owner=None, **constraints):
+        dict.__init__(self, items, **constraints)
+        self.owner = owner
+
+    def __setitem__(self, dof, constraint):
+        touch(self.owner, 'boundary', 'steps')
+        dict.__setitem__(self, dof, constraint)
+
+    def __delitem__(self, dof):
+        touch(self.owner, 'boundary', 'steps')
+        dict.__delitem__(self, dof)
+
+    def update(self, *args, **kwargs):
+        touch(self.owner, 'boundary', 'steps')
+        dict.update(self, *args, **kwargs)
+
+    def copy(self):
+        return self.__class__(self, self.owner)
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self), self.owner))
+
+
 class Constrainable(Base):
     """A mixin to allow different object types to accept constraints on each of
     its degrees of freedom."""
 
-    __slots__ = ['constraints']
+    __slots__ = ['_constraints']
 
     def __init__(self, *degrees_of_freedom):
         free = feb.constraints.free
-        self.constraints = dict( (i,free) for i in degrees_of_freedom )
+        self._constraints = ConstraintDict( ((i,free)
+            for i in degrees_of_freedom), self )
         # TODO: Prevent new DOFs from being added after the fact.
 
+    # Replacing the whole dict changes constraints just as setting them does.
+    def _getconstraints(self):
+        return self._constraints
+    def _setconstraints(self, constraints):
+        touch(self, 'boundary', 'steps')
+        if isinstance(constraints, ConstraintDict):
+            constraints.owner = self
+        self._constraints = constraints
+    constraints = property(_getconstraints, _setconstraints)
+
     def get_children(self):
         return set(self.constraints.itervalues())
 
@@ -112,6 +219,7 @@ class Switch(Base):
         return self.points[x]
 
     def __setitem__(self, x, y):
+        touch(self, 'steps')
         self.points[x] = y
 
 
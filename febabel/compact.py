@@ -0,0 +1,79 @@
+"""
+Contains a pass removing objects which nothing in a problem uses.
+
+Readers keep every node in a file, even when a configuration only uses some of
+its parts, and everything in a problem's sets is written out.  Compacting the
+problem first keeps the solver from being handed nodes it can only fix in
+place.
+"""
+from . import problem, geometry as geo, materials as mat, constraints as con, \
+    instrument
+from ._formats._common import ValsDict
+
+
+
+def compact(self):
+    """Removes objects held in the problem's sets which nothing else uses:
+    nodes used by no element (including springs and contact surfaces),
+    contact or rigid interface and with no constraints, and materials and
+    loadcurves used by no other object.  Sets losing objects are rebuilt, so
+    they take no more memory than needed.  Returns the set of objects
+    removed."""
+    Node, Element = geo.Node, geo.Element
+    # Objects held directly in sets, which are removed if nothing uses them,
+    # and objects which are always kept.
+    held, elements, roots = set(), set(), set([self.timestepper])
+    with instrument.phase('gather'):
+        for s in self.sets.itervalues():
+            if isinstance(s, dict) and not isinstance(s, ValsDict):
+                continue
+            for x in s:
+                if isinstance(x, Element):
+                    elements.add(x)
+                elif isinstance(x, (Node, mat.Material, con.LoadCurve)):
+                    held.add(x)
+                else:
+                    roots.add(x)
+
+    with instrument.phase('mark'):
+        used = set()
+        for e in elements:
+            used.update(e._nodes)
+            roots.add(e._material)
+        roots.discard(None)
+        free = con.free
+        for x in held:
+            if isinstance(x, Node) and x not in used and any( c is not free
+                    for c in x.constraints.itervalues() ):
+                used.add(x)
+        # Nodes are only searched for their constraints where these aren't
+        # all free, as that is by far the most common case.
+        for n in used:
+            for c in n.constraints.itervalues():
+                if c is not free:
+                    roots.add(c)
+        stack = list(roots)
+        used.update(roots)
+        while stack:
+            for x in stack.pop().get_children() or ():
+                if x not in used:
+                    used.add(x)
+                    stack.append(x)
+
+    removed = held - used
+    instrument.count('removed', len(removed))
+    if removed:
+        with instrument.phase('rebuild'):
+            for name, s in self.sets.items():
+                if isinstance(s, ValsDict):
+                    kept = ValsDict( (k,x) for k,x in s.iteritems()
+                        if x not in removed )
+                elif isinstance(s, dict):
+                    continue
+                else:
+                    kept = s.__class__( x for x in s if x not in removed )
+                if len(kept) != len(s):
+                    self.sets[name] = kept
+    return removed
+
+problem.FEproblem.compact = compact
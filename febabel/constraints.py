@@ -1,4 +1,4 @@
-from .common import Base, Switch
+from .common import Base, Switch, touch
 
 
 
@@ -27,12 +27,17 @@ class LoadCurve(Base):
         self.interpolation = interpolation
         self.extrapolation = extrapolation
 
+    def __setattr__(self, name, value):
+        touch(self, 'loaddata')
+        Base.__setattr__(self, name, value)
+
 
     # For more convenient read/write access to the points dictionary.
     def __getitem__(self, x):
         return self.points[x]
 
     def __setitem__(self, x, y):
+        touch(self, 'loaddata')
         self.points[x] = y
 
 
@@ -80,6 +85,10 @@ class Constraint(Base):
         self.multiplier = multiplier
         self.loadcurve = loadcurve
 
+    def __setattr__(self, name, value):
+        touch(self, 'boundary', 'steps')
+        Base.__setattr__(self, name, value)
+
     def get_children(self):
         return set([self.loadcurve])
 
@@ -117,6 +126,10 @@ class Contact(Base):
         self.slave = set(slave)
         self.options = options if options is not None else dict()
 
+    def __setattr__(self, name, value):
+        touch(self, 'boundary', 'steps')
+        Base.__setattr__(self, name, value)
+
     def get_children(self):
         return self.master.union(self.slave)
 
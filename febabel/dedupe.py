@@ -0,0 +1,142 @@
+"""
+Contains a pass merging materials and loadcurves with identical definitions.
+
+Writers number materials and loadcurves by identity, so a problem built with a
+new (but identical) material for each element or spring, or the same
+loadcurve defined in several files, is written with one definition for each.
+Merging them first shrinks the file and the solver's material table.
+"""
+from . import problem, common, geometry as geo, materials as mat, \
+    constraints as con, instrument
+from ._formats._common import ValsDict
+
+
+def _internable(obj):
+    """Whether obj can be replaced by any equal object.  Rigid bodies can't,
+    as each is a separate body."""
+    return ( isinstance(obj, (mat.Material, mat.AxisOrientation,
+        con.LoadCurve)) and not isinstance(obj, common.Constrainable)
+        and hasattr(obj, '__dict__') )
+
+
+class Interner(object):
+    """Keeps one instance of each distinct material, material axis and
+    loadcurve.  Objects are equal when they are of the same class and their
+    attributes are equal, with objects they refer to compared after
+    interning them in turn.  Rigid bodies and Fields are only equal to
+    themselves.
+
+    The module's loadcurve_zero, loadcurve_constant and loadcurve_ramp are
+    always the instances kept for their values, as writers recognize them by
+    identity."""
+
+    def __init__(self):
+        # The kept instance equal to each object seen, and each kept instance
+        # by its key.
+        self._kept = dict()
+        self._by_key = dict()
+        for lc in (con.loadcurve_zero, con.loadcurve_constant,
+                con.loadcurve_ramp):
+            self.intern(lc)
+
+    def intern(self, obj):
+        """Returns the kept instance equal to obj, which is obj itself if no
+        equal object has been seen before."""
+        kept = self._kept.get(obj)
+        if kept is None:
+            if _internable(obj):
+                key = (obj.__class__, self._freeze(obj.__dict__))
+                kept = self._by_key.setdefault(key, obj)
+            else:
+                kept = obj
+            self._kept[obj] = kept
+        return kept
+
+    def _freeze(self, value):
+        "Returns a hashable value equal for equal values."
+        if isinstance(value, common.Base):
+            return id(self.intern(value))
+        elif isinstance(value, dict):
+            return frozenset( (self._freeze(k), self._freeze(v))
+                for k,v in value.iteritems() )
+        elif isinstance(value, (list, tuple)):
+            return tuple( self._freeze(v) for v in value )
+        try:
+            hash(value)
+        except TypeError:
+            return ('id', id(value))
+        return value
+
+
+
+def dedupe(self):
+    """Replaces each material, material axis and loadcurve in the problem
+    which is equal to another (see Interner) with that one, wherever it is
+    used, so that each distinct definition is written only once.  Returns a
+    dict giving the object kept in place of each one replaced."""
+    Node, Element = geo.Node, geo.Element
+    free = con.free
+    with instrument.phase('gather'):
+        # Elements and nodes are only searched for their materials and
+        # constraints, as they are by far the most numerous objects.
+        stack = [self.timestepper]
+        for s in self.sets.itervalues():
+            if isinstance(s, dict) and not isinstance(s, ValsDict):
+                continue
+            stack.extend(s)
+        seen, elements, others = set(), list(), list()
+        while stack:
+            x = stack.pop()
+            if x is None or x in seen:
+                continue
+            seen.add(x)
+            if isinstance(x, Element):
+                elements.append(x)
+                stack.append(x._material)
+                stack.extend(x._nodes)
+            elif isinstance(x, Node):
+                stack.extend( c for c in x.constraints.itervalues()
+                    if c is not free )
+            else:
+                others.append(x)
+                stack.extend(x.get_children() or ())
+
+    with instrument.phase('intern'):
+        interner = Interner()
+        replaced = dict()
+        for x in others:
+            kept = interner.intern(x)
+            if kept is not x:
+                replaced[x] = kept
+    instrument.count('merged', len(replaced))
+    if not replaced:
+        return replaced
+
+    with instrument.phase('replace'):
+        for e in elements:
+            if e._material in replaced:
+                e._material = replaced[e._material]
+        for x in others:
+            attrs = getattr(x, '__dict__', {})
+            for k,v in attrs.items():
+                if isinstance(v, common.Base) and v in replaced:
+                    attrs[k] = replaced[v]
+            for cls in type(x).__mro__:
+                for slot in getattr(cls, '__slots__', ()):
+                    v = getattr(x, slot, None)
+                    if isinstance(v, common.Base) and v in replaced:
+                        setattr(x, slot, replaced[v])
+        for name, s in self.sets.items():
+            if isinstance(s, ValsDict):
+                if any( x in replaced for x in s ):
+                    self.sets[name] = ValsDict( (k, replaced.get(x, x))
+                        for k,x in s.iteritems() )
+            elif isinstance(s, dict):
+                continue
+            elif any( x in replaced for x in s ):
+                self.sets[name] = s.__class__( replaced.get(x, x) for x in s )
+    # Attributes were replaced directly, so record the changes here.
+    common.touch(self, 'geometry', 'materials', 'boundary', 'loaddata', 'steps')
+    return replaced
+
+problem.FEproblem.dedupe = dedupe
@@ -1,5 +1,5 @@
 from math import sqrt
-from .common import Base, Constrainable
+from .common import Base, Constrainable, touch
 
 class Node(Constrainable):
     """A single point in three-dimensional Cartesian space.
@@ -25,18 +25,21 @@ class Node(Constrainable):
     def _getx(self):
         return self._pos[0]
     def _setx(self, value):
+        touch(self, 'geometry')
         self._pos[0] = value
     x = property(_getx, _setx)
 
     def _gety(self):
         return self._pos[1]
     def _sety(self, value):
+        touch(self, 'geometry')
         self._pos[1] = value
     y = property(_gety, _sety)
 
     def _getz(self):
         return self._pos[2]
     def _setz(self, value):
+        touch(self, 'geometry')
         self._pos[2] = value
     z = property(_getz, _setz)
 
@@ -47,6 +50,7 @@ class Node(Constrainable):
     def __getitem__(self, i):
         return self._pos[i]
     def __setitem__(self, i, value):
+        touch(self, 'geometry')
         self._pos[i] = value
     def __len__(self):
         # Could return len(self._pos), but it will always be 3...
@@ -64,12 +68,17 @@ class Node(Constrainable):
 class Element(Base):
     """Base class for all different element types.
     Note that subclasses should define n_nodes, the number of nodes required by
-    the particular element."""
+    the particular element.  They may also define edges, the pairs of node
+    indices joined by each edge, and for solids faces, the node indices of
+    each face, counterclockwise seen from outside (so that their normals
+    point out of the element), in the order of Abaqus's face labels."""
 
     # Only this data needs storing, so decrease memory again.
     # Note that this doesn't interfere with adding new data to the class
     # directly; only instances are affected.  Adding n_nodes is fine.
-    __slots__ = ['_nodes', 'material']
+    __slots__ = ['_nodes', '_material']
+
+    edges = faces = ()
 
     def __init__(self, nodes, material=None):
         """nodes is an iterable of Node objects.
@@ -79,7 +88,16 @@ class Element(Base):
         undefined!"""
         n = iter(nodes)
         self._nodes = [ n.next() for i in xrange(self.n_nodes) ]
-        self.material = material
+        self._material = material
+
+    # Changing an element's material changes both the geometry and the set of
+    # materials in use.
+    def _getmaterial(self):
+        return self._material
+    def _setmaterial(self, material):
+        touch(self, 'geometry', 'materials')
+        self._material = material
+    material = property(_getmaterial, _setmaterial)
 
     def get_children(self):
         s = set(self._nodes)
@@ -103,6 +121,7 @@ class Element(Base):
     def __getitem__(self, i):
         return self._nodes[i]
     def __setitem__(self, i, node):
+        touch(self, 'geometry', 'connectivity')
         self._nodes[i] = node
     def __len__(self):
         # Could return len(self._nodes), but it will always be constant...
@@ -119,28 +138,51 @@ class SolidElement(Element):
 class Tet4(SolidElement):
     "4-node linear tetrahedral element."
     n_nodes = 4
+    edges = ((0,1), (1,2), (2,0), (0,3), (1,3), (2,3))
+    faces = ((0,2,1), (0,1,3), (1,2,3), (2,0,3))
 class Pent6(SolidElement):
     "6-node linear pentahedral (triangular prism) element."
     n_nodes = 6
+    edges = ((0,1), (1,2), (2,0), (3,4), (4,5), (5,3), (0,3), (1,4), (2,5))
+    faces = ((0,2,1), (3,4,5), (0,1,4,3), (1,2,5,4), (2,0,3,5))
 class Hex8(SolidElement):
     "8-node linear hexahedral (brick) element."
     n_nodes = 8
+    edges = ((0,1), (1,2), (2,3), (3,0), (4,5), (5,6), (6,7), (7,4), (0,4),
+        (1,5), (2,6), (3,7))
+    faces = ((0,3,2,1), (4,5,6,7), (0,1,5,4), (1,2,6,5), (2,3,7,6),
+        (0,4,7,3))
+
+
+# Edges of triangular and quadrilateral shells and surfaces.
+_tri_edges = ((0,1), (1,2), (2,0))
+_quad_edges = ((0,1), (1,2), (2,3), (3,0))
 
 
 class ShellElement(Element):
     "Base class for shell elements."
-    __slots__ = ['thickness']
+    __slots__ = ['_thickness']
     # TODO: thickness should be a list; one for each node.
     def __init__(self, nodes, material=None, thickness=0.0):
         Element.__init__(self, nodes, material)
-        self.thickness = thickness
+        self._thickness = thickness
+
+    # Shell thicknesses are written with the geometry.
+    def _getthickness(self):
+        return self._thickness
+    def _setthickness(self, thickness):
+        touch(self, 'geometry')
+        self._thickness = thickness
+    thickness = property(_getthickness, _setthickness)
 
 class Shell3(ShellElement):
     "3-node triangular shell element."
     n_nodes = 3
+    edges = _tri_edges
 class Shell4(ShellElement):
     "4-node quadrilateral shell element."
     n_nodes = 4
+    edges = _quad_edges
 
 
 class SurfaceElement(Element):
@@ -149,14 +191,64 @@ class SurfaceElement(Element):
 class Surface3(SurfaceElement):
     "3-node triangular surface element."
     n_nodes = 3
+    edges = _tri_edges
 class Surface4(SurfaceElement):
     "4-node quadrilateral surface element."
     n_nodes = 4
+    edges = _quad_edges
 
 
 class Spring(Element):
     "2-node linear spring element."
     n_nodes = 2
     def __init__(self, nodes, material=None, tension_only=False):
-        self.tension_only = tension_only
+        self._tension_only = tension_only
         Element.__init__(self, nodes, material)
+
+    # Springs are written with the boundary conditions.
+    def _gettension_only(self):
+        return self._tension_only
+    def _settension_only(self, tension_only):
+        touch(self, 'boundary')
+        self._tension_only = tension_only
+    tension_only = property(_gettension_only, _settension_only)
+
+
+
+class SpringBlock(Base):
+    """A block of 2-node linear springs, kept as arrays rather than as a
+    Spring element (and material) each, for large bundles of springs.
+
+    nodes is a sequence of Node objects, and pairs is a sequence (eg. a NumPy
+    array of shape (n, 2)) giving the positions in nodes of the ends of each
+    spring.  material is the material of every spring, any of whose
+    parameters may be Fields giving their value at each spring (see
+    materials.Field)."""
+
+    __slots__ = ['nodes', 'pairs', 'material', 'tension_only']
+
+    def __setattr__(self, name, value):
+        # Springs are written with the boundary conditions.
+        touch(self, 'boundary')
+        Base.__setattr__(self, name, value)
+
+    def __init__(self, nodes, pairs, material, tension_only=False):
+        self.nodes = nodes
+        self.pairs = pairs
+        self.material = material
+        self.tension_only = tension_only
+
+    def get_children(self):
+        s = set(self.nodes)
+        s.add(self.material)
+        return s
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def springs(self):
+        """Returns the block's springs as separate Spring elements, each with
+        its own material (see materials.Material.at)."""
+        nodes = self.nodes
+        return [ Spring([nodes[a], nodes[b]], self.material.at(i),
+            self.tension_only) for i,(a,b) in enumerate(self.pairs) ]
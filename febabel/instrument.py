@@ -0,0 +1,149 @@
+"""
+Lightweight instrumentation of reading and writing.
+
+Readers and writers mark the phases of their work with the phase context
+manager, and report counts of objects and bytes written.  None of this costs
+more than a function call unless an observer has been added with
+add_observer.  Observers are called as
+
+    observer(kind, name, value)
+
+where kind is one of:
+    'phase': value is the wall time in seconds taken by the phase.  Nested
+             phases are named by their path, eg. "read_cnfg/geometry".
+    'count': value is a number of objects, eg. the number of nodes read.
+    'bytes': value is a number of bytes written.
+
+Profile is an observer which totals all of these up for a report.
+"""
+import time
+
+
+_observers = list()
+# Names of the phases currently running, outermost first.
+_stack = list()
+
+
+def add_observer(observer):
+    "Start calling observer with each instrumentation event."
+    _observers.append(observer)
+
+def remove_observer(observer):
+    "Stop calling observer with instrumentation events."
+    _observers.remove(observer)
+
+
+def _notify(kind, name, value):
+    for o in list(_observers):
+        o(kind, name, value)
+
+
+class _Phase(object):
+    __slots__ = ['name', 'start']
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        _stack.append(self.name)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.time() - self.start
+        path = '/'.join(_stack)
+        _stack.pop()
+        _notify('phase', path, elapsed)
+
+
+class _NullPhase(object):
+    __slots__ = []
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc_info):
+        pass
+
+_null_phase = _NullPhase()
+
+
+def phase(name):
+    """Returns a context manager timing the named phase of work within
+    whatever phases are currently running."""
+    if _observers:
+        return _Phase(name)
+    return _null_phase
+
+
+def _prefixed(name):
+    return '/'.join(_stack + [name]) if _stack else name
+
+def count(name, number):
+    "Report a number of objects of the given name within the current phase."
+    if _observers:
+        _notify('count', _prefixed(name), number)
+
+def wrote(name, nbytes):
+    "Report a number of bytes written to the named output."
+    if _observers:
+        _notify('bytes', _prefixed(name), nbytes)
+
+
+
+class Profile(object):
+    """An observer totalling up the times, counts and bytes of each name.
+
+    Usable as a context manager, which adds it as an observer for the
+    duration of the block:
+        with Profile() as prof:
+            p.read('model.cnfg')
+        print(prof.report())"""
+
+    def __init__(self):
+        # Each maps a name to [total, number of events].  Names are kept in
+        # the order first seen, for reporting.
+        self.totals = dict()
+        self.order = list()
+
+    def __call__(self, kind, name, value):
+        key = (kind, name)
+        if key not in self.totals:
+            self.totals[key] = [0, 0]
+            self.order.append(key)
+        total = self.totals[key]
+        total[0] += value
+        total[1] += 1
+
+    def __enter__(self):
+        add_observer(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        remove_observer(self)
+
+
+    def report(self):
+        "Returns a text table of all totals, with nested phases indented."
+        # Phases end after the phases nested in them, so sort each name after
+        # its parent while otherwise keeping the order they were first seen.
+        first = dict( (name, i) for i,(kind,name) in enumerate(self.order) )
+        def sort_key(key):
+            parts = key[1].split('/')
+            return [ first.get('/'.join(parts[:i+1]), -1)
+                for i in xrange(len(parts)) ]
+        order = sorted(self.order, key=sort_key)
+
+        top = sum( self.totals[k][0] for k in self.order
+            if k[0] == 'phase' and '/' not in k[1] )
+        lines = ['%-48s %10s %7s %6s' % ('Phase', 'Total', '%', 'Calls')]
+        for kind, name in order:
+            total, calls = self.totals[(kind, name)]
+            depth = name.count('/')
+            label = '  '*depth + name.rsplit('/', 1)[-1]
+            if kind == 'phase':
+                lines.append('%-48s %9.3fs %6.1f%% %6d' % (label, total,
+                    100.0 * total / top if top else 0, calls))
+            elif kind == 'count':
+                lines.append('%-48s %10d' % (label, total))
+            else:
+                lines.append('%-48s %10d bytes' % (label, total))
+        return '\n'.join(lines)
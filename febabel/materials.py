@@ -1,11 +1,46 @@
-from .common import Base, Constrainable
+import copy
+
+from .common import Base, Constrainable, touch
 # FIXME: Density belongs in every material.
 
 
 
+class Field(object):
+    """A material parameter whose value differs between the elements using
+    the material.  values is a sequence (eg. a NumPy array) giving its value
+    at each element, in the order of the block of elements using the
+    material (see geometry.SpringBlock).
+    NOTE: Only the materials of SpringBlocks may have Fields yet.  Writers
+    raise ValueError for a Field in the material of any other element."""
+
+    __slots__ = ['values']
+
+    def __init__(self, values):
+        self.values = values
+
+    def __len__(self):
+        return len(self.values)
+    def __getitem__(self, i):
+        return self.values[i]
+    def __iter__(self):
+        return iter(self.values)
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, repr(self.values))
+
+
+
 class Material(Base):
     "Base material object."
 
+    def __setattr__(self, name, value):
+        # A material's axis decides fiber directions in the geometry.
+        if name == 'axis':
+            touch(self, 'materials', 'geometry')
+        else:
+            touch(self, 'materials')
+        Base.__setattr__(self, name, value)
+
     def _store(self, params):
         del params['self']
         # TODO: Have parameters as a dict linked to attributes?
@@ -13,6 +48,19 @@ class Material(Base):
         for k,v in params.iteritems():
             setattr(self, k, v)
 
+    def at(self, i):
+        """Returns the material of the i-th element of the block using it: the
+        material itself, or a copy with each Field parameter replaced by its
+        i-th value."""
+        fields = [ k for k in self.parameters
+            if isinstance(getattr(self, k), Field) ]
+        if not fields:
+            return self
+        m = copy.copy(self)
+        for k in fields:
+            m.__dict__[k] = getattr(self, k)[i]
+        return m
+
 
 
 # TODO: Docstrings showing strain-energy functions.
@@ -87,6 +135,11 @@ class AxisOrientation(Base):
     All Axes should make use of the AxisOrientation._normalize static method to
     easily convert two vectors into three mutually-orthogonal unit vectors."""
 
+    def __setattr__(self, name, value):
+        # Axes are written with materials, or as fibers in the geometry.
+        touch(self, 'materials', 'geometry')
+        Base.__setattr__(self, name, value)
+
     @staticmethod
     def _normalize(v1, v2):
         """Takes two non-parallel vectors and returns three normalized unit
@@ -164,3 +217,19 @@ class NodalOrientation(AxisOrientation):
         v2 = [ element[ self.edge2[1] ][i] - element[ self.edge2[0] ][i]
             for i in xrange(3) ]
         return self._normalize(v1, v2)
+
+class ElementOrientation(AxisOrientation):
+    """Gives the primary axis of each Element explicitly, such as fiber
+    directions read from a file.
+    vectors is a dict relating each Element to its primary axis vector.  The
+    secondary axis is arbitrary."""
+    def __init__(self, vectors=None):
+        self.vectors = vectors if vectors is not None else dict()
+
+    def get_at_element(self, element):
+        v1 = self.vectors[element]
+        # Use whichever coordinate axis is furthest from parallel to v1.
+        i = min(xrange(3), key=lambda i: abs(v1[i]))
+        v2 = [0,0,0]
+        v2[i] = 1
+        return self._normalize(v1, v2)
@@ -0,0 +1,212 @@
+"""
+Contains functions for estimating the memory used by a problem.
+
+FEproblem.memory_report walks all of a problem's objects and totals their
+sizes by category (nodes, elements, constraint dicts, sets, etc.), so the
+memory used per node and per element can be compared between models and
+between versions.  Sizes are estimates from sys.getsizeof: each object and
+the containers and numbers it holds directly are counted, but objects shared
+between several others (eg. small ints) are counted for each of them.
+
+measure records the peak memory used while reading or writing, using
+tracemalloc where available (Python 3.4 and later) and the process's peak
+resident memory otherwise.
+"""
+from __future__ import with_statement
+import sys
+from contextlib import contextmanager
+
+from . import problem, common, geometry as geo, materials as mat, \
+    constraints as con
+
+
+# Categories in the order they are reported.
+CATEGORIES = ('nodes', 'node constraint dicts', 'elements', 'springs',
+    'materials', 'spring materials', 'constraints', 'loadcurves', 'contacts',
+    'sets', 'other')
+
+
+
+def _sizeof_values(values, seen):
+    """Returns the size of the given non-FEbabel objects, and of the
+    containers and numbers directly inside them.  Containers already in seen
+    are skipped."""
+    getsizeof = sys.getsizeof
+    size = 0
+    for v in values:
+        if isinstance(v, common.Base) or v is None or id(v) in seen:
+            continue
+        if isinstance(v, mat.Field):
+            seen.add(id(v))
+            size += getsizeof(v)
+            v = v.values
+        if isinstance(v, (list, tuple, set, frozenset, dict)):
+            seen.add(id(v))
+            size += getsizeof(v)
+            size += _sizeof_values(
+                v.iteritems() if isinstance(v, dict) else v, seen )
+        else:
+            size += getsizeof(v)
+    return size
+
+
+def _sizeof(obj, seen):
+    "Returns the estimated size of an FEbabel object and the data it holds."
+    size = sys.getsizeof(obj)
+    values = list()
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+        values.extend(obj.__dict__.itervalues())
+    for cls in type(obj).__mro__:
+        for slot in getattr(cls, '__slots__', ()):
+            # Constraint dicts are counted in their own category.
+            if slot != 'constraints' and hasattr(obj, slot):
+                values.append(getattr(obj, slot))
+    return size + _sizeof_values(values, seen)
+
+
+
+class MemoryReport(object):
+    """Estimated memory use of a problem, by category.
+
+    sizes maps each category name to (number of objects, bytes).  peaks maps
+    labels (such as "read" and "write") to peak bytes used, when given."""
+
+    def __init__(self, sizes, peaks=None):
+        self.sizes = sizes
+        self.peaks = peaks if peaks is not None else dict()
+
+    def total(self):
+        return sum( b for n,b in self.sizes.itervalues() )
+
+    def per_node(self):
+        "Returns the total estimated bytes per node."
+        n = self.sizes['nodes'][0]
+        return self.total() / float(n) if n else 0.0
+
+    def per_element(self):
+        "Returns the total estimated bytes per element (excluding springs)."
+        n = self.sizes['elements'][0]
+        return self.total() / float(n) if n else 0.0
+
+    def __str__(self):
+        total = self.total()
+        lines = ['%-24s %10s %14s %6s' % ('Category', 'Objects', 'Bytes', '%')]
+        for c in CATEGORIES:
+            n, b = self.sizes[c]
+            lines.append('%-24s %10d %14d %5.1f%%'
+                % (c, n, b, 100.0*b/total if total else 0))
+        lines.append('%-24s %10s %14d' % ('total', '', total))
+        lines.append('%-24s %10s %14.1f' % ('per node', '', self.per_node()))
+        lines.append('%-24s %10s %14.1f' % ('per element', '',
+            self.per_element()))
+        for label, peak in sorted(self.peaks.iteritems()):
+            lines.append('%-24s %10s %14d' % ('peak during %s' % label, '',
+                peak))
+        return '\n'.join(lines)
+
+
+
+def memory_report(self, peaks=None):
+    """Returns a MemoryReport estimating the memory used by this problem's
+    objects and sets.  peaks is an optional dict of peak memory use to
+    include, such as one filled in by memory.measure."""
+    sizes = dict( (c, [0, 0]) for c in CATEGORIES )
+    def add(category, size):
+        sizes[category][0] += 1
+        sizes[category][1] += size
+
+    descendants = self.get_descendants()
+    spring_materials = set( e.material for e in descendants
+        if isinstance(e, (geo.Spring, geo.SpringBlock)) )
+
+    # Containers shared between sets and contacts are only counted once, as
+    # sets.
+    seen = set()
+    getsizeof = sys.getsizeof
+    for s in self.sets.itervalues():
+        if id(s) in seen:
+            continue
+        seen.add(id(s))
+        # The keys of a ValsDict are the IDs read from a file.
+        size = getsizeof(s)
+        if isinstance(s, dict):
+            size += _sizeof_values(s.iterkeys(), seen)
+        add('sets', size)
+
+    for x in descendants:
+        size = _sizeof(x, seen)
+        if isinstance(x, geo.Node):
+            add('nodes', size)
+        elif isinstance(x, (geo.Spring, geo.SpringBlock)):
+            add('springs', size)
+        elif isinstance(x, geo.Element):
+            add('elements', size)
+        elif isinstance(x, mat.Material):
+            add('spring materials' if x in spring_materials else 'materials',
+                size)
+        elif isinstance(x, con.LoadCurve):
+            add('loadcurves', size)
+        elif isinstance(x, con.Constraint):
+            add('constraints', size)
+        elif isinstance(x, con.Contact):
+            add('contacts', size)
+        else:
+            add('other', size)
+
+        if isinstance(x, common.Constrainable):
+            size = getsizeof(x.constraints)
+            add('node constraint dicts' if isinstance(x, geo.Node)
+                else 'constraints', size)
+
+    return MemoryReport( dict( (c, tuple(v)) for c,v in sizes.iteritems() ),
+        peaks )
+
+problem.FEproblem.memory_report = memory_report
+
+
+
+def _max_rss():
+    "Returns the peak resident memory of this process in bytes, or None."
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes; OS X reports bytes.
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+@contextmanager
+def measure(peaks, label):
+    """Records the peak memory used within the block in peaks[label].
+
+    With tracemalloc, the peak traced memory is recorded, and tracing is
+    started (and stopped again afterwards) if it isn't already running.
+    Otherwise the peak resident memory of the whole process is recorded,
+    which includes everything allocated before the block."""
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+
+    if tracemalloc is None:
+        try:
+            yield
+        finally:
+            rss = _max_rss()
+            if rss is not None:
+                peaks[label] = rss
+        return
+
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        peaks[label] = tracemalloc.get_traced_memory()[1]
+        if started:
+            tracemalloc.stop()
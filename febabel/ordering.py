@@ -0,0 +1,199 @@
+"""
+Contains functions for ordering nodes and elements to suit solvers.
+
+rcm reorders nodes by the Reverse Cuthill-McKee algorithm, which reduces the
+bandwidth and profile of the stiffness matrix, and so the time and memory
+taken by FEBio's skyline and direct solvers.  bandwidth measures an ordering.
+
+morton reorders elements along a Morton (Z-order) space-filling curve through
+their centroids, so that neighbouring elements are numbered close together.
+This improves memory locality when assembling and post-processing, and gives
+the same order from one run to the next.
+
+Two nodes are neighbours if any element uses both of them.  Neighbours are
+found through the elements of each node rather than stored for every pair of
+nodes, which keeps memory use low for millions of nodes.  NumPy is only
+needed when these functions are used.
+"""
+from itertools import chain
+
+from . import adjacency
+
+
+class _Graph(object):
+    "The nodes of each element and elements of each node, as CSR arrays."
+
+    def __init__(self, nodes, elements):
+        np = adjacency.np
+        adjacency._require_numpy()
+        index = dict( (n, i) for i,n in enumerate(nodes) )
+        self.elem_offsets, self.elem_nodes = adjacency.connectivity(
+            elements, index )
+        self.node_offsets, self.node_elems = adjacency.transpose(
+            self.elem_offsets, self.elem_nodes, len(nodes) )
+        # Nodes are ranked by the number of element nodes they share an
+        # element with, as a cheap stand-in for their number of neighbours.
+        sizes = np.diff(self.elem_offsets)
+        self.degree = np.bincount(self.elem_nodes,
+            np.repeat(sizes - 1, sizes), minlength=len(nodes)).astype(np.intp)
+
+    def levels(self, start, visited):
+        """Yields the breadth-first levels of nodes reached from the start
+        node, marking them in visited.  Nodes within a level are ordered as
+        in Cuthill-McKee: by the node they were first reached from, then by
+        increasing degree."""
+        np = adjacency.np
+        # Once an element's nodes have been found, none are new again.
+        expanded = np.zeros(len(self.elem_offsets) - 1, bool)
+        level = np.array([start])
+        visited[start] = True
+        while len(level):
+            yield level
+            elems, source = adjacency.gather(self.node_offsets,
+                self.node_elems, level)
+            keep = ~expanded[elems]
+            elems, source = elems[keep], source[keep]
+            # Keep each element only where it was first found.
+            first = np.sort(np.unique(elems, return_index=True)[1])
+            elems, source = elems[first], source[first]
+            expanded[elems] = True
+
+            found, via = adjacency.gather(self.elem_offsets, self.elem_nodes,
+                elems)
+            source = source[via]
+            keep = ~visited[found]
+            found, source = found[keep], source[keep]
+            found = found[np.lexsort( (found, self.degree[found], source) )]
+            first = np.unique(found, return_index=True)[1]
+            level = found[np.sort(first)]
+            visited[level] = True
+
+    def peripheral(self, start, visited):
+        """Returns a node far from the start node (a pseudo-peripheral node),
+        found as by George and Liu from repeated breadth-first searches
+        through the unvisited nodes."""
+        np = adjacency.np
+        depth = 0
+        while True:
+            marks = visited.copy()
+            levels = list(self.levels(start, marks))
+            if len(levels) <= depth:
+                return start
+            depth = len(levels)
+            last = levels[-1]
+            candidate = last[np.argmin(self.degree[last])]
+            if candidate == start:
+                return start
+            start = candidate
+
+    def rcm(self):
+        """Returns the positions of the nodes in Reverse Cuthill-McKee
+        order."""
+        np = adjacency.np
+        visited = self.degree == 0
+        order = list()
+        for start in np.argsort(self.degree, kind='mergesort'):
+            if visited[start]:
+                continue
+            start = self.peripheral(start, visited)
+            order.extend(self.levels(start, visited))
+        order = np.concatenate(order)[::-1] if order else np.zeros(0, np.intp)
+        return np.concatenate( (order, np.flatnonzero(self.degree == 0)) )
+
+    def bandwidth(self, order=None):
+        """Returns the bandwidth and profile with the nodes numbered in the
+        given order (a list of their positions), or as they are."""
+        np = adjacency.np
+        if not len(self.elem_nodes):
+            return 0, 0
+        rank = np.arange(len(self.degree))
+        if order is not None:
+            rank[order] = rank.copy()
+        positions = rank[self.elem_nodes]
+        starts = self.elem_offsets[:-1]
+        lowest = np.minimum.reduceat(positions, starts)
+        highest = np.maximum.reduceat(positions, starts)
+        # The furthest earlier neighbour of each node is the lowest node of
+        # any of its elements.
+        used = np.flatnonzero(self.degree > 0)
+        reach = np.minimum.reduceat(lowest[self.node_elems],
+            self.node_offsets[used])
+        return int((highest - lowest).max()), int((rank[used] - reach).sum())
+
+
+
+def rcm(nodes, elements):
+    """Returns the positions in nodes of the nodes in Reverse Cuthill-McKee
+    order, as a NumPy array.  Each connected part of the mesh is ordered in
+    turn, and nodes used by no element are put last."""
+    return _Graph(nodes, elements).rcm()
+
+
+def bandwidth(nodes, elements):
+    """Returns the bandwidth and profile of the matrix connecting the given
+    nodes, numbered in the order given, through the given elements.  The
+    bandwidth is the largest difference between the positions of two nodes
+    of an element, and the profile is the sum over all nodes of the distance
+    back to their furthest earlier neighbour."""
+    return _Graph(nodes, elements).bandwidth()
+
+
+
+# Bits of each coordinate used in Morton keys; three fit in 64 bits.
+MORTON_BITS = 21
+
+
+def _spread(x):
+    """Spreads the lowest MORTON_BITS bits of each value in a uint64 array
+    out to every third bit."""
+    np = adjacency.np
+    for shift, mask in ((32, 0x1f00000000ffff), (16, 0x1f0000ff0000ff),
+            (8, 0x100f00f00f00f00f), (4, 0x10c30c30c30c30c3),
+            (2, 0x1249249249249249)):
+        x = (x | (x << np.uint64(shift))) & np.uint64(mask)
+    return x
+
+
+def morton_keys(points):
+    """Returns the Morton key of each point in an array of shape (n, 3),
+    within the points' bounding box."""
+    np = adjacency.np
+    adjacency._require_numpy()
+    if not len(points):
+        return np.zeros(0, np.uint64)
+    low = points.min(axis=0)
+    span = points.max(axis=0) - low
+    scale = (2**MORTON_BITS - 1) / np.where(span > 0, span, 1)
+    cells = ((points - low) * scale).astype(np.uint64)
+    return (_spread(cells[:,0]) | (_spread(cells[:,1]) << np.uint64(1))
+        | (_spread(cells[:,2]) << np.uint64(2)))
+
+
+def centroids(elements):
+    """Returns the average of each element's node positions, as an array of
+    shape (n, 3)."""
+    np = adjacency.np
+    adjacency._require_numpy()
+    result = np.empty( (len(elements), 3) )
+    by_size = dict()
+    for i,e in enumerate(elements):
+        by_size.setdefault(len(e._nodes), list()).append(i)
+    for k, positions in by_size.iteritems():
+        coords = np.fromiter( chain.from_iterable(chain.from_iterable(
+            [ n._pos for n in elements[i]._nodes ] for i in positions )),
+            float, 3*k*len(positions) )
+        result[positions] = coords.reshape(-1, k, 3).mean(axis=1)
+    return result
+
+
+def morton(elements):
+    """Returns a list of the given elements (or any objects with nodes)
+    sorted along a Morton curve through their centroids.  Elements with the
+    same key are sorted by their centroids, so the order doesn't depend on
+    the order given."""
+    np = adjacency.np
+    elements = list(elements)
+    points = centroids(elements)
+    order = np.lexsort( (points[:,2], points[:,1], points[:,0],
+        morton_keys(points)) )
+    return [ elements[i] for i in order ]
@@ -0,0 +1,201 @@
+"""
+Contains functions for splitting a problem's elements into balanced, compact
+partitions, eg. to share work between processes.
+
+Elements are split by recursive bisection of their centroids: each part is cut
+in two across its principal (inertial) axis, or its longest coordinate axis,
+with the sizes of the two halves kept in proportion to the number of
+partitions each will hold.  Partitions found this way can then be refined by
+moving elements across the boundaries between partitions where this reduces
+the number of faces shared between partitions.  NumPy is only needed when
+these functions are used.
+"""
+from itertools import chain
+
+from . import problem, adjacency, geometry as geo, instrument
+from ._formats._common import _nodes_and_elements, _numbered, ESET
+
+
+# Partitions are kept within this fraction of the average partition size while
+# refining.
+IMBALANCE = 0.03
+
+
+def _axis(points, method):
+    "Returns the axis to cut a group of points across, as a unit vector."
+    np = adjacency.np
+    if method == 'coordinate':
+        axis = np.zeros(3)
+        axis[np.argmax(points.max(axis=0) - points.min(axis=0))] = 1
+        return axis
+    centred = points - points.mean(axis=0)
+    # The principal axis is the eigenvector with the largest eigenvalue.  Its
+    # sign is arbitrary, so it is turned to point along its largest component.
+    axis = np.linalg.eigh(np.dot(centred.T, centred))[1][:,-1]
+    return axis if axis[np.argmax(np.abs(axis))] > 0 else -axis
+
+
+def bisect(points, k, method='inertial'):
+    """Returns the partition number (0 to k-1) of each point in an array of
+    shape (n, 3), found by recursive bisection.  method is "inertial" to cut
+    across the principal axis of each group of points, or "coordinate" to cut
+    across its longest coordinate axis.  Partition sizes differ by at most
+    one."""
+    np = adjacency.np
+    adjacency._require_numpy()
+    if method not in ('inertial', 'coordinate'):
+        raise ValueError('Unknown bisection method: %s' % method)
+    if k < 1:
+        raise ValueError('At least one partition is needed.')
+    parts = np.zeros(len(points), np.intp)
+    # Each group of points is (their positions, first partition number, number
+    # of partitions).
+    groups = [ (np.arange(len(points)), 0, k) ]
+    while groups:
+        rows, first, count = groups.pop()
+        if count == 1 or len(rows) == 0:
+            parts[rows] = first
+            continue
+        low = count // 2
+        split = len(rows) * low // count
+        distance = np.dot(points[rows], _axis(points[rows], method))
+        # Ties are broken by position, so the result doesn't depend on the
+        # platform's partitioning algorithm.
+        order = np.lexsort( (rows, distance) )
+        groups.append( (rows[order[:split]], first, low) )
+        groups.append( (rows[order[split:]], first + low, count - low) )
+    return parts
+
+
+def cut(offsets, indices, parts):
+    """Returns the number of pairs of neighbours in different partitions,
+    given the neighbours of each element as CSR arrays (see
+    adjacency.face_neighbours)."""
+    np = adjacency.np
+    rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    return int((parts[rows] != parts[indices]).sum()) // 2
+
+
+def refine(offsets, indices, parts, k, passes=8, imbalance=IMBALANCE):
+    """Improves partitions in place by greedily moving elements to the
+    partition holding most of their neighbours, given the neighbours of each
+    element as CSR arrays.  Only moves which reduce the number of neighbours
+    in different partitions are made, and partition sizes are kept within
+    the given fraction of the average (or where they were, if further).
+    Returns the number of elements moved."""
+    np = adjacency.np
+    n = len(parts)
+    rows = np.repeat(np.arange(n), np.diff(offsets))
+    sizes = np.bincount(parts, minlength=k)
+    largest = max(int(np.ceil(n / float(k) * (1 + imbalance))), sizes.max())
+    smallest = min(int(np.floor(n / float(k) * (1 - imbalance))), sizes.min())
+    moved = idle = 0
+    for i in xrange(passes):
+        # Count the neighbours each element has in each partition.
+        keys, links = np.unique(rows * k + parts[indices], return_counts=True)
+        elems, targets = keys // k, keys % k
+        own = np.zeros(n, np.intp)
+        mine = targets == parts[elems]
+        own[elems[mine]] = links[mine]
+        gain = links - own[elems]
+        sources = parts[elems]
+        # Moves are made in only one direction between any two partitions in
+        # each pass, so neighbours can't swap places with each other.
+        forward = targets > sources if i % 2 == 0 else targets < sources
+        keep = (gain > 0) & forward
+        elems, sources, targets, gain = (elems[keep], sources[keep],
+            targets[keep], gain[keep])
+        # Each element goes to its best partition, and the best moves are
+        # made first while there is room.
+        order = np.lexsort( (targets, -gain, elems) )
+        best = np.unique(elems[order], return_index=True)[1]
+        chosen = order[best]
+        elems, sources, targets, gain = (elems[chosen], sources[chosen],
+            targets[chosen], gain[chosen])
+        order = np.lexsort( (elems, -gain) )
+        elems, sources, targets = elems[order], sources[order], targets[order]
+        arriving = _rank(targets, k)
+        leaving = _rank(sources, k)
+        keep = ( (arriving < largest - sizes[targets])
+            & (leaving < sizes[sources] - smallest) )
+        elems, sources, targets = elems[keep], sources[keep], targets[keep]
+        if not len(elems):
+            # Stop once there is nothing to move in either direction.
+            idle += 1
+            if idle == 2:
+                break
+            continue
+        idle = 0
+        parts[elems] = targets
+        sizes += (np.bincount(targets, minlength=k)
+            - np.bincount(sources, minlength=k))
+        moved += len(elems)
+    return moved
+
+
+def _rank(groups, k):
+    "Returns the position of each entry among those of the same group."
+    np = adjacency.np
+    order = np.argsort(groups, kind='mergesort')
+    counts = np.bincount(groups, minlength=k)
+    starts = np.cumsum(counts) - counts
+    rank = np.empty(len(groups), np.intp)
+    rank[order] = np.arange(len(groups)) - np.repeat(starts, counts)
+    return rank
+
+
+
+def partition(self, k, method='inertial', passes=8, set_prefix=None):
+    """Splits the problem's solid, shell and spring elements into k
+    partitions of nearly equal size by recursive bisection of their centroids
+    (see bisect), then reduces the faces shared between partitions by moving
+    elements across their boundaries, in up to the given number of passes
+    (see refine).  Returns a dict giving each element's partition number,
+    from 0 to k-1.
+
+    If set_prefix is given, each partition's elements are also stored as a
+    set named set_prefix followed by the partition's number, from 1 to k.
+    Raises ValueError, before partitioning, if any of these sets exists."""
+    adjacency._require_numpy()
+    np = adjacency.np
+    if set_prefix is not None:
+        names = [ '%s%d' % (set_prefix, i+1) for i in xrange(k) ]
+        used = [ name for name in names if name in self.sets ]
+        if used:
+            raise ValueError('Set "%s" already exists.' % used[0])
+    with instrument.phase('gather'):
+        elements = [ e for e in _nodes_and_elements(self, False)[1]
+            if not isinstance(e, geo.SurfaceElement) ]
+        elements = _numbered(elements, self.sets, ESET)
+        nodes = set()
+        for e in elements:
+            nodes.update(e._nodes)
+        nodes = list(nodes)
+        index = dict( (n, i) for i,n in enumerate(nodes) )
+        offsets, indices = adjacency.connectivity(elements, index)
+        coords = np.fromiter( chain.from_iterable( n._pos for n in nodes ),
+            float, 3*len(nodes) ).reshape(-1, 3)
+    instrument.count('elements', len(elements))
+    with instrument.phase('bisect'):
+        if elements:
+            points = (np.add.reduceat(coords[indices], offsets[:-1])
+                / np.diff(offsets)[:,None])
+        else:
+            points = np.zeros( (0, 3) )
+        parts = bisect(points, k, method)
+    if passes:
+        with instrument.phase('refine'):
+            offsets, indices = adjacency.face_neighbours(elements, offsets,
+                indices)
+            instrument.count('cut before', cut(offsets, indices, parts))
+            refine(offsets, indices, parts, k, passes)
+            instrument.count('cut after', cut(offsets, indices, parts))
+
+    if set_prefix is not None:
+        for name in names:
+            self.sets[name] = set()
+        for e, part in zip(elements, parts.tolist()):
+            self.sets[names[part]].add(e)
+    return dict(zip(elements, parts.tolist()))
+
+problem.FEproblem.partition = partition
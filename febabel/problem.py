@@ -1,7 +1,9 @@
-import os
+import copy
 from itertools import chain
 
 from .common import Base, Switch
+from . import common
+from . import instrument
 
 
 class FEproblem(Base):
@@ -12,6 +14,9 @@ class FEproblem(Base):
                             else TimeStepper(0,0) )
         self.options = options if options is not None else dict()
         self.sets = dict()
+        # Counters of the changes made to each part of the problem, while
+        # anything is watching for them (see common.touch).
+        self.generations = dict.fromkeys(common.parts, 0)
 
     def get_children(self):
         s = set(chain( *self.sets.values() ))
@@ -19,18 +24,98 @@ class FEproblem(Base):
         return s
 
 
-    def read(self, filename):
+    def clone(self):
+        """Returns a new problem with its own sets, options and time stepper,
+        and its own copy of each element in its sets, which share this one's
+        nodes, materials and all other objects.  Materials giving the fiber
+        direction of each element (see ElementOrientation) are copied too,
+        along with their axes, for the element copies to use.
+        Sets, and elements' materials and thicknesses, can be changed freely in
+        the clone without affecting this problem.  To change another object
+        (eg. a material's parameters, or a node) in only the clone, replace it
+        with a modified copy rather than modifying it."""
+        from ._formats._cache import copy_sets
+        from .materials import ElementOrientation
+        p = self.__class__(copy.copy(self.timestepper), dict(self.options))
+        copies = dict()
+        p.sets = copy_sets(self.sets, nodes=False, memo=copies)
+        # Element copies keep the fiber directions given to their originals.
+        materials = dict()
+        for e, new in copies.iteritems():
+            m = e._material
+            axis = getattr(m, 'axis', None)
+            if not isinstance(axis, ElementOrientation):
+                continue
+            if m not in materials:
+                materials[m] = copy.copy(m)
+                materials[m].axis = ElementOrientation()
+            new._material = materials[m]
+            if e in axis.vectors:
+                new._material.axis.vectors[new] = axis.vectors[e]
+        return p
+
+
+    # Methods added by other modules, which are only imported when one of
+    # their methods is first needed, and the module adding each.
+    lazy_methods = {
+        'adjacency': 'adjacency',
+        'check_elements': 'quality',
+        'compact': 'compact',
+        'dedupe': 'dedupe',
+        'memory_report': 'memory',
+        'partition': 'partition',
+        'refine': 'refine',
+        'to_simplices': 'simplex',
+    }
+
+    def __getattr__(self, name):
+        if name in self.lazy_methods:
+            __import__('febabel.%s' % self.lazy_methods[name])
+            return object.__getattribute__(self, name)
+        # Readers and writers (eg. read_inp) are added by their format's
+        # module, which is only imported when first needed.
+        kind, _, ext = name.partition('_')
+        if kind in ('read', 'write') and ext:
+            from . import _formats
+            if ext in _formats.FORMATS:
+                _formats.load(ext)
+                try:
+                    return object.__getattribute__(self, name)
+                except AttributeError:
+                    pass
+        raise AttributeError("'%s' object has no attribute '%s'"
+            % (self.__class__.__name__, name))
+
+
+    def read(self, filename, **kwargs):
         """Convenience function to run the appropriate reader method.
-        Currently guesses based on file extension."""
-        ext = os.path.splitext(filename)[1][1:]
-        getattr(self, 'read_%s'%ext)(filename)
-
-    def write(self, filename):
+        The format is given by the file's extension, ignoring any compression
+        suffix (".gz", ".bz2" or ".xz"), or if that isn't a known format, by
+        the start of the file's contents (see _formats.format_of).
+        Compressed files are decompressed as they are read.  Any keyword
+        arguments are passed on to the reader."""
+        from . import _formats
+        ext = _formats.format_of(filename)
+        _formats.load(ext)
+        with instrument.phase('read_%s'%ext):
+            getattr(self, 'read_%s'%ext)(filename, **kwargs)
+
+    def write(self, filename, compresslevel=None, **kwargs):
         """Convenience function to run the appropriate writer method.
-        Currently guesses based on file extension."""
-        ext = os.path.splitext(filename)[1][1:]
-        getattr(self, 'write_%s'%ext)(filename)
-
+        The format is given by the file's extension.  If the file name ends in
+        ".gz", ".bz2" or ".xz", the file is compressed as it is written, at
+        compresslevel (1 to 9) if given.  Any other keyword arguments are
+        passed on to the writer."""
+        from . import _formats
+        ext = _formats.format_of(filename, False)
+        _formats.load(ext)
+        with instrument.phase('write_%s'%ext):
+            if _formats._compress.split(filename)[1] is None:
+                getattr(self, 'write_%s'%ext)(filename, **kwargs)
+            else:
+                with _formats._compress.open(filename, 'wb',
+                        compresslevel) as f:
+                    getattr(self, 'write_%s'%ext)(f, **kwargs)
 
 
 class TimeStepper(Base):
@@ -0,0 +1,262 @@
+"""
+Contains functions for measuring the geometry and quality of elements.
+
+Elements are measured in blocks of a single type, with their node
+coordinates gathered into a NumPy array of shape (elements, nodes, 3), so
+that even millions of elements can be measured in a few seconds.  NumPy is
+only needed when these functions are used.
+
+FEproblem.check_elements uses these to find inverted, degenerate and badly
+shaped elements before a problem is handed to a solver.
+"""
+from itertools import chain
+from math import sqrt
+
+from . import problem, common, geometry as geo, instrument
+from ._formats._common import _nodes_and_elements
+
+np = common.optional_module('numpy')
+
+
+def _corners(cls):
+    """Returns the corners of a solid element type, each as its node and its
+    three neighbours in right-handed order, found from the element's
+    outward faces."""
+    corners = list()
+    for v in xrange(cls.n_nodes):
+        # Going backwards round a face from outside, then into the element.
+        face = next( f for f in cls.faces if v in f )
+        i = face.index(v)
+        behind, ahead = face[i-1], face[(i+1) % len(face)]
+        inner, = [ a if b == v else b for a,b in cls.edges
+            if v in (a,b) and not set((a,b)) & set((behind, ahead)) ]
+        corners.append( (v, behind, ahead, inner) )
+    return tuple(corners)
+
+# Nodes meeting at each corner of each solid element type, as (corner node,
+# and its three neighbours in right-handed order).
+corner_map = dict( (cls, _corners(cls))
+    for cls in (geo.Tet4, geo.Pent6, geo.Hex8) )
+
+# Scale giving a scaled Jacobian of 1 for each ideally-shaped element type
+# (regular tetrahedra and triangles, right equilateral wedges, cubes and
+# squares).
+jacobian_scale = {
+    geo.Tet4: sqrt(2),
+    geo.Pent6: 2 / sqrt(3),
+    geo.Hex8: 1.0,
+    geo.Shell3: 2 / sqrt(3),
+    geo.Surface3: 2 / sqrt(3),
+    geo.Shell4: 1.0,
+    geo.Surface4: 1.0,
+}
+
+# Pairs of nodes making each edge of each element type.
+edge_map = dict( (cls, cls.edges) for cls in (geo.Tet4, geo.Pent6, geo.Hex8,
+    geo.Shell3, geo.Surface3, geo.Shell4, geo.Surface4) )
+
+# Element types which have an area rather than a volume.
+surface_types = (geo.Shell3, geo.Shell4, geo.Surface3, geo.Surface4)
+
+# Scaled Jacobians closer to 0 than this count as degenerate.
+DEGENERATE = 1e-6
+
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('Measuring elements requires NumPy.')
+
+
+def blocks(elements):
+    """Sorts elements into blocks of a single type.  Returns a dict giving
+    (list of elements, array of their node coordinates) for each element
+    type.  Springs, and types not in edge_map, are left out."""
+    _require_numpy()
+    by_type = dict()
+    for e in elements:
+        if e.__class__ in edge_map:
+            by_type.setdefault(e.__class__, list()).append(e)
+
+    result = dict()
+    for cls, elements in by_type.iteritems():
+        k = len(elements[0])
+        coords = np.fromiter( chain.from_iterable(chain.from_iterable(
+            [ n._pos for n in e._nodes ] for e in elements )),
+            float, 3*k*len(elements) )
+        result[cls] = (elements, coords.reshape(-1, k, 3))
+    return result
+
+
+
+def centroids(coords):
+    "Returns the average of each element's node coordinates."
+    return coords.mean(axis=1)
+
+
+def _triple(a, b, c):
+    """Returns the triple products a . (b x c) of arrays of vectors, or the
+    determinants of matrices with columns a, b and c."""
+    a0, a1, a2 = a[...,0], a[...,1], a[...,2]
+    b0, b1, b2 = b[...,0], b[...,1], b[...,2]
+    c0, c1, c2 = c[...,0], c[...,1], c[...,2]
+    return a0*(b1*c2 - b2*c1) + a1*(b2*c0 - b0*c2) + a2*(b0*c1 - b1*c0)
+
+
+def _cross(a, b):
+    "Returns the cross products of arrays of vectors."
+    a0, a1, a2 = a[...,0], a[...,1], a[...,2]
+    b0, b1, b2 = b[...,0], b[...,1], b[...,2]
+    return np.concatenate([ (a1*b2 - a2*b1)[...,None],
+        (a2*b0 - a0*b2)[...,None], (a0*b1 - a1*b0)[...,None] ], axis=-1)
+
+
+def _quadrature(cls):
+    """Returns the derivatives of an element type's shape functions at its
+    integration points, as an array of shape (points, nodes, 3), and the
+    weights of those points."""
+    if cls is geo.Hex8:
+        g = 1 / sqrt(3)
+        signs = np.array([ (-1,-1,-1), (1,-1,-1), (1,1,-1), (-1,1,-1),
+            (-1,-1,1), (1,-1,1), (1,1,1), (-1,1,1) ], float)
+        points = signs * g
+        # dN_i/dx_j = s_ij/8 * product of (1 + s_ik x_k) over k != j.
+        terms = 1 + points[:,None,:] * signs[None,:,:]
+        dN = np.empty( (8, 8, 3) )
+        for j in xrange(3):
+            others = [ k for k in xrange(3) if k != j ]
+            dN[:,:,j] = (signs[None,:,j] / 8.0 * terms[:,:,others[0]]
+                * terms[:,:,others[1]])
+        return dN, np.ones(8)
+    if cls is geo.Pent6:
+        # Three points on the triangle, by two along the wedge's length.
+        g = 1 / sqrt(3)
+        dN = list()
+        for r,s in ((1/6.0, 1/6.0), (2/3.0, 1/6.0), (1/6.0, 2/3.0)):
+            for t in (-g, g):
+                lo, hi = (1-t) / 2, (1+t) / 2
+                tri = 1 - r - s
+                dN.append([
+                    (-lo, -lo, -tri/2), (lo, 0, -r/2), (0, lo, -s/2),
+                    (-hi, -hi, tri/2), (hi, 0, r/2), (0, hi, s/2) ])
+        return np.array(dN), np.ones(6) / 6.0
+    raise TypeError('No integration rule for %s.' % cls.__name__)
+
+
+def volumes(cls, coords):
+    """Returns the volume of each solid element of the given type.  Inverted
+    elements have negative volumes."""
+    if cls is geo.Tet4:
+        d = coords[:,1:] - coords[:,:1]
+        return _triple(d[:,0], d[:,1], d[:,2]) / 6.0
+    # Integrate the Jacobian determinant; the rules used are exact for these
+    # element types.
+    dN, weights = _quadrature(cls)
+    n, k = coords.shape[:2]
+    # J[e,i,q,j] is the derivative of coordinate i by natural coordinate j
+    # at integration point q of element e.
+    J = np.dot( coords.transpose(0,2,1).reshape(-1, k),
+        dN.transpose(1,0,2).reshape(k, -1) ).reshape(n, 3, len(weights), 3)
+    J = J.transpose(0,2,1,3)
+    return _triple(J[...,0], J[...,1], J[...,2]).dot(weights)
+
+
+def areas(cls, coords):
+    """Returns the area of each shell or surface element of the given type.
+    The area of a quadrilateral is taken as half the cross product of its
+    diagonals, which is exact if it is planar."""
+    if coords.shape[1] == 3:
+        a, b = coords[:,1] - coords[:,0], coords[:,2] - coords[:,0]
+    else:
+        a, b = coords[:,2] - coords[:,0], coords[:,3] - coords[:,1]
+    return np.sqrt( (_cross(a, b)**2).sum(axis=-1) ) / 2
+
+
+def _unit(v):
+    "Normalizes an array of vectors, leaving zero-length vectors at zero."
+    length = np.sqrt( (v*v).sum(axis=-1) )[...,None]
+    return v / np.where(length > 0, length, 1)
+
+
+def scaled_jacobians(cls, coords):
+    """Returns the minimum scaled Jacobian of each element of the given type:
+    the Jacobian at each corner, calculated from unit vectors along the
+    corner's edges.  It is 1 for ideally-shaped elements, 0 for degenerate
+    elements and negative for inverted ones.
+
+    For shells and surfaces, corners are measured about the normal through
+    both diagonals (or of the triangle), so only quadrilaterals can be
+    inverted."""
+    if cls in corner_map:
+        corners = np.array(corner_map[cls])
+        edges = coords[:,corners[:,1:]] - coords[:,corners[:,:1]]
+        lengths = np.sqrt( (edges*edges).sum(axis=-1) ).prod(axis=-1)
+        jac = _triple(edges[:,:,0], edges[:,:,1], edges[:,:,2])
+        jac /= np.where(lengths > 0, lengths, 1)
+    else:
+        k = coords.shape[1]
+        normal = _unit( _cross(*( (coords[:,1] - coords[:,0],
+            coords[:,2] - coords[:,0]) if k == 3
+            else (coords[:,2] - coords[:,0], coords[:,3] - coords[:,1]) )) )
+        ahead = _unit( np.roll(coords, -1, axis=1) - coords )
+        behind = _unit( np.roll(coords, 1, axis=1) - coords )
+        jac = _triple(normal[:,None], ahead, behind)
+    return jac.min(axis=1) * jacobian_scale[cls]
+
+
+def aspect_ratios(cls, coords):
+    """Returns the ratio of each element's longest edge to its shortest.
+    Elements with an edge of zero length have an infinite ratio."""
+    edges = np.array(edge_map[cls])
+    v = coords[:,edges[:,1]] - coords[:,edges[:,0]]
+    lengths = np.sqrt( (v*v).sum(axis=-1) )
+    shortest, longest = lengths.min(axis=1), lengths.max(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(shortest > 0, longest / shortest, np.inf)
+
+
+
+def check_elements(self, min_jacobian=0.0, max_aspect_ratio=None):
+    """Checks the quality of all solid, shell and surface elements in the
+    problem.  Returns a list of (element, description) for each element
+    which is inverted or degenerate, has a minimum scaled Jacobian below
+    min_jacobian, or has an aspect ratio above max_aspect_ratio (if given).
+    Elements are listed from the lowest scaled Jacobian up."""
+    _require_numpy()
+    with instrument.phase('gather'):
+        found = blocks(_nodes_and_elements(self, False)[1])
+
+    bad = list()
+    with instrument.phase('measure'):
+        for cls, (elements, coords) in found.iteritems():
+            instrument.count('elements', len(elements))
+            jac = scaled_jacobians(cls, coords)
+            size = (areas if cls in surface_types else volumes)(cls, coords)
+            if max_aspect_ratio is not None:
+                ratio = aspect_ratios(cls, coords)
+                stretched = ratio > max_aspect_ratio
+            else:
+                stretched = np.zeros(len(elements), bool)
+            degenerate = (np.abs(jac) < DEGENERATE) | (size == 0)
+            inverted = ~degenerate & ( (jac < 0) | (size < 0) )
+            poor = jac < min_jacobian
+
+            for i in np.flatnonzero(degenerate | inverted | poor | stretched):
+                if degenerate[i]:
+                    what = 'degenerate'
+                elif inverted[i]:
+                    what = 'inverted'
+                elif poor[i]:
+                    what = 'poor shape'
+                else:
+                    what = 'stretched'
+                description = '%s %s: scaled Jacobian %.3g' % (what,
+                    cls.__name__, jac[i])
+                if max_aspect_ratio is not None:
+                    description += ', aspect ratio %.3g' % ratio[i]
+                bad.append( (jac[i], elements[i], description) )
+
+    bad.sort(key=lambda b: b[0])
+    return [ (e, description) for j, e, description in bad ]
+
+problem.FEproblem.check_elements = check_elements
@@ -0,0 +1,303 @@
+"""
+Contains a pass refining a problem's mesh uniformly.
+
+Each hexahedron and each tetrahedron is split into 8, and each quadrilateral or
+triangular shell or surface element into 4, with new nodes at the middle of
+each edge, and at the centre of each quadrilateral face and each hexahedron.
+Each new node is found from the sorted nodes of the edge or face it lies on,
+hashed for all elements at once with NumPy, so elements (and surfaces) sharing
+an edge or face share its new nodes, and a conforming mesh stays conforming.
+NumPy is only needed when this pass is used.
+"""
+from collections import defaultdict
+from itertools import chain, product
+
+from . import problem, adjacency, common, geometry as geo, materials as mat, \
+    constraints as con, instrument
+from ._formats._common import ValsDict, NSET, ESET, _numbered
+
+
+
+def _lattice(corners):
+    """Returns the template (see TEMPLATES) for splitting an element in two
+    along each of its axes, given the positions of its corners on a lattice
+    from 0 to 2 along each axis."""
+    lattice = product(range(3), repeat=len(corners[0]))
+    support = dict( (q, tuple( i for i,c in enumerate(corners)
+        if all( a == 1 or a == b for a,b in zip(q, c) ) )) for q in lattice )
+    # The element's own nodes come first, then the points by what they lie on.
+    points = sorted(support.itervalues(), key=lambda p: (len(p), p))
+    position = dict( (p, i) for i,p in enumerate(points) )
+    children = list()
+    for offset in product(range(2), repeat=len(corners[0])):
+        children.append(tuple( position[support[tuple( o + c//2
+            for o,c in zip(offset, corner) )]] for corner in corners ))
+    return points, children
+
+
+# For each element class refined, a template giving the points of a refined
+# element (each as the tuple of the element's nodes it is the centre of, with
+# the element's own nodes first), and the points used by each of its children.
+_HEX = [ (0,0,0), (2,0,0), (2,2,0), (0,2,0), (0,0,2), (2,0,2), (2,2,2),
+    (0,2,2) ]
+_QUAD = [ (0,0), (2,0), (2,2), (0,2) ]
+_TRI = ( [(0,), (1,), (2,), (0,1), (1,2), (0,2)],
+    [(0,3,5), (3,1,4), (5,4,2), (3,4,5)] )
+# The octahedron left after cutting off the tetrahedron's corners is split
+# along the diagonal between the middles of edges 0-2 and 1-3.
+_TET = ( [(0,), (1,), (2,), (3,), (0,1), (0,2), (0,3), (1,2), (1,3), (2,3)],
+    [(0,4,5,6), (4,1,7,8), (5,7,2,9), (6,8,9,3),
+     (5,8,4,7), (5,8,7,9), (5,8,9,6), (5,8,6,4)] )
+TEMPLATES = {
+    geo.Hex8: _lattice(_HEX),
+    geo.Tet4: _TET,
+    geo.Shell4: _lattice(_QUAD),
+    geo.Surface4: _lattice(_QUAD),
+    geo.Shell3: _TRI,
+    geo.Surface3: _TRI,
+}
+
+
+
+def _unique_rows(rows):
+    """Returns the number of distinct rows in an integer array of shape (n,
+    k), and the index of each row among them, from 0 up."""
+    np = adjacency.np
+    if len(rows) == 0:
+        return 0, np.zeros(0, np.intp)
+    # Fold the columns into one key, ranking the keys after each column so
+    # they stay well within range.
+    keys = rows[:,0]
+    for j in xrange(1, rows.shape[1]):
+        keys = adjacency._rank(keys * (rows[:,j].max() + 1) + rows[:,j])
+    return keys.max() + 1, keys
+
+
+
+def _gather(self, classes, kept):
+    """Returns the elements of the given classes held in the problem's sets
+    and contacts, numbered as read where possible (see _numbered), the nodes
+    they use, likewise numbered, and the other objects found.  Raises
+    ValueError if any other element isn't of one of the classes kept."""
+    Node, Element = geo.Node, geo.Element
+    stack = list()
+    for s in self.sets.itervalues():
+        if isinstance(s, dict) and not isinstance(s, ValsDict):
+            continue
+        stack.extend(s)
+    seen, elements, others = set(), list(), list()
+    while stack:
+        x = stack.pop()
+        if x is None or x in seen:
+            continue
+        seen.add(x)
+        if isinstance(x, Element):
+            if x.__class__ in classes:
+                elements.append(x)
+                stack.append(x._material)
+            elif not isinstance(x, kept):
+                raise ValueError('%s elements can\'t be converted.'
+                    % x.__class__.__name__)
+        elif not isinstance(x, Node):
+            others.append(x)
+            stack.extend(x.get_children() or ())
+    elements = _numbered(elements, self.sets, ESET)
+    nodes = set()
+    for e in elements:
+        nodes.update(e._nodes)
+    return elements, _numbered(nodes, self.sets, NSET), others
+
+
+def _connectivity(elements, index):
+    """Returns the index of each node of the given elements, all of the same
+    class, as an array with a row for each element."""
+    np = adjacency.np
+    k = elements[0].n_nodes if elements else 0
+    return np.fromiter( (index[n] for e in elements for n in e._nodes),
+        np.intp, k*len(elements) ).reshape(-1, k)
+
+
+def _node_array(nodes):
+    """Returns an array of the given nodes, for looking up the nodes of many
+    elements at once.  Nodes look like sequences to NumPy, so they are put in
+    one by one."""
+    array = adjacency.np.empty(len(nodes), object)
+    for i, n in enumerate(nodes):
+        array[i] = n
+    return array
+
+
+def _split(found, cls, parents, rows):
+    """Creates the elements of the given class each of the parents is split
+    into, each with its parent's material (and thickness, for shells), and
+    adds the lists of them to the dict found.  rows is an array of Nodes,
+    with a row for each new element, those of each parent consecutive."""
+    count = len(rows) // len(parents) if parents else 0
+    rows = iter(rows.tolist())
+    shell = issubclass(cls, geo.ShellElement)
+    for e in parents:
+        made = list()
+        attrs = getattr(e, '__dict__', None)
+        for i in xrange(count):
+            new = cls.__new__(cls)
+            new._nodes = rows.next()
+            new._material = e._material
+            if shell:
+                new.thickness = e.thickness
+            if attrs:
+                new.__dict__.update(attrs)
+            made.append(new)
+        found[e] = made
+
+
+def _replace(self, found, others, added=None):
+    """Replaces each element in the dict found by the list of elements it
+    was split into, in the problem's sets, contact surfaces and
+    ElementOrientations.  added, if given, returns the new nodes to add to a
+    set of nodes (including rigid interfaces) given its nodes.  Sets read
+    from files ("<file>:allelements") number each element's replacements
+    consecutively, in the order of their IDs, and new nodes after the
+    existing ones."""
+    Node = geo.Node
+    def split(items):
+        return chain.from_iterable( found.get(x, (x,)) for x in items )
+
+    for name, s in self.sets.items():
+        if isinstance(s, dict) and not isinstance(s, ValsDict):
+            continue
+        members = [ x for x in s if isinstance(x, Node) ] if added else []
+        replaced = any( x in found for x in s )
+        if not (members or replaced):
+            continue
+        extra = added(members) if members else []
+        if isinstance(s, ValsDict):
+            if replaced:
+                keys = sorted(s.iterkeys(),
+                    key=lambda k: (0, int(k)) if k.isdigit() else (1, k))
+                new = ValsDict( (str(i+1), x) for i,x in
+                    enumerate(split(map(s.__getitem__, keys))) )
+            else:
+                new = ValsDict(s.iteritems())
+            start = max([ int(k) for k in new.iterkeys() if k.isdigit() ]
+                or [0]) + 1
+            new.update( (str(start+i), n) for i,n in enumerate(extra) )
+        else:
+            new = s.__class__(chain(split(s), extra))
+        self.sets[name] = new
+    for x in others:
+        if isinstance(x, con.RigidInterface):
+            if added:
+                x.nodes = x.nodes.union(added(x.nodes))
+        elif isinstance(x, con.Contact) and hasattr(x, 'master'):
+            x.master = set(split(x.master))
+            x.slave = set(split(x.slave))
+        elif isinstance(x, mat.ElementOrientation):
+            for e in found:
+                if e in x.vectors:
+                    v = x.vectors.pop(e)
+                    x.vectors.update( (c, v) for c in found[e] )
+    # Elements were created and sets replaced directly, so record the changes
+    # here.
+    common.touch(self, 'geometry', 'connectivity', 'materials', 'boundary', 'steps')
+
+
+
+def _refine_once(self):
+    "Refines the problem's mesh once; see refine."
+    np = adjacency.np
+    with instrument.phase('gather'):
+        elements, nodes, others = _gather(self, TEMPLATES, geo.Spring)
+        index = dict( (n, i) for i,n in enumerate(nodes) )
+        coords = np.fromiter( chain.from_iterable( n._pos for n in nodes ),
+            float, 3*len(nodes) ).reshape(-1, 3)
+        by_class = defaultdict(list)
+        for e in elements:
+            by_class[e.__class__].append(e)
+
+    with instrument.phase('hash'):
+        # The nodes of each element, and of the edges (2 nodes), faces (4)
+        # and hexahedra (8) new nodes are put on the centres of.
+        blocks, supports = list(), defaultdict(list)
+        for cls in sorted(by_class, key=lambda cls: cls.__name__):
+            es = by_class[cls]
+            conn = _connectivity(es, index)
+            places = list()
+            for p in TEMPLATES[cls][0][cls.n_nodes:]:
+                places.append( (len(p), sum(map(len, supports[len(p)]))) )
+                supports[len(p)].append(np.sort(conn[:,list(p)], axis=1))
+            blocks.append( (cls, es, conn, places) )
+        # Number the distinct edges, faces and hexahedra as the new nodes.
+        first, rows, ids = len(nodes), list(), dict()
+        for size in sorted(supports):
+            all_rows = np.concatenate(supports[size])
+            count, ids[size] = _unique_rows(all_rows)
+            ids[size] += first
+            kept = np.zeros(count, np.intp)
+            kept[ids[size] - first] = np.arange(len(all_rows))
+            rows.append(all_rows[kept])
+            first += count
+        new_coords = [ coords[r].mean(axis=1) for r in rows ]
+    instrument.count('nodes added', first - len(nodes))
+
+    with instrument.phase('split'):
+        all_nodes = nodes + [ geo.Node(x) for x in
+            chain.from_iterable( c.tolist() for c in new_coords ) ]
+        node_array = _node_array(all_nodes)
+        found = dict()
+        for cls, es, conn, places in blocks:
+            k = cls.n_nodes
+            table = np.empty( (len(es), k + len(places)), np.intp )
+            table[:,:k] = conn
+            for j, (size, start) in enumerate(places):
+                table[:,k+j] = ids[size][start:start+len(es)]
+            children = list(chain.from_iterable(TEMPLATES[cls][1]))
+            _split(found, cls, es, node_array[table[:,children].reshape(-1,
+                k)])
+    instrument.count('elements refined', len(found))
+
+    def added(members):
+        """Returns the new nodes all of whose parent nodes are among the given
+        nodes."""
+        inside = np.zeros(len(nodes), bool)
+        inside[[ index[n] for n in members if n in index ]] = True
+        hits = [ np.flatnonzero(inside[r].all(axis=1)) for r in rows ]
+        offsets = np.cumsum([len(nodes)] + [ len(r) for r in rows ])
+        return [ all_nodes[i] for i in chain.from_iterable( (h + o).tolist()
+            for h,o in zip(hits, offsets) ) ]
+
+    with instrument.phase('rebuild'):
+        _replace(self, found, others, added)
+    return found
+
+
+def refine(self, levels=1):
+    """Refines the problem's mesh uniformly the given number of times: each
+    Hex8 and Tet4 element is split into 8, and each Shell4, Shell3, Surface4
+    and Surface3 element into 4, of the same material (and thickness).  Nodes
+    are added at the middle of each edge and the centre of each quadrilateral
+    face and hexahedron, shared by all elements using that edge or face.
+    Springs and the original nodes are kept as they are.
+
+    Elements are replaced by their children in every set, contact surface and
+    ElementOrientation, and each set of nodes (including rigid interfaces)
+    gains the new nodes between its nodes, ie. whose edge or face has all its
+    nodes in the set.  Sets read from files ("<file>:allelements") number
+    each element's children consecutively, in the order of the parents' IDs,
+    and new nodes are numbered after the existing ones.  Returns a dict
+    giving the list of elements each original element was split into.
+
+    Raises ValueError, leaving the problem unchanged, if it holds any other
+    kind of element."""
+    adjacency._require_numpy()
+    children = dict()
+    for level in xrange(levels):
+        found = _refine_once(self)
+        if level == 0:
+            children = found
+        else:
+            for e, kids in children.iteritems():
+                children[e] = list(chain.from_iterable( found.get(c, (c,))
+                    for c in kids ))
+    return children
+
+problem.FEproblem.refine = refine
@@ -0,0 +1,101 @@
+"""
+Contains a pass converting a problem's mesh to simplices: Hex8 and Pent6
+elements are split into Tet4s, and Shell4 and Surface4 elements into
+triangles.
+
+Each solid is split into the tetrahedra joining its lowest-numbered node to
+the triangles of the faces not touching it, with each quadrilateral face cut
+along the diagonal through its own lowest-numbered node.  As that diagonal
+depends only on the face's nodes, elements (and surfaces) sharing a face cut
+it the same way, and a conforming mesh stays conforming.  Every element of a
+class is split at once, as arrays of node indices, with NumPy.
+"""
+from . import problem, adjacency, geometry as geo, instrument
+from .refine import _gather, _connectivity, _node_array, _split, _replace
+
+
+# The class of the elements each class is split into.
+SIMPLICES = {
+    geo.Hex8: geo.Tet4,
+    geo.Pent6: geo.Tet4,
+    geo.Shell4: geo.Shell3,
+    geo.Surface4: geo.Surface3,
+}
+
+
+
+def _triangles(conn, faces):
+    """Returns the triangles each of the given polygons is cut into, as an
+    array of shape (n, number of triangles, 3) of positions in the rows of
+    conn.  faces is an array giving the positions of the nodes of one face
+    for each row, in order around it.  Quadrilaterals are cut along the
+    diagonal through their lowest-numbered node."""
+    np = adjacency.np
+    if faces.shape[1] == 3:
+        return faces[:,None,:]
+    rows = np.arange(len(conn))[:,None]
+    first = conn[rows, faces].argmin(axis=1)
+    q = faces[rows, (first[:,None] + np.arange(4)) % 4]
+    return np.stack( (q[:,[0,1,2]], q[:,[0,2,3]]), axis=1 )
+
+
+def _tetrahedra(cls, conn):
+    """Returns the tetrahedra each solid of the given class is split into, as
+    an array of shape (n, number of tetrahedra, 4) of positions in the rows
+    of conn."""
+    np = adjacency.np
+    k = cls.n_nodes
+    # The faces away from each node, in the same order of sizes for every
+    # node.
+    away = [ sorted( (f for f in cls.faces if v not in f), key=len )
+        for v in xrange(k) ]
+    apex = conn.argmin(axis=1)
+    tets = list()
+    for j in xrange(len(away[0])):
+        faces = np.array([ away[v][j] for v in xrange(k) ])[apex]
+        triangles = _triangles(conn, faces)
+        tets.append(np.concatenate( (np.broadcast_to(apex[:,None,None],
+            triangles.shape[:2] + (1,)), triangles), axis=2 ))
+    return np.concatenate(tets, axis=1)
+
+
+def to_simplices(self):
+    """Converts the problem's mesh to simplices: each Hex8 is split into 6
+    Tet4 elements, each Pent6 into 3, and each Shell4 and Surface4 into 2
+    Shell3 or Surface3 elements, of the same material (and thickness).  No
+    nodes are added; elements sharing a face are split to match (see
+    above).  Tet4, Shell3, Surface3 and Spring elements are kept as they are.
+
+    Elements are replaced by the ones they were split into in every set,
+    contact surface and ElementOrientation.  Sets read from files
+    ("<file>:allelements") number the elements each was split into
+    consecutively, in the order of their IDs.  Returns a dict giving the
+    list of elements each element was split into."""
+    adjacency._require_numpy()
+    np = adjacency.np
+    with instrument.phase('gather'):
+        elements, nodes, others = _gather(self, SIMPLICES,
+            (geo.Tet4, geo.Shell3, geo.Surface3, geo.Spring))
+        index = dict( (n, i) for i,n in enumerate(nodes) )
+        node_array = _node_array(nodes)
+    with instrument.phase('split'):
+        found = dict()
+        for cls in sorted(SIMPLICES, key=lambda cls: cls.__name__):
+            es = [ e for e in elements if e.__class__ is cls ]
+            if not es:
+                continue
+            conn = _connectivity(es, index)
+            if cls.faces:
+                local = _tetrahedra(cls, conn)
+            else:
+                local = _triangles(conn, np.tile(np.arange(4), (len(es), 1)))
+            rows = np.arange(len(es))[:,None,None]
+            new = SIMPLICES[cls]
+            _split(found, new, es, node_array[conn[rows, local]].reshape(-1,
+                new.n_nodes))
+    instrument.count('elements split', len(found))
+    with instrument.phase('rebuild'):
+        _replace(self, found, others)
+    return found
+
+problem.FEproblem.to_simplices = to_simplices
@@ -0,0 +1,116 @@
+"""
+Contains functions for writing many variants of one problem to .feb files,
+where the variants differ only in some parameters (material coefficients,
+loadcurve scales, constraint multipliers, etc.).
+
+The geometry is only rendered once and shared by every variant, and variants
+can be written in parallel.
+"""
+from __future__ import with_statement
+import os, itertools
+
+from . import geometry as geo, materials as mat, constraints as con
+
+
+
+def material_of(problem, set_name):
+    """Returns the single material shared by all elements in the named set,
+    such as one created by a cnfg file's "material-" section.
+    Raises ValueError if the set's elements don't all share one material."""
+    matls = set( e.material for e in problem.sets[set_name] )
+    if len(matls) != 1:
+        raise ValueError('Set "%s" has %s materials, not one.' %
+            (set_name, len(matls)))
+    return matls.pop()
+
+
+
+def _apply(targets, values):
+    """Sets each (object, parameter) target to its value.
+    Returns a list of (object, parameter, old value) to undo it with."""
+    undo = list()
+    for (obj, param), value in zip(targets, values):
+        # A loadcurve's "scale" multiplies all of its values.
+        if isinstance(obj, con.LoadCurve) and param == 'scale':
+            undo.append( (obj, 'points', obj.points) )
+            obj.points = dict( (t, v*value) for t,v in obj.points.iteritems() )
+        else:
+            undo.append( (obj, param, getattr(obj, param)) )
+            setattr(obj, param, value)
+    return undo
+
+def _undo(undo):
+    for obj, param, value in reversed(undo):
+        setattr(obj, param, value)
+
+
+# State shared with worker processes.  It is set before the workers are
+# forked, so it never needs pickling.
+_state = None
+
+def _write_variant(args):
+    index, values = args
+    writer, geometry, targets, filename_pattern = _state
+    filename = filename_pattern % index
+    undo = _apply(targets, values)
+    try:
+        writer.write(filename, {'Geometry': geometry})
+    finally:
+        _undo(undo)
+    return filename
+
+
+
+def write_sweep(problem, grid, filename_pattern, processes=None):
+    """Write one .feb file for every combination of parameter values in grid.
+
+    grid is a dict (or list of pairs) relating (object, parameter) targets to
+    sequences of values.  Objects are typically materials (see material_of)
+    or constraints, and parameters are the names of their attributes.  A
+    LoadCurve may also take the parameter "scale", which multiplies all of its
+    values.  Targets must not affect the geometry (node positions, material
+    axes, etc.), since it is only rendered once.
+
+    filename_pattern is formatted with the index of each variant, for example
+    "knee_%03d.feb".  Variants are numbered in the order given by
+    itertools.product over grid's values.
+
+    Variants are written by processes worker processes (all CPUs by default).
+    Each works on its own copy-on-write copy of the problem, and the problem
+    itself is left unchanged.
+
+    Returns a list of (filename, values) pairs, one for each variant."""
+    global _state
+
+    grid = list(grid.iteritems() if isinstance(grid, dict) else grid)
+    targets = [ t for t,_ in grid ]
+    for obj, param in targets:
+        if ( isinstance(obj, (geo.Node, geo.Element, mat.AxisOrientation))
+            or param == 'axis' ):
+            raise ValueError("Can't sweep over geometry parameter %s of %r" %
+                (param, obj))
+    combinations = list(itertools.product( *[v for _,v in grid] ))
+
+    from ._formats import feb
+    writer = feb._Writer(problem)
+    geometry = writer.serialize('Geometry')
+    _state = (writer, geometry, targets, filename_pattern)
+    try:
+        # Worker processes rely on fork to inherit the state.
+        if processes is None:
+            import multiprocessing
+            processes = multiprocessing.cpu_count()
+        if processes > 1 and len(combinations) > 1 and hasattr(os, 'fork'):
+            import multiprocessing
+            pool = multiprocessing.Pool(processes)
+            try:
+                filenames = pool.map(_write_variant, enumerate(combinations))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            filenames = map(_write_variant, enumerate(combinations))
+    finally:
+        _state = None
+
+    return zip(filenames, combinations)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python2
+import unittest
+
+import sys, os
+# For Python 3, use the translated version of the library.
+# For Python 2, find the library one directory up.
+if sys.version < '3':
+    sys.path.append(os.path.dirname(sys.path[0]))
+import febabel as f
+
+
+@unittest.skipIf(f.adjacency.np is None, 'NumPy is not available')
+class TestAdjacency(unittest.TestCase):
+
+    def setUp(self):
+        # Two tets sharing a face, a shell on the other side of the second,
+        # and a free node.
+        geo = f.geometry
+        self.p = p = f.problem.FEproblem()
+        self.nodes = n = [ geo.Node(x) for x in ((0,0,0), (1,0,0), (0,1,0),
+            (0,0,1), (1,1,1), (2,2,2)) ]
+        self.tets = [ geo.Tet4([n[0], n[1], n[2], n[3]]),
+            geo.Tet4([n[1], n[2], n[3], n[4]]) ]
+        self.shell = geo.Shell3([n[2], n[3], n[4]])
+        self.free = geo.Node((5,5,5))
+        p.sets['mesh:allnodes'] = f._formats._common.ValsDict(
+            (str(i+1), x) for i,x in enumerate(n + [self.free]) )
+        p.sets['mesh:allelements'] = f._formats._common.ValsDict(
+            (str(i+1), e) for i,e in enumerate(self.tets + [self.shell]) )
+
+    def test_adjacency(self):
+        a = self.p.adjacency()
+        self.assertEqual(a.nodes, self.nodes + [self.free])
+        self.assertEqual(a.elements, self.tets + [self.shell])
+        self.assertEqual(a.elements_of(self.nodes[0]), self.tets[:1])
+        self.assertEqual(a.elements_of(self.nodes[3]), a.elements)
+        self.assertEqual(a.elements_of(self.free), [])
+        self.assertEqual(a.neighbours_of(self.tets[0]), self.tets[1:])
+        # Shells are joined to each other at edges, not to solids.
+        self.assertEqual(a.neighbours_of(self.tets[1]), self.tets[:1])
+        self.assertEqual(a.neighbours_of(self.shell), [])
+        offsets, indices = a.node_offsets, a.node_elems
+        self.assertEqual(list(offsets), [0, 1, 3, 6, 9, 11, 11, 11])
+        self.assertEqual(list(indices[3:6]), [0, 1, 2])
+
+    def test_cached(self):
+        a = self.p.adjacency()
+        # Moving nodes keeps the adjacency.
+        self.nodes[0].x = 0.5
+        self.assertTrue(self.p.adjacency() is a)
+        # Changing an element's nodes, or the elements, doesn't.
+        self.tets[0][0] = self.nodes[5]
+        b = self.p.adjacency()
+        self.assertFalse(b is a)
+        self.assertEqual(b.elements_of(self.nodes[5]), self.tets[:1])
+        self.assertTrue(self.p.adjacency() is b)
+        del self.p.sets['mesh:allelements']['3']
+        c = self.p.adjacency()
+        self.assertFalse(c is b)
+        self.assertEqual(c.elements, self.tets)
+        # As does replacing a free node.
+        self.p.sets['mesh:allnodes']['7'] = f.geometry.Node((6,6,6))
+        self.assertFalse(self.p.adjacency() is c)
+
+
+if __name__ == '__main__':
+    unittest.main()
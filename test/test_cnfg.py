@@ -7,6 +7,8 @@ import sys, os
 if sys.version < '3':
     sys.path.append(os.path.dirname(sys.path[0]))
 import febabel as f    
+from febabel._formats import _cache, cnfg
+import tempfile, shutil, warnings
 
 datadir = os.path.join(os.path.dirname(__file__), 'data')
 
@@ -166,15 +168,11 @@ class TestCnfg(unittest.TestCase):
         self.assertTrue(len([i for i in contact if
                              i.slave == p.sets['tf_joint.inp:pclsurf']]), 1)
 
-        # Check spring elements have been created.
-        self.assertEqual(len(
-            p.sets['meniscectomy_kurosawa80.cnfg:latant_horn'] ), 88)
-        self.assertEqual(len(
-            p.sets['meniscectomy_kurosawa80.cnfg:latpost_horn'] ), 88)
-        self.assertEqual(len(
-            p.sets['meniscectomy_kurosawa80.cnfg:medant_horn'] ), 88)
-        self.assertEqual(len(
-            p.sets['meniscectomy_kurosawa80.cnfg:medpost_horn'] ), 88)
+        # Check spring elements have been created, in one block each.
+        for horn in ('latant', 'latpost', 'medant', 'medpost'):
+            blocks = list(p.sets['meniscectomy_kurosawa80.cnfg:%s_horn' % horn])
+            self.assertEqual(len(blocks), 1)
+            self.assertEqual(len(blocks[0]), 88)
 
         # Check that time controls have been applied.
         self.assertEqual(p.timestepper.duration, 1.0)
@@ -186,5 +184,168 @@ class TestCnfg(unittest.TestCase):
 
 
 
+class TestMeshCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.inp = os.path.join(self.tmpdir, 'cube.inp')
+        with open(self.inp, 'w') as fileobj:
+            fileobj.write('\n'.join(['*NODE',
+                '1,0,0,0', '2,1,0,0', '3,1,1,0', '4,0,1,0',
+                '5,0,0,1', '6,1,0,1', '7,1,1,1', '8,0,1,1',
+                '*ELEMENT,TYPE=C3D8', '1,1,2,3,4,5,6,7,8',
+                '*ELSET,ELSET=cube', '1', '']))
+        self.calls = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def shift(self, p):
+        self.calls += 1
+        for n in p.sets['cube.inp:allnodes']:
+            n.x += 10
+
+
+    def test_copies(self):
+        cache = _cache.MeshCache()
+        p1 = f.problem.FEproblem()
+        cache.read(p1, self.inp, self.shift, 'shift')
+        p2 = f.problem.FEproblem()
+        cache.read(p2, self.inp, self.shift, 'shift')
+        # Only parsed and transformed once.
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(p1.sets['cube.inp:allnodes']['1'].x, 10)
+
+        # Each problem gets its own nodes, elements and set containers.
+        n1, n2 = p1.sets['cube.inp:allnodes'], p2.sets['cube.inp:allnodes']
+        self.assertFalse(n1 is n2)
+        self.assertFalse(n1['5'] is n2['5'])
+        e1 = p1.sets['cube.inp:allelements']['1']
+        e2 = p2.sets['cube.inp:allelements']['1']
+        self.assertFalse(e1 is e2)
+        self.assertEqual(list(e2), [ n2[str(i)] for i in range(1, 9) ])
+        self.assertTrue(e2 in p2.sets['cube.inp:cube'])
+        e1.material = f.materials.NeoHookean(1, 0.3)
+        self.assertTrue(e2.material is None)
+        n1['5'].x = 42
+        n1['5'].constraints['x'] = f.constraints.fixed
+        p5 = f.problem.FEproblem()
+        cache.read(p5, self.inp, self.shift, 'shift')
+        for n in (n2['5'], p5.sets['cube.inp:allnodes']['5']):
+            self.assertEqual(n.x, 10)
+            self.assertTrue(n.constraints['x'] is f.constraints.free)
+
+        # A different transform gets its own copy.
+        p3 = f.problem.FEproblem()
+        cache.read(p3, self.inp, self.shift, 'other')
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(len(cache._sets), 2)
+
+        # Changing the file invalidates it, and drops its earlier results.
+        with open(self.inp, 'a') as fileobj:
+            fileobj.write('*NSET,NSET=one\n1\n')
+        os.utime(self.inp, (0, 0))
+        p4 = f.problem.FEproblem()
+        cache.read(p4, self.inp, self.shift, 'shift')
+        self.assertEqual(self.calls, 3)
+        self.assertTrue('cube.inp:one' in p4.sets)
+        self.assertEqual(len(cache._sets), 1)
+
+        # Only the most recently used results are kept.
+        cache.size = 2
+        for key in ('a', 'b', 'c'):
+            cache.read(f.problem.FEproblem(), self.inp, self.shift, key)
+        self.assertEqual([ k[1] for k in cache._sets ], ['b', 'c'])
+
+
+    def test_disk(self):
+        cachedir = os.path.join(self.tmpdir, 'cache')
+        p1 = f.problem.FEproblem()
+        _cache.MeshCache(cachedir).read(p1, self.inp, self.shift, 'shift')
+        p2 = f.problem.FEproblem()
+        _cache.MeshCache(cachedir).read(p2, self.inp, self.shift, 'shift')
+        self.assertEqual(self.calls, 1)
+        n = p2.sets['cube.inp:allnodes']['2']
+        self.assertEqual(list(n), [11, 0, 0])
+        # Shared constraint objects keep their identity.
+        self.assertTrue(n.constraints['x'] is f.constraints.free)
+        self.assertEqual(len(p2.sets['cube.inp:cube']), 1)
+
+
+
+
+class TestLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.write('base.cnfg', '[solver]', 'time_steps = 10',
+            'step_size = 0.1', '[contact]', 'a = 1')
+        self.write('main.cnfg', '[solver]', 'dtmin = 0.01', 'time_steps = 5',
+            'INCLUDE base.cnfg', 'step_size = 0.2', '[springs]',
+            'INCLUDE sub/extra.cnfg', 'b = 2')
+        os.mkdir(os.path.join(self.tmpdir, 'sub'))
+        self.write('sub/extra.cnfg', '[contact]', 'a = 3', 'c = %(a)s')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, *lines):
+        with open(os.path.join(self.tmpdir, name), 'w') as fileobj:
+            fileobj.write('\n'.join(lines + ('',)))
+
+    def load(self, name):
+        cp = f._formats.cnfg.ConfigParser.SafeConfigParser()
+        f._formats.cnfg._load(cp, os.path.join(self.tmpdir, name))
+        return cp
+
+
+    def test_load(self):
+        cp = self.load('main.cnfg')
+        self.assertEqual(cp.sections(), ['solver', 'contact', 'springs'])
+        # Later options replace earlier ones, and text after an INCLUDE
+        # stays in its own file's section.
+        self.assertEqual(cp.items('solver'), [('dtmin', '0.01'),
+            ('time_steps', '10'), ('step_size', '0.2')])
+        self.assertEqual(cp.items('contact'), [('a', '3'), ('c', '3')])
+        self.assertEqual(cp.items('springs'), [('b', '2')])
+
+    def test_outer_section(self):
+        # Options at the start of an INCLUDEd file continue the section it
+        # is included in.
+        self.write('main.cnfg', '[options]', 'INCLUDE extra.cnfg', 'b = 2')
+        self.write('extra.cnfg', 'mesh = x.inp', 'INCLUDE more.cnfg',
+            '[other]', 'INCLUDE more.cnfg')
+        self.write('more.cnfg', 'c = 3')
+        cp = self.load('main.cnfg')
+        self.assertEqual(cp.sections(), ['options', 'other'])
+        self.assertEqual(cp.items('options'), [('mesh', 'x.inp'),
+            ('c', '3'), ('b', '2')])
+        self.assertEqual(cp.items('other'), [('c', '3')])
+        # Other files must start with a section header.
+        self.assertRaises(f._formats.cnfg.ConfigParser.
+            MissingSectionHeaderError, self.load, 'extra.cnfg')
+
+    def test_cached(self):
+        parse = f._formats.cnfg._parse
+        path = os.path.join(self.tmpdir, 'base.cnfg')
+        first = parse(path)
+        self.assertTrue(parse(path) is first)
+        # Changing the file invalidates it.
+        with open(path, 'a') as fileobj:
+            fileobj.write('b = 2\n')
+        self.assertFalse(parse(path) is first)
+        self.assertEqual(self.load('base.cnfg').get('contact', 'b'), '2')
+
+    def test_loop(self):
+        self.write('sub/extra.cnfg', 'INCLUDE ../main.cnfg')
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            cp = self.load('main.cnfg')
+        self.assertEqual(len(w), 1)
+        self.assertEqual(cp.get('springs', 'b'), '2')
+
+
+
+
 if __name__=='__main__':
     unittest.main()
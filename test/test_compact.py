@@ -0,0 +1,52 @@
+#!/usr/bin/env python2
+import unittest
+
+import sys, os
+# For Python 3, use the translated version of the library.
+# For Python 2, find the library one directory up.
+if sys.version < '3':
+    sys.path.append(os.path.dirname(sys.path[0]))
+import febabel as f
+
+
+class TestCompact(unittest.TestCase):
+
+    def test_compact(self):
+        geo, con, mat = f.geometry, f.constraints, f.materials
+        p = f.problem.FEproblem()
+        nodes = [ geo.Node((i,0,0)) for i in range(10) ]
+        rigid = mat.Rigid()
+        lc = con.LoadCurve({0:0, 1:2})
+        unused_lc = con.LoadCurve({0:1, 1:1})
+        # Nodes 0-3 make a tet, 4 is fixed, 5 holds a spring with 6, 7 is on
+        # a rigid interface, and 8 and 9 are used by nothing.
+        tet = geo.Tet4(nodes[:4], mat.NeoHookean(1, 0.3))
+        nodes[4].constraints['x'] = con.fixed
+        nodes[0].constraints['y'] = con.Force(lc, 1)
+        spring = geo.Spring(nodes[5:7], mat.LinearIsotropic(2, 0))
+        p.sets['mesh:allnodes'] = allnodes = f._formats._common.ValsDict(
+            (str(i+1), n) for i,n in enumerate(nodes) )
+        p.sets['mesh:allelements'] = f._formats._common.ValsDict(
+            [('1', tet)] )
+        p.sets['ends'] = set([nodes[0], nodes[9]])
+        p.sets['springs'] = set([spring])
+        p.sets['rigid_int'] = set([ con.RigidInterface(rigid, nodes[7:8]) ])
+        p.sets['extras'] = [rigid, mat.NeoHookean(2, 0.3), lc, unused_lc]
+
+        removed = p.compact()
+        self.assertEqual(len(removed), 4)
+        self.assertTrue(nodes[8] in removed and nodes[9] in removed)
+        self.assertTrue(unused_lc in removed)
+        self.assertEqual(sorted(p.sets['mesh:allnodes'].iterkeys(), key=int),
+            map(str, range(1, 9)))
+        self.assertTrue(isinstance(p.sets['mesh:allnodes'],
+            f._formats._common.ValsDict))
+        self.assertEqual(p.sets['ends'], set(nodes[:1]))
+        self.assertEqual(p.sets['extras'], [rigid, lc])
+        # Sets are replaced rather than changed in place.
+        self.assertEqual(len(allnodes), 10)
+        self.assertEqual(p.compact(), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python2
+import unittest
+
+import sys, os, tempfile, shutil, gzip, bz2, ConfigParser
+# For Python 3, use the translated version of the library.
+# For Python 2, find the library one directory up.
+if sys.version < '3':
+    sys.path.append(os.path.dirname(sys.path[0]))
+import febabel as f
+from febabel._formats import cnfg, pipeline
+c = f._formats._compress
+
+
+inp_text = '''\
+*NODE
+1, 0.0, 0.0, 0.0
+2, 1.0, 0.0, 0.0
+3, 1.0, 1.0, 0.0
+4, 0.0, 1.0, 0.0
+5, 0.0, 0.0, 1.0
+6, 1.0, 0.0, 1.0
+7, 1.0, 1.0, 1.0
+8, 0.0, 1.0, 1.0
+*ELEMENT, TYPE=C3D8
+1, 1, 2, 3, 4, 5, 6, 7, 8
+*NSET, NSET=top
+5, 6, 7, 8
+'''
+
+
+class TestCompress(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def test_split(self):
+        self.assertEqual(c.split('a/knee.feb.gz'), ('a/knee.feb', '.gz'))
+        self.assertEqual(c.split('knee.inp.BZ2'), ('knee.inp', '.bz2'))
+        self.assertEqual(c.split('knee.vtu.xz'), ('knee.vtu', '.xz'))
+        self.assertEqual(c.split('knee.feb'), ('knee.feb', None))
+
+    def test_open(self):
+        data = ''.join( '%d, %r\n' % (i, i*0.5) for i in xrange(20000) )
+        suffixes = ['', '.gz', '.bz2']
+        if c.lzma is not None:
+            suffixes.append('.xz')
+        for suffix in suffixes:
+            name = self.path('data.txt' + suffix)
+            with c.open(name, 'w') as fileobj:
+                fileobj.write(data)
+            with c.open(name) as fileobj:
+                self.assertEqual(fileobj.read(), data)
+        with bz2.BZ2File(self.path('data.txt.bz2')) as fileobj:
+            self.assertEqual(fileobj.read(), data)
+
+        self.assertRaises(ValueError, c.open, self.path('x.gz'), 'a')
+        self.assertRaises(ValueError, c.open, self.path('x.gz'), 'w', 0)
+
+    def test_gzip_threads(self):
+        data = ''.join( '%d, %r\n' % (i, i*0.5) for i in xrange(20000) )
+        c.BLOCK_SIZE, block_size = 10000, c.BLOCK_SIZE
+        try:
+            for threads in (1, 3):
+                name = self.path('data%d.gz' % threads)
+                with c.open(name, 'wb', 1, threads) as fileobj:
+                    for i in xrange(0, len(data), 777):
+                        fileobj.write(data[i:i+777])
+                # Any gzip reader reads all of the members.
+                with gzip.open(name) as fileobj:
+                    self.assertEqual(fileobj.read(), data)
+        finally:
+            c.BLOCK_SIZE = block_size
+        self.assertTrue(os.path.getsize(self.path('data3.gz')) < len(data)/2)
+
+        name = self.path('empty.gz')
+        c.open(name, 'wb', threads=2).close()
+        with gzip.open(name) as fileobj:
+            self.assertEqual(fileobj.read(), '')
+
+    def test_read_write(self):
+        with gzip.open(self.path('mesh.inp.gz'), 'wb') as fileobj:
+            fileobj.write(inp_text)
+        p = f.problem.FEproblem()
+        p.read(self.path('mesh.inp.gz'))
+        self.assertEqual(len(p.sets['mesh.inp.gz:allnodes']), 8)
+        self.assertEqual(len(p.sets['mesh.inp.gz:top']), 4)
+
+        p.write(self.path('mesh.feb'))
+        p.write(self.path('mesh.feb.gz'), compresslevel=9)
+        p.write(self.path('mesh.feb.bz2'))
+        with open(self.path('mesh.feb')) as fileobj:
+            text = fileobj.read()
+        with gzip.open(self.path('mesh.feb.gz')) as fileobj:
+            self.assertEqual(fileobj.read(), text)
+        with bz2.BZ2File(self.path('mesh.feb.bz2')) as fileobj:
+            self.assertEqual(fileobj.read(), text)
+
+        q = f.problem.FEproblem()
+        q.read(self.path('mesh.feb.bz2'))
+        self.assertEqual(len(q.sets['mesh.feb.bz2:allelements']), 1)
+
+    def test_cnfg_include(self):
+        with gzip.open(self.path('main.cnfg.gz'), 'wb') as fileobj:
+            fileobj.write('[options]\nscale = 1\nINCLUDE part.cnfg.bz2\n')
+        with bz2.BZ2File(self.path('part.cnfg.bz2'), 'wb') as fileobj:
+            fileobj.write('[transform]\nq_angle = 0\n')
+        cp = ConfigParser.SafeConfigParser()
+        f._formats.cnfg._load(cp, self.path('main.cnfg.gz'))
+        self.assertEqual(cp.get('options', 'scale'), '1')
+        self.assertEqual(cp.get('transform', 'q_angle'), '0')
+
+    def test_convert(self):
+        with bz2.BZ2File(self.path('mesh.inp.bz2'), 'wb') as fileobj:
+            fileobj.write(inp_text)
+        f._formats.pipeline.convert(self.path('mesh.inp.bz2'),
+            self.path('mesh.feb.gz'), 1)
+        p = f.problem.FEproblem()
+        p.read(self.path('mesh.feb.gz'))
+        self.assertEqual(len(p.sets['mesh.feb.gz:allnodes']), 8)
+        self.assertEqual(len(p.sets['mesh.feb.gz:allelements']), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python2
+import unittest
+
+import sys, os
+# For Python 3, use the translated version of the library.
+# For Python 2, find the library one directory up.
+if sys.version < '3':
+    sys.path.append(os.path.dirname(sys.path[0]))
+import febabel as f
+try: from cStringIO import StringIO
+except ImportError: from io import BytesIO as StringIO
+
+
+class TestDedupe(unittest.TestCase):
+
+    def test_interner(self):
+        mat, con = f.materials, f.constraints
+        interner = f.dedupe.Interner()
+        a = mat.NeoHookean(1, 0.3)
+        self.assertTrue(interner.intern(a) is a)
+        self.assertTrue(interner.intern(mat.NeoHookean(1, 0.3)) is a)
+        self.assertFalse(interner.intern(mat.NeoHookean(1, 0.4)) is a)
+        self.assertFalse(interner.intern(mat.LinearIsotropic(1, 0.3)) is a)
+        # Lists are compared by value.
+        ogden = interner.intern(mat.Ogden([1, 2], [3, 4], 5))
+        self.assertTrue(interner.intern(mat.Ogden([1, 2], [3, 4], 5)) is ogden)
+        # Objects referred to are interned first.
+        t = mat.TransIsoElastic(1, 2, 3, 4, mat.VectorOrientation((1,0,0),
+            (0,1,0)), mat.NeoHookean(1, 0.3))
+        same = mat.TransIsoElastic(1, 2, 3, 4, mat.VectorOrientation((1,0,0),
+            (0,1,0)), a)
+        self.assertTrue(interner.intern(same) is interner.intern(t))
+        # The module's loadcurves are kept over equal ones.
+        self.assertTrue(interner.intern(con.LoadCurve({0:0, 1:1}))
+            is con.loadcurve_ramp)
+        step = con.LoadCurve({0:0, 1:1}, con.LoadCurve.IN_STEP)
+        self.assertTrue(interner.intern(step) is step)
+        # Rigid bodies and fields are only equal to themselves.
+        self.assertFalse(interner.intern(mat.Rigid([0,0,0], 1))
+            is interner.intern(mat.Rigid([0,0,0], 1)))
+        self.assertFalse(interner.intern(mat.LinearIsotropic(mat.Field([1]),
+            0)) is interner.intern(mat.LinearIsotropic(mat.Field([1]), 0)))
+
+
+    def test_dedupe(self):
+        geo, con, mat = f.geometry, f.constraints, f.materials
+        p = f.problem.FEproblem()
+        nodes = [ geo.Node((i,0,0)) for i in range(8) ]
+        tets = [ geo.Tet4(nodes[i:i+4], mat.NeoHookean(1, 0.3))
+            for i in range(3) ]
+        tets.append(geo.Tet4(nodes[4:8], mat.NeoHookean(2, 0.3)))
+        springs = [ geo.Spring(nodes[i:i+2], mat.LinearIsotropic(5, 0))
+            for i in range(3) ]
+        lc1, lc2 = con.LoadCurve({0:0, 1:2}), con.LoadCurve({0:0, 1:2})
+        nodes[0].constraints['x'] = con.Force(lc1, 1)
+        nodes[1].constraints['x'] = con.Displacement(lc2, 2)
+        nodes[2].constraints['y'] = con.Force(con.LoadCurve({0:0, 1:1}), 1)
+        p.timestepper.max_step = con.LoadCurve({0:0, 1:2})
+        p.sets['mesh:allelements'] = f._formats._common.ValsDict(
+            (str(i+1), e) for i,e in enumerate(tets) )
+        p.sets['springs'] = set(springs)
+        p.sets['curves'] = [lc1, lc2]
+
+        replaced = p.dedupe()
+        self.assertEqual(len(replaced), 7)
+        self.assertEqual(len(set( e.material for e in tets )), 2)
+        self.assertTrue(tets[0].material is tets[2].material)
+        self.assertEqual(len(set( e.material for e in springs )), 1)
+        # Either of two equal objects may be kept.
+        lc = nodes[0].constraints['x'].loadcurve
+        self.assertTrue(lc in (lc1, lc2))
+        self.assertTrue(nodes[1].constraints['x'].loadcurve is lc)
+        self.assertTrue(p.timestepper.max_step is lc)
+        self.assertTrue(nodes[2].constraints['y'].loadcurve
+            is con.loadcurve_ramp)
+        self.assertEqual(p.sets['curves'], [lc, lc])
+        # Nothing is left to merge.
+        self.assertEqual(p.dedupe(), {})
+
+        outfile = StringIO()
+        p.write_feb(outfile)
+        self.assertEqual(outfile.getvalue().count('<material '), 2)
+        self.assertEqual(outfile.getvalue().count('<loadcurve '), 2)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
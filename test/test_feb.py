@@ -14,6 +14,7 @@ else:
 datadir = os.path.join(os.path.dirname(__file__), 'data')
 
 import febabel as f
+from febabel._formats import feb
 
 
 class TestFeb(unittest.TestCase):
@@ -102,6 +103,119 @@ class TestFeb(unittest.TestCase):
 
 
 
+    def test_write_feb_parallel(self):
+        geo, mat = f.geometry, f.materials
+        p = f.problem.FEproblem()
+        nodes = [ geo.Node((x, y*0.5, z)) for z in (0,1) for y in (0,1,2)
+            for x in range(6) ]
+        grid = lambda x,y,z: nodes[x + 6*y + 18*z]
+        fibers = mat.ElementOrientation()
+        trans = mat.TransIsoElastic(1, 2, 3, 4, fibers, mat.NeoHookean(5, 0.3))
+        elements = [ geo.Hex8([ grid(x+a, y+b, c) for a,b,c in ((0,0,0),
+            (1,0,0), (1,1,0), (0,1,0), (0,0,1), (1,0,1), (1,1,1), (0,1,1)) ],
+            trans if x % 2 else mat.NeoHookean(1, 0.3))
+            for y in (0,1) for x in range(5) ]
+        elements += [ geo.Shell4([ grid(x, 0, 0), grid(x+1, 0, 0),
+            grid(x+1, 0, 1), grid(x, 0, 1) ],
+            trans if x == 0 else mat.NeoHookean(1, 0.3),
+            thickness=0.1*(x+1)) for x in range(5) ]
+        fibers.vectors = dict( (e, (1, 0.25*i, 0)) for i,e in
+            enumerate(elements) if e.material is trans )
+        p.sets['mesh:allnodes'] = f._formats._common.ValsDict(
+            (str(i+1), n) for i,n in enumerate(nodes) )
+        p.sets['mesh:allelements'] = f._formats._common.ValsDict(
+            (str(i+1), e) for i,e in enumerate(elements) )
+
+        serial = StringIO()
+        p.write_feb(serial)
+        f._formats.feb.CHUNK_SIZE, chunk_size = 4, f._formats.feb.CHUNK_SIZE
+        try:
+            parallel = StringIO()
+            p.write_feb(parallel, processes=2)
+        finally:
+            f._formats.feb.CHUNK_SIZE = chunk_size
+        self.assertEqual(parallel.getvalue(), serial.getvalue())
+        tree = etree.fromstring(parallel.getvalue())
+        data = tree.find('Geometry/ElementData')
+        self.assertEqual(len(data), 9)
+        self.assertEqual(len(data.findall('element/fiber')), 5)
+
+        # Empty sections are written as ElementTree writes them.
+        p.sets.clear()
+        serial, parallel = StringIO(), StringIO()
+        p.write_feb(serial)
+        p.write_feb(parallel, processes=1)
+        self.assertEqual(parallel.getvalue(), serial.getvalue())
+
+
+    def test_write_feb_spring_block(self):
+        geo, mat, con = f.geometry, f.materials, f.constraints
+        nodes = [ geo.Node((i, i*i, 0)) for i in range(4) ]
+        block = geo.SpringBlock(nodes, [(0, 1), (0, 2), (3, 1)],
+            mat.LinearIsotropic(mat.Field([1.5, 2.0, 0.25]), 0))
+
+        def springs(p):
+            "Returns the Boundary section, and each spring's values."
+            outfile = StringIO()
+            p.write_feb(outfile)
+            tree = etree.fromstring(outfile.getvalue())
+            coords = dict( (n.get('id'), n.text)
+                for n in tree.find('Geometry/Nodes') )
+            boundary = tree.find('Boundary')
+            return boundary, sorted( (s.get('type'), tuple( coords[i]
+                for i in s.findtext('node').split(',') ), s.findtext('E'))
+                for s in boundary.findall('spring') )
+
+        # Blocks are written as their springs would be.
+        p = f.problem.FEproblem()
+        p.sets['springs'] = set([block])
+        q = f.problem.FEproblem()
+        q.sets['springs'] = set(block.springs())
+        boundary, values = springs(p)
+        self.assertEqual(values, springs(q)[1])
+        self.assertEqual([ v[2] for v in values ], ['1.5', '2.0', '0.25'])
+
+        # Blocks follow other boundary conditions and springs.
+        nodes[0].constraints['x'] = con.fixed
+        p.sets['springs'].add(geo.Spring(nodes[2:4],
+            mat.LinearIsotropic(3, 0), tension_only=True))
+        boundary, values = springs(p)
+        self.assertEqual([ e.tag for e in boundary ], ['fix'] + ['spring']*4)
+        self.assertEqual(boundary[1].get('type'), 'tension-only linear')
+        self.assertEqual(len(values), 4)
+
+        # Changing a block is seen by incremental writes.
+        p.write_feb(StringIO(), incremental=True)
+        block.pairs = [(0, 1), (0, 3), (3, 1)]
+        block.tension_only = True
+        incremental, fresh = StringIO(), StringIO()
+        p.write_feb(incremental, incremental=True)
+        p.write_feb(fresh)
+        self.assertEqual(incremental.getvalue(), fresh.getvalue())
+        self.assertEqual(springs(p)[0].findall('spring')[-1].get('type'),
+            'tension-only linear')
+
+        # The arrays can also be NumPy arrays.
+        np = f.adjacency.np
+        if np is not None:
+            outfile = StringIO()
+            p.write_feb(outfile)
+            block.pairs = np.array(block.pairs)
+            block.material.E = mat.Field(np.array(block.material.E.values))
+            numpy_outfile = StringIO()
+            p.write_feb(numpy_outfile)
+            self.assertEqual(numpy_outfile.getvalue(), outfile.getvalue())
+
+        # Other elements' materials can't have Fields.
+        q = f.problem.FEproblem()
+        q.sets['solid'] = set([ geo.Tet4(nodes,
+            mat.NeoHookean(mat.Field([1.0, 2.0]), 0.3)) ])
+        self.assertRaises(ValueError, q.write_feb, StringIO())
+        q.sets['solid'] = set([ geo.Spring(nodes[:2],
+            mat.LinearIsotropic(mat.Field([1.0]), 0)) ])
+        self.assertRaises(ValueError, q.write_feb, StringIO())
+
+
     def test_write_feb_materials(self):
         p = f.problem.FEproblem()
         nodes = list(map( f.geometry.Node, [(0,0,0), (1,0,0), (0,1,0), (0,0,1)] ))
@@ -291,7 +405,9 @@ class TestFeb(unittest.TestCase):
         self.assertEqual(rz.get('lc'), lcid)
         self.assertEqual(rz.text, '122.2')
 
-        # Test loadcurves.
+        # Test loadcurves.  loadcurve_zero is only used by the free and fixed
+        # constraints, which are written without it.
+        self.assertEqual(len(tree.find('LoadData').findall('loadcurve')), 3)
         for lc in tree.find('LoadData').findall('loadcurve'):
             # Let's only look at the shared one.
             if lc.get('id') != lcid:
@@ -433,5 +549,294 @@ class TestFeb(unittest.TestCase):
 
 
 
+    def test_write_feb_incremental(self):
+        p = f.problem.FEproblem()
+        Node = f.geometry.Node
+        nodes = [
+            Node((0,0,0)), Node((1,0,0)), Node((1,1,0)), Node((0,1,0)),
+            Node((0,0,1)), Node((1,0,1)), Node((1,1,1)), Node((0,1,1)),
+        ]
+        matl = f.materials.MooneyRivlin(1, 0, 10)
+        p.sets[''] = set([f.geometry.Hex8(nodes, matl)])
+
+        def write():
+            outfile = StringIO()
+            p.write_feb(outfile, incremental=True)
+            tree = etree.fromstring(outfile.getvalue())
+            ids = dict( (e.get('id'), e.text) for e in
+                tree.find('Geometry').find('Nodes').findall('node') )
+            return tree, ids
+
+        tree1, ids1 = write()
+        geometry = p._feb_writer.cache['Geometry'][1]
+
+        # Changing a material only renders the Material section again.
+        matl.c1 = 2
+        tree2, ids2 = write()
+        self.assertTrue(p._feb_writer.cache['Geometry'][1] is geometry)
+        self.assertEqual(tree2.find('Material').find('material').find(
+            'c1').text, '2')
+        self.assertEqual(ids1, ids2)
+
+        # Moving a node renders the geometry again, with the same IDs.
+        nodes[6].z = 5
+        tree3, ids3 = write()
+        self.assertFalse(p._feb_writer.cache['Geometry'][1] is geometry)
+        self.assertEqual(sorted(ids1), sorted(ids3))
+        changed = [ i for i in ids1 if ids1[i] != ids3[i] ]
+        self.assertEqual(len(changed), 1)
+        self.assertEqual(ids3[changed[0]], '1,1,5')
+
+        # New objects are numbered after existing ones.
+        nodes.append(Node((9,9,9)))
+        p.sets['extra'] = set([nodes[-1]])
+        tree4, ids4 = write()
+        self.assertEqual(ids4['9'], '9,9,9')
+        del ids4['9']
+        self.assertEqual(ids3, ids4)
+
+        # Constraints changed through a node's constraint dict are seen.
+        nodes[0].constraints['x'] = f.constraints.fixed
+        tree5, ids5 = write()
+        fix = tree5.find('Boundary').find('fix').findall('node')
+        self.assertEqual(len(fix), 1)
+        self.assertEqual(ids5[fix[0].get('id')], '0,0,0')
+
+
+
+    def write_incremental(self, p):
+        outfile = StringIO()
+        p.write_feb(outfile, incremental=True)
+        return etree.fromstring(outfile.getvalue())
+
+    def test_write_feb_incremental_thickness(self):
+        p = f.problem.FEproblem()
+        nodes = [ f.geometry.Node((x,y,0)) for x,y in ((0,0), (1,0), (1,1)) ]
+        shell = f.geometry.Shell3(nodes, f.materials.NeoHookean(1, 0.3), 0.5)
+        p.sets[''] = set([shell])
+        self.write_incremental(p)
+        shell.thickness = 2
+        tree = self.write_incremental(p)
+        self.assertEqual(tree.find('Geometry').find('ElementData').find(
+            'element').findtext('thickness'), '2,2,2')
+
+    def test_write_feb_incremental_tension_only(self):
+        p = f.problem.FEproblem()
+        nodes = [ f.geometry.Node((x,0,0)) for x in range(2) ]
+        spring = f.geometry.Spring(nodes, f.materials.LinearIsotropic(5, 0))
+        p.sets[''] = set([spring])
+        self.write_incremental(p)
+        spring.tension_only = True
+        tree = self.write_incremental(p)
+        self.assertEqual(tree.find('Boundary').find('spring').get('type'),
+            'tension-only linear')
+
+    def test_write_feb_incremental_axis(self):
+        p = f.problem.FEproblem()
+        nodes = [ f.geometry.Node(x) for x in
+            ((0,0,0), (1,0,0), (0,1,0), (0,0,1)) ]
+        axis = f.materials.SphericalOrientation((0,0,0), (0,0,1))
+        matl = f.materials.TransIsoElastic(1, 2, 3, 4, axis,
+            f.materials.NeoHookean(1, 0.3))
+        p.sets[''] = set([f.geometry.Tet4(nodes, matl)])
+        self.write_incremental(p)
+        axis.pos1 = [1, 2, 3]
+        tree = self.write_incremental(p)
+        self.assertEqual(tree.find('Material').find('material').findtext(
+            'fiber'), '1,2,3')
+
+    def test_write_feb_incremental_constraints(self):
+        p = f.problem.FEproblem()
+        node, other = f.geometry.Node((0,0,0)), f.geometry.Node((1,0,0))
+        other.constraints['x'] = f.constraints.fixed
+        p.sets[''] = set([node, other])
+        self.write_incremental(p)
+        node.constraints = f.common.ConstraintDict(x=f.constraints.fixed,
+            y=f.constraints.free, z=f.constraints.free)
+        tree = self.write_incremental(p)
+        self.assertEqual(len(tree.find('Boundary').find('fix').findall(
+            'node')), 2)
+
+    def test_write_feb_incremental_in_place(self):
+        p = f.problem.FEproblem()
+        nodes = [ f.geometry.Node((x,0,0)) for x in range(3) ]
+        lc = f.constraints.LoadCurve({0:1, 1:1})
+        nodes[0].constraints['x'] = f.constraints.Force(lc)
+        axis = f.materials.VectorOrientation((1,0,0), (0,1,0))
+        matl = f.materials.TransIsoElastic(1, 2, 3, 4, axis,
+            f.materials.NeoHookean(1, 0.3))
+        block = f.geometry.SpringBlock(nodes, [(0,1), (1,2)],
+            f.materials.LinearIsotropic(f.materials.Field([1.0, 2.0]), 0))
+        p.sets[''] = set(nodes + [block, f.geometry.Tet4(nodes + [
+            f.geometry.Node((0,0,1))], matl)])
+        self.write_incremental(p)
+        # Containers changed in place are seen, even though changing them
+        # isn't counted.
+        lc.points[1] = 5
+        axis.pos1[1] = 2
+        block.material.E.values[1] = 7.0
+        tree = self.write_incremental(p)
+        fresh = StringIO()
+        p.write_feb(fresh)
+        self.assertEqual(etree.tostring(tree), fresh.getvalue().split('\n',
+            1)[1])
+        self.assertEqual(tree.find('LoadData').findtext('loadcurve'
+            '/loadpoint[2]'), '1,5')
+        self.assertEqual(tree.find('Material').find('material').findtext(
+            'fiber'), '1,2,0')
+
+    def test_write_feb_incremental_problems(self):
+        # Changes are only counted in problems containing the changed object.
+        p, other = f.problem.FEproblem(), f.problem.FEproblem()
+        node, moved = f.geometry.Node((0,0,0)), f.geometry.Node((1,0,0))
+        p.sets[''] = set([node])
+        other.sets[''] = set([moved])
+        self.write_incremental(p)
+        self.write_incremental(other)
+        geometry = p._feb_writer.cache['Geometry'][1]
+        moved.x = 2
+        self.write_incremental(p)
+        self.assertTrue(p._feb_writer.cache['Geometry'][1] is geometry)
+        tree = self.write_incremental(other)
+        self.assertEqual(tree.find('Geometry').find('Nodes').findtext('node'),
+            '2,0,0')
+
+
+
+    @unittest.skipIf(f.adjacency.np is None, 'NumPy is not available')
+    def test_write_feb_renumbered(self):
+        import random
+        p = f.problem.FEproblem()
+        Node = f.geometry.Node
+        # A row of bricks, with nodes read in a scattered order.
+        grid = [ [ Node((x,y,z)) for y,z in ((0,0), (1,0), (1,1), (0,1)) ]
+            for x in range(11) ]
+        hexes = [ f.geometry.Hex8(grid[x] + grid[x+1]) for x in range(10) ]
+        nodes = [ n for g in grid for n in g ]
+        random.seed(7)
+        random.shuffle(nodes)
+        p.sets['row.inp:allnodes'] = f._formats._common.ValsDict(
+            (str(i+1), n) for i,n in enumerate(nodes) )
+        p.sets['row.inp:allelements'] = set(hexes)
+
+        prof = f.instrument.Profile()
+        outfile = StringIO()
+        with prof:
+            p.write_feb(outfile, node_order='rcm')
+        tree = etree.fromstring(outfile.getvalue())
+        positions = dict( (e.get('id'), e.text) for e in
+            tree.find('Geometry').find('Nodes').findall('node') )
+        bandwidth = 0
+        found = set()
+        for e in tree.find('Geometry').find('Elements').findall('hex8'):
+            ids = e.text.split(',')
+            bandwidth = max(bandwidth, max(map(int, ids)) - min(map(int, ids)))
+            found.add( tuple( positions[i] for i in ids ) )
+        # Elements still have their own nodes.
+        self.assertEqual(found, set( tuple( '%s,%s,%s' % tuple(n) for n in h )
+            for h in hexes ))
+        self.assertTrue(bandwidth <= 11, msg=bandwidth)
+        count = lambda name: prof.totals[('count', 'prepare/renumber/' + name)][0]
+        self.assertEqual(count('bandwidth after'), bandwidth)
+        self.assertTrue(count('bandwidth before') > bandwidth)
+
+        self.assertRaises(ValueError, p.write_feb, StringIO(),
+            node_order='wrong')
+
+        # Sorted elements are numbered along the row.
+        outfile = StringIO()
+        p.write_feb(outfile, element_order='morton')
+        tree = etree.fromstring(outfile.getvalue())
+        positions = dict( (e.get('id'), e.text) for e in
+            tree.find('Geometry').find('Nodes').findall('node') )
+        x = [ float(positions[e.text.split(',')[0]].split(',')[0]) for e in
+            tree.find('Geometry').find('Elements').findall('hex8') ]
+        self.assertTrue(x == sorted(x) or x == sorted(x, reverse=True), msg=x)
+
+
+
+    def test_read_feb(self):
+        p = f.problem.FEproblem()
+        Node = f.geometry.Node
+        nodes = [
+            Node((0,0,0)), Node((1,0,0)), Node((1,1,0)), Node((0,1,0)),
+            Node((0,0,1)), Node((1,0,1)), Node((1,1,1)), Node((0,1,1)),
+            Node((0,0,2)), Node((1,0,2)), Node((1,1,2)), Node((0,1,2)),
+        ]
+        con = f.constraints
+        lc = con.LoadCurve({0:0, 1:0.75, 2:1})
+        rigid = f.materials.Rigid(center_of_mass=(0,0,0))
+        fibers = f.materials.TransIsoElastic(1, 2, 3, 4,
+            f.materials.SphericalOrientation((0,0,0), (0,0,1)),
+            f.materials.MooneyRivlin(5, 6, 7))
+        top = [f.geometry.Surface4(nodes[8:])]
+        bottom = [f.geometry.Surface4(nodes[3::-1])]
+        p.sets[''] = set([
+            f.geometry.Hex8(nodes[0:8], rigid),
+            f.geometry.Hex8(nodes[4:12], fibers),
+            f.geometry.Spring([nodes[0],nodes[10]],
+                f.materials.LinearIsotropic(22, 0), tension_only=True),
+            f.geometry.Spring([nodes[1],nodes[11]],
+                f.materials.LinearIsotropic(22, 0)),
+            con.SlidingContact(top, bottom, options={'penalty':'100'}),
+            con.SwitchContact({0: None, 1: con.TiedContact(top, bottom)}),
+        ])
+        nodes[0].constraints['x'] = con.Displacement(lc, 4)
+        nodes[3].constraints['z'] = con.fixed
+        nodes[9].constraints['z'] = con.SwitchConstraint(
+            {0: con.fixed, 1: con.Force(lc, -2)})
+        rigid.constraints['Rz'] = con.Force(lc, 122.2)
+
+        outfile = StringIO()
+        p.write_feb(outfile)
+        outfile.seek(0)
+        q = f.problem.FEproblem()
+        q.read_feb(outfile)
+
+        name = 'feb'
+        self.assertEqual(len(q.sets[name+':allnodes']), 12)
+        self.assertEqual(len(q.sets[name+':allelements']), 2)
+        springs = q.sets[name+':springs']
+        self.assertEqual(len(springs), 2)
+        # Springs aren't given shared materials, even with equal stiffness.
+        self.assertEqual(len(set( s.material for s in springs )), 2)
+        self.assertEqual([ s.material.E for s in springs ], [22, 22])
+        self.assertEqual(len(q.sets[name+':contact']), 2)
+        ds = q.get_descendants_sorted()
+        read_nodes = dict( (tuple(n), n) for n in ds[f.geometry.Node] )
+
+        n = read_nodes[(0,0,0)]
+        self.assertEqual(n.constraints['x'].multiplier, 4)
+        self.assertEqual(n.constraints['x'].loadcurve.points, lc.points)
+        self.assertTrue(read_nodes[(0,1,0)].constraints['z'] is con.fixed)
+        switch = read_nodes[(1,0,2)].constraints['z']
+        self.assertTrue(isinstance(switch, con.SwitchConstraint))
+        self.assertTrue(switch[0] is con.fixed)
+        self.assertEqual(switch[1].multiplier, -2)
+
+        rigid2, = [ m for m in ds[f.materials.Material]
+            if isinstance(m, f.materials.Rigid) ]
+        self.assertEqual(rigid2.center_of_mass, [0,0,0])
+        self.assertEqual(rigid2.constraints['Rz'].multiplier, 122.2)
+        fibers2, = [ m for m in ds[f.materials.Material]
+            if isinstance(m, f.materials.TransIsoElastic) ]
+        self.assertEqual((fibers2.c3, fibers2.lam_max), (1, 4))
+        self.assertEqual(fibers2.base.c2, 6)
+        self.assertEqual(fibers2.axis.pos1, [0,0,0])
+
+        switched, = ds[con.Contact] & ds[f.common.Switch]
+        self.assertTrue(switched[0] is None)
+        self.assertTrue(isinstance(switched[1], con.TiedContact))
+
+        # Writing the read problem gives the same file, apart from IDs.
+        outfile2 = StringIO()
+        q.write_feb(outfile2)
+        tags = lambda s: sorted( (e.tag, sorted(e.keys()))
+            for e in etree.fromstring(s.getvalue()).iter() )
+        self.assertEqual(tags(outfile), tags(outfile2))
+
+
+
+
 if __name__=='__main__':
     unittest.main()
@@ -6,7 +6,7 @@ import sys, os
 # For Python 2, find the library one directory up.
 if sys.version < '3':
     sys.path.append(os.path.dirname(sys.path[0]))
-from febabel import geometry as g
+from febabel import geometry as g, materials
 
 
 class TestNode(unittest.TestCase):
@@ -77,6 +77,46 @@ class TestElements(unittest.TestCase):
             (0.5, 0.75, 2.5/4) )
 
 
+    def test_faces(self):
+        # Each solid's faces point out of it, and cover every edge twice.
+        shapes = {
+            g.Tet4: [(0,0,0), (1,0,0), (0,1,0), (0,0,1)],
+            g.Pent6: [(0,0,0), (1,0,0), (0,1,0), (0,0,1), (1,0,1), (0,1,1)],
+            g.Hex8: [(0,0,0), (1,0,0), (1,1,0), (0,1,0), (0,0,1), (1,0,1),
+                (1,1,1), (0,1,1)],
+        }
+        for cls, coords in shapes.iteritems():
+            e = cls([ g.Node(x) for x in coords ])
+            centre = e.get_vertex_avg()
+            sides = list()
+            for face in cls.faces:
+                a, b, c = [ [ e[i][j] - centre[j] for j in range(3) ]
+                    for i in face[:3] ]
+                ab = [ b[j] - a[j] for j in range(3) ]
+                ac = [ c[j] - a[j] for j in range(3) ]
+                normal = [ ab[1]*ac[2] - ab[2]*ac[1],
+                    ab[2]*ac[0] - ab[0]*ac[2], ab[0]*ac[1] - ab[1]*ac[0] ]
+                self.assertTrue(sum( n*x for n,x in zip(normal, a) ) > 0)
+                sides.extend( tuple(sorted( (face[i-1], face[i]) ))
+                    for i in range(len(face)) )
+            self.assertEqual(sorted(sides), sorted( tuple(sorted(edge))
+                for edge in cls.edges*2 ))
+
+
+    def test_spring_block(self):
+        E = materials.Field([1.0, 2.0])
+        block = g.SpringBlock(self.nodes[0:3], [(0, 1), (0, 2)],
+            materials.LinearIsotropic(E, 0), tension_only=True)
+        self.assertEqual(len(block), 2)
+        self.assertEqual(block.get_children(),
+            set(self.nodes[0:3] + [block.material]))
+        springs = block.springs()
+        self.assertEqual([ list(s) for s in springs ],
+            [ [self.nodes[0], self.nodes[1]], [self.nodes[0], self.nodes[2]] ])
+        self.assertEqual([ s.material.E for s in springs ], [1.0, 2.0])
+        self.assertTrue(all( s.tension_only for s in springs ))
+
+
 
 
 if __name__ == '__main__':
@@ -1,12 +1,15 @@
 #!/usr/bin/env python2
 import unittest
 
-import sys, os
+import sys, os, tempfile, shutil, warnings
 # For Python 3, use the translated version of the library.
 # For Python 2, find the library one directory up.
 if sys.version < '3':
     sys.path.append(os.path.dirname(sys.path[0]))
-import febabel as f    
+import febabel as f
+from febabel._formats import inp
+try: from cStringIO import StringIO
+except ImportError: from io import StringIO
 
 datadir = os.path.join(os.path.dirname(__file__), 'data')
 
@@ -46,6 +49,133 @@ class TestInp(unittest.TestCase):
 
 
 
+    def test_write_inp(self):
+        p = f.problem.FEproblem()
+        geo = f.geometry
+        # A 4x1x1 row of bricks, a tetrahedron and a shell on the end.
+        nodes = [ geo.Node((x,y,z)) for z in (0,1) for y in (0,1)
+            for x in range(5) ]
+        grid = lambda x,y,z: nodes[x + 5*y + 10*z]
+        bricks = [ geo.Hex8([ grid(x+a, b, c) for a,b,c in ((0,0,0), (1,0,0),
+            (1,1,0), (0,1,0), (0,0,1), (1,0,1), (1,1,1), (0,1,1)) ])
+            for x in range(4) ]
+        apex = geo.Node((5,0,0))
+        tet = geo.Tet4([grid(4,0,0), apex, grid(4,1,0), grid(4,0,1)])
+        shell = geo.Shell4([grid(0,0,0), grid(0,1,0), grid(0,1,1), grid(0,0,1)])
+        p.sets['mesh.inp:allelements'] = set(bricks + [tet, shell])
+        p.sets['mesh.inp:bottom'] = set( geo.Surface4([ b[i] for i in
+            (0,3,2,1) ]) for b in bricks )
+        p.sets['mesh.inp:tip'] = set([ geo.Surface3(
+            [grid(4,0,0), grid(4,1,0), apex]) ])
+        p.sets['mesh.inp:front'] = set( grid(x,0,z) for x in range(5)
+            for z in (0,1) )
+        p.sets['mesh.inp:ends'] = set([bricks[0], bricks[3], tet])
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'out.inp')
+            p.write_inp(filename)
+            with open(filename) as fileobj:
+                text = fileobj.read()
+            q = f.problem.FEproblem()
+            q.read_inp(filename)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        for line in ('*ELEMENT,TYPE=C3D8', '*ELEMENT,TYPE=C3D4',
+                '*ELEMENT,TYPE=S4', '*NSET,NSET=front', '*ELSET,ELSET=ends',
+                '*SURFACE,NAME=bottom', '*SURFACE,NAME=tip'):
+            self.assertTrue(line in text.splitlines(), msg=line)
+        self.assertEqual(len(q.sets['out.inp:allnodes']), 21)
+        self.assertEqual(len(q.sets['out.inp:allelements']), 6)
+
+        pos = lambda objects: sorted( tuple(n) for n in objects )
+        self.assertEqual(pos(q.sets['out.inp:front']), pos(p.sets['mesh.inp:front']))
+        self.assertEqual(sorted( e.__class__.__name__ for e in
+            q.sets['out.inp:ends'] ), ['Hex8', 'Hex8', 'Tet4'])
+        # Surfaces have the same nodes, in the same orientation.
+        faces = lambda s: sorted( tuple(pos([n])[0] for n in e) for e in s )
+        turn = lambda faces: sorted( min( f[i:] + f[:i] for i in range(len(f)) )
+            for f in faces )
+        for name in ('bottom', 'tip'):
+            self.assertEqual(turn(faces(q.sets['out.inp:'+name])),
+                turn(faces(p.sets['mesh.inp:'+name])))
+
+
+
+    def test_generate(self):
+        ids = range(1, 101) + [200, 300]
+        out = StringIO()
+        f._formats.inp._write_set(out, 'NSET', 'a', ids)
+        self.assertEqual(out.getvalue(),
+            '*NSET,NSET=a,GENERATE\n1,100,1\n200,200,1\n300,300,1\n')
+        lines = out.getvalue().splitlines()[1:]
+        self.assertEqual(f._formats.inp._set_ids(lines, True),
+            list(map(str, ids)))
+        # Scattered IDs are listed, 16 per line.
+        out = StringIO()
+        f._formats.inp._write_set(out, 'ELSET', 'b', range(1, 40, 2))
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], '*ELSET,ELSET=b')
+        self.assertEqual(len(lines[1].split(',')), 16)
+        self.assertEqual(f._formats.inp._set_ids(lines[1:], False),
+            list(map(str, range(1, 40, 2))))
+
+
+
+    def test_iter_inp(self):
+        inp = f._formats.inp
+        tmpdir = tempfile.mkdtemp()
+        try:
+            name = os.path.join(tmpdir, 'deck.inp')
+            with open(name, 'w') as fileobj:
+                fileobj.write('** A comment\n*Node\n')
+                fileobj.writelines( '%d, %d.0, 0.0, %d.5\n' % (i, i, i)
+                    for i in range(1, 11) )
+                fileobj.write('*ELEMENT, TYPE=s4, ELSET=shells\n')
+                fileobj.writelines( '%d, %d, %d, %d, %d\n'
+                    % (i, i, i+1, i+6, i+5) for i in range(1, 5) )
+                fileobj.write('*NSET, NSET=ends, GENERATE\n1, 10, 9\n'
+                    '*ELSET, ELSET=first\n1, 2\n'
+                    '*SURFACE, NAME=top\n1, SPOS\n3, sneg\n'
+                    '*STEP\n*NODE\n11, 0, 0, 0\n')
+            records = list(inp.iter_inp(name, chunk_size=4))
+            self.assertEqual([ r.__class__ for r in records ], [inp.Nodes]*3
+                + [inp.Elements] + [inp.Set]*2
+                + [inp.Surface, inp.Unrecognized])
+            self.assertEqual(records[0].ids, ['1', '2', '3', '4'])
+            self.assertEqual(list(records[2].coords), [9.0, 0.0, 9.5, 10.0,
+                0.0, 10.5])
+            self.assertEqual(records[3].type, 'S4')
+            self.assertEqual(records[3].params['ELSET'], 'shells')
+            self.assertEqual(records[3].nodes[:8],
+                ['1', '2', '7', '6', '2', '3', '8', '7'])
+            self.assertEqual(records[4], ('NSET', 'ends',
+                {'NSET': 'ends', 'GENERATE': ''}, ['1', '10']))
+            self.assertEqual(records[5].ids, ['1', '2'])
+            self.assertEqual(records[6].faces, [('1', 'SPOS'), ('3', 'sneg')])
+            self.assertEqual(records[7].keyword, 'STEP')
+
+            # Reading builds the problem from the same records.
+            p = f.problem.FEproblem()
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                p.read(name)
+            self.assertEqual(len(caught), 1)
+            self.assertEqual(len(p.sets['deck.inp:allnodes']), 10)
+            self.assertEqual(p.sets['deck.inp:allnodes']['10'].z, 10.5)
+            elements = p.sets['deck.inp:allelements']
+            self.assertEqual(len(elements), 4)
+            self.assertEqual([ n.x for n in elements['4'] ], [4, 5, 10, 9])
+            self.assertEqual(p.sets['deck.inp:first'],
+                set([elements['1'], elements['2']]))
+            self.assertEqual(len(p.sets['deck.inp:ends']), 2)
+            self.assertEqual(len(p.sets['deck.inp:top']), 2)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+
 
 if __name__=='__main__':
     unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python2
+import unittest
+
+import sys, os
+# For Python 3, use the translated version of the library.
+# For Python 2, find the library one directory up.
+if sys.version > '3':
+    from io import BytesIO as StringIO
+else:
+    try: from cStringIO import StringIO
+    except: from StringIO import StringIO
+    sys.path.append(os.path.dirname(sys.path[0]))
+import febabel as f
+
+
+class TestInstrument(unittest.TestCase):
+
+    def setUp(self):
+        p = self.problem = f.problem.FEproblem()
+        Node = f.geometry.Node
+        nodes = [
+            Node((0,0,0)), Node((1,0,0)), Node((1,1,0)), Node((0,1,0)),
+            Node((0,0,1)), Node((1,0,1)), Node((1,1,1)), Node((0,1,1)),
+        ]
+        p.sets['allelements'] = set([ f.geometry.Hex8(nodes,
+            f.materials.MooneyRivlin(1, 0, 10)) ])
+
+
+    def test_observer(self):
+        events = list()
+        observer = lambda *args: events.append(args)
+        f.instrument.add_observer(observer)
+        try:
+            out = StringIO()
+            self.problem.write_feb(out)
+        finally:
+            f.instrument.remove_observer(observer)
+
+        phases = [ name for kind,name,value in events if kind == 'phase' ]
+        self.assertTrue('prepare/descendants' in phases)
+        self.assertTrue('Geometry/build' in phases)
+        self.assertTrue('Geometry/serialize' in phases)
+        # Byte counts cover everything but the header and closing tag.
+        written = sum( value for kind,name,value in events if kind == 'bytes' )
+        self.assertEqual(written, len(out.getvalue().split(b'>', 2)[2])
+            - len(b'</febio_spec>'))
+
+        # Nothing is reported once the observer is removed.
+        del events[:]
+        self.problem.write_feb(StringIO())
+        self.assertEqual(events, [])
+
+
+    def test_profile(self):
+        with f.instrument.Profile() as prof:
+            self.problem.write_feb(StringIO())
+            self.problem.write_feb(StringIO())
+        self.assertEqual(prof.totals[('phase', 'Geometry')][1], 2)
+        report = prof.report().splitlines()
+        # Nested phases are listed after, and indented under, their parents.
+        i = report.index([ l for l in report if l.startswith('prepare ') ][0])
+        self.assertTrue(report[i+1].startswith('  descendants '))
+
+
+if __name__ == '__main__':
+    unittest.main()
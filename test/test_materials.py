@@ -110,6 +110,21 @@ class TestAxes(unittest.TestCase):
             ([1,0,0],[0,0,1],[0,-1,0]) )
 
 
+    def test_field(self):
+        E = m.Field([1.0, 2.0, 3.0])
+        self.assertEqual(len(E), 3)
+        self.assertEqual(list(E), [1.0, 2.0, 3.0])
+        matl = m.LinearIsotropic(E, 0.3)
+        second = matl.at(1)
+        self.assertFalse(second is matl)
+        self.assertEqual(type(second), m.LinearIsotropic)
+        self.assertEqual( (second.E, second.v), (2.0, 0.3) )
+        self.assertTrue(matl.E is E)
+        # Materials without fields are the same at every element.
+        matl = m.NeoHookean(1, 0.3)
+        self.assertTrue(matl.at(5) is matl)
+
+
 
 
 if __name__ == '__main__':
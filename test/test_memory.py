@@ -0,0 +1,53 @@
+#!/usr/bin/env python2
+import unittest
+
+import sys, os
+# For Python 3, use the translated version of the library.
+# For Python 2, find the library one directory up.
+if sys.version < '3':
+    sys.path.append(os.path.dirname(sys.path[0]))
+import febabel as f
+
+
+class TestMemory(unittest.TestCase):
+
+    def test_memory_report(self):
+        p = f.problem.FEproblem()
+        Node = f.geometry.Node
+        nodes = [
+            Node((0,0,0)), Node((1,0,0)), Node((1,1,0)), Node((0,1,0)),
+            Node((0,0,1)), Node((1,0,1)), Node((1,1,1)), Node((0,1,1)),
+        ]
+        hex = f.geometry.Hex8(nodes, f.materials.MooneyRivlin(1, 0, 10))
+        springs = [ f.geometry.Spring([nodes[0], n],
+            f.materials.LinearIsotropic(i, 0)) for i,n in enumerate(nodes[1:]) ]
+        p.sets['allelements'] = set([hex])
+        p.sets['springs'] = set(springs)
+        # The same set in a contact is only counted once.
+        p.sets['top'] = set([ f.geometry.Surface4(nodes[4:]) ])
+        p.sets['contact'] = set([
+            f.constraints.TiedContact(p.sets['top'], p.sets['top']) ])
+
+        peaks = dict()
+        with f.memory.measure(peaks, 'report'):
+            report = p.memory_report(peaks)
+        self.assertTrue(peaks['report'] > 0)
+
+        sizes = report.sizes
+        self.assertEqual(sizes['nodes'][0], 8)
+        self.assertEqual(sizes['node constraint dicts'][0], 8)
+        self.assertEqual(sizes['elements'][0], 2)
+        self.assertEqual(sizes['springs'][0], 7)
+        self.assertEqual(sizes['materials'][0], 1)
+        self.assertEqual(sizes['spring materials'][0], 7)
+        self.assertEqual(sizes['sets'][0], 4)
+        self.assertEqual(sizes['contacts'][0], 1)
+        for n, b in sizes.values():
+            self.assertTrue(b > 0 or n == 0)
+        self.assertTrue(sizes['contacts'][1] < sizes['sets'][1])
+        self.assertEqual(report.per_node(), report.total() / 8.0)
+        self.assertTrue('peak during report' in str(report))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python2
+import unittest
+
+import sys, os, random
+# For Python 3, use the translated version of the library.
+# For Python 2, find the library one directory up.
+if sys.version < '3':
+    sys.path.append(os.path.dirname(sys.path[0]))
+import febabel as f
+
+
+@unittest.skipIf(f.adjacency.np is None, 'NumPy is not available')
+class TestOrdering(unittest.TestCase):
+
+    def setUp(self):
+        # A row of 20 bricks, with nodes in a random order, plus a spring
+        # off the end and a node used by nothing.
+        Node = f.geometry.Node
+        grid = [ [ Node((x,y,z)) for y,z in ((0,0), (1,0), (1,1), (0,1)) ]
+            for x in range(21) ]
+        self.elements = [ f.geometry.Hex8(grid[x] + grid[x+1])
+            for x in range(20) ]
+        self.spring = f.geometry.Spring([grid[-1][0], Node((22,0,0))])
+        self.elements.append(self.spring)
+        self.nodes = [ n for g in grid for n in g ] + [ self.spring[1],
+            Node((-1,0,0)) ]
+        random.seed(4)
+        random.shuffle(self.nodes)
+
+    def test_rcm(self):
+        before = f.ordering.bandwidth(self.nodes, self.elements)
+        order = f.ordering.rcm(self.nodes, self.elements)
+        self.assertEqual(sorted(order), range(len(self.nodes)))
+        nodes = [ self.nodes[i] for i in order ]
+        self.assertEqual(tuple(nodes[-1]), (-1,0,0))
+        after = f.ordering.bandwidth(nodes, self.elements)
+        # Each node can be numbered within two layers of its neighbours.
+        self.assertTrue(after[0] <= 11, msg=after)
+        self.assertTrue(after[0] < before[0] and after[1] < before[1])
+
+    def test_bandwidth(self):
+        nodes = [ self.spring[1], self.spring[0] ]
+        self.assertEqual(f.ordering.bandwidth(nodes, [self.spring]), (1, 1))
+        self.assertEqual(f.ordering.bandwidth(nodes, []), (0, 0))
+
+    def test_morton(self):
+        np = f.adjacency.np
+        points = np.array([ (x,y,z) for z in (0,1) for y in (0,1)
+            for x in (0,1) ], float)
+        # Corners of a cube follow a Z through each layer in turn.
+        self.assertEqual(list(np.argsort(f.ordering.morton_keys(points))),
+            range(8))
+
+        hexes = [ e for e in self.elements if isinstance(e, f.geometry.Hex8) ]
+        shuffled = list(hexes)
+        random.shuffle(shuffled)
+        ordered = f.ordering.morton(shuffled)
+        self.assertEqual(ordered, f.ordering.morton(reversed(shuffled)))
+        # The row is followed from one end or the other.
+        self.assertTrue(ordered == hexes or ordered == hexes[::-1])
+        for e, c in zip(hexes, f.ordering.centroids(hexes)):
+            self.assertEqual(tuple(c), tuple(e.get_vertex_avg()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python2
+import unittest
+
+import sys, os, random
+# For Python 3, use the translated version of the library.
+# For Python 2, find the library one directory up.
+if sys.version < '3':
+    sys.path.append(os.path.dirname(sys.path[0]))
+import febabel as f
+
+
+@unittest.skipIf(f.adjacency.np is None, 'NumPy is not available')
+class TestPartition(unittest.TestCase):
+
+    def setUp(self):
+        # A block of 12x4x2 bricks, and a triangle of shells on one end.
+        geo = f.geometry
+        self.p = p = f.problem.FEproblem()
+        grid = dict( ((x,y,z), geo.Node((x,y,z))) for x in range(13)
+            for y in range(5) for z in range(3) )
+        corners = ((0,0,0), (1,0,0), (1,1,0), (0,1,0), (0,0,1), (1,0,1),
+            (1,1,1), (0,1,1))
+        self.hexes = [ geo.Hex8([ grid[x+a, y+b, z+c] for a,b,c in corners ])
+            for z in range(2) for y in range(4) for x in range(12) ]
+        self.shell = geo.Shell3([ grid[0,0,0], grid[0,1,0],
+            geo.Node((-1,0,0)) ])
+        p.sets['block'] = set(self.hexes + [self.shell])
+        p.sets['end'] = set([ geo.Surface4([ grid[12,y,z] for y,z in
+            ((0,0), (1,0), (1,1), (0,1)) ]) ])
+
+    def test_face_neighbours(self):
+        elements = self.hexes + [self.shell]
+        nodes = set()
+        for e in elements:
+            nodes.update(e)
+        index = dict( (n, i) for i,n in enumerate(nodes) )
+        offsets, indices = f.adjacency.face_neighbours(elements,
+            *f.adjacency.connectivity(elements, index))
+        count = lambda i: offsets[i+1] - offsets[i]
+        # Corner, edge and inner bricks.
+        self.assertEqual(count(0), 3)
+        self.assertEqual(count(1), 4)
+        self.assertEqual(count(13), 5)
+        self.assertEqual(list(indices[offsets[13]:offsets[14]]),
+            [1, 12, 14, 25, 61])
+        # The shell only touches the bricks along an edge.
+        self.assertEqual(count(len(elements) - 1), 0)
+        self.assertEqual(offsets[-1], 2 * (11*4*2 + 12*3*2 + 12*4))
+
+    def test_bisect(self):
+        np = f.adjacency.np
+        points = np.array([ (x, 0.1*y, 0) for x in range(10)
+            for y in range(3) ], float)
+        parts = f.partition.bisect(points, 3, 'coordinate')
+        self.assertEqual(list(np.bincount(parts)), [10, 10, 10])
+        # Partitions are cut across the length of the points.
+        self.assertEqual(list(parts), sorted(parts))
+        # Points along a diagonal are cut across it.
+        points = np.array([ (x, x, 0) for x in range(12) ], float)
+        self.assertEqual(list(f.partition.bisect(points, 3)),
+            [0]*4 + [1]*4 + [2]*4)
+        self.assertRaises(ValueError, f.partition.bisect, points, 2, 'random')
+
+    def test_refine(self):
+        np = f.adjacency.np
+        # A row of 100 elements, split into two with a ragged boundary.
+        offsets = np.array([0, 1] + range(3, 199, 2) + [198])
+        indices = np.array([1] + [ j for i in range(1, 99)
+            for j in (i-1, i+1) ] + [98])
+        parts = np.array([0]*45 + [1,0]*5 + [1]*45)
+        self.assertEqual(f.partition.cut(offsets, indices, parts), 11)
+        f.partition.refine(offsets, indices, parts, 2, imbalance=0.1)
+        self.assertEqual(f.partition.cut(offsets, indices, parts), 1)
+        self.assertTrue(abs(parts.sum() - 50) <= 5)
+
+    def test_partition(self):
+        prof = f.instrument.Profile()
+        f.instrument.add_observer(prof)
+        try:
+            parts = self.p.partition(4, set_prefix='part')
+        finally:
+            f.instrument.remove_observer(prof)
+        # Surfaces aren't partitioned.
+        self.assertEqual(sorted(parts), sorted(self.hexes + [self.shell]))
+        sizes = [ len(self.p.sets['part%d' % i]) for i in range(1, 5) ]
+        self.assertEqual(sum(sizes), 97)
+        self.assertTrue(max(sizes) - min(sizes) <= 2, msg=sizes)
+        for e, i in parts.iteritems():
+            self.assertTrue(e in self.p.sets['part%d' % (i+1)])
+        # Quarters of the block along its length share the fewest faces.
+        cut = prof.totals[('count', 'refine/cut after')][0]
+        self.assertEqual(cut, 3*8)
+        self.assertTrue(cut <= prof.totals[('count', 'refine/cut before')][0])
+        # Existing sets aren't replaced.
+        first = self.p.sets['part1']
+        self.assertRaises(ValueError, self.p.partition, 2, set_prefix='part')
+        self.assertTrue(self.p.sets['part1'] is first)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python2
+import unittest
+
+import sys, os, tempfile, shutil, warnings
+import xml.etree.ElementTree as etree
+# For Python 3, use the translated version of the library.
+# For Python 2, find the library one directory up.
+if sys.version < '3':
+    sys.path.append(os.path.dirname(sys.path[0]))
+import febabel as f
+from febabel._formats import pipeline
+try: from cStringIO import StringIO
+except ImportError: from io import BytesIO as StringIO
+
+
+inp_text = '''\
+** A brick and a tet sharing a face, and a shell on the brick's base.
+*NODE
+1, 0.0, 0.0, 0.0
+2, 1.0, 0.0, 0.0
+3, 1.0, 1.0, 0.0
+4, 0.0, 1.0, 0.0
+5, 0.0, 0.0, 1.0
+6, 1.0, 0.0, 1.0
+7, 1.0, 1.0, 1.0
+8, 0.0, 1.0, 1.0
+9, 0.5, 0.5, 1.5
+10, 2.5, 2.5, 2.5
+*ELEMENT, TYPE=C3D8
+11, 1, 2, 3, 4, 5, 6, 7, 8
+*ELEMENT, type=C3D4
+12, 5, 6, 7, 9,
+*ELEMENT, TYPE=S4
+13, 1, 4, 3, 2
+*NSET, NSET=top
+5, 6, 7, 8
+*SURFACE, NAME=base
+11, S1
+'''
+
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'mesh.inp')
+        with open(self.filename, 'w') as fileobj:
+            fileobj.write(inp_text)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def elements(self, tree):
+        "Returns each element's tag, material and node coordinates."
+        coords = dict( (e.get('id'), tuple(map(float, e.text.split(','))))
+            for e in tree.find('Geometry/Nodes') )
+        return sorted( (e.tag, e.get('mat'),
+            tuple( coords[i] for i in e.text.split(',') ))
+            for e in tree.find('Geometry/Elements') )
+
+    def test_convert(self):
+        p = f.problem.FEproblem()
+        p.read_inp(self.filename)
+        serial = StringIO()
+        p.write_feb(serial)
+        pipelined = StringIO()
+        f._formats.pipeline.CHUNK_SIZE, chunk_size = (2,
+            f._formats.pipeline.CHUNK_SIZE)
+        try:
+            f._formats.pipeline.convert(self.filename, pipelined)
+        finally:
+            f._formats.pipeline.CHUNK_SIZE = chunk_size
+
+        a = etree.fromstring(serial.getvalue())
+        b = etree.fromstring(pipelined.getvalue())
+        self.assertEqual([ e.tag for e in a ], [ e.tag for e in b ])
+        for section in a:
+            if section.tag != 'Geometry':
+                self.assertEqual(etree.tostring(section),
+                    etree.tostring(b.find(section.tag)))
+        self.assertEqual(self.elements(a), self.elements(b))
+        self.assertEqual(len(b.find('Geometry/Nodes')), 10)
+        # Nodes and elements are numbered in file order.
+        self.assertEqual(b.find('Geometry/Nodes')[9].text, '2.5,2.5,2.5')
+        self.assertEqual(b.find('Geometry/Elements')[1].text, '5,6,7,9')
+        shells = b.findall('Geometry/ElementData/element')
+        self.assertEqual([ e.get('id') for e in shells ], ['3'])
+        self.assertEqual(shells[0].find('thickness').text,
+            a.find('Geometry/ElementData/element/thickness').text)
+
+    def test_nodes_after_elements(self):
+        # Elements may use nodes defined later in the file.
+        with open(self.filename, 'w') as fileobj:
+            fileobj.write('*ELEMENT, TYPE=C3D4\n1, 5, 6, 7, 9\n*NODE\n'
+                '5, 0, 0, 1\n6, 1, 0, 1\n7, 1, 1, 1\n9, 0.5, 0.5, 1.5\n')
+        out = StringIO()
+        f._formats.pipeline.convert(self.filename, out)
+        tree = etree.fromstring(out.getvalue())
+        self.assertEqual(self.elements(tree), [ ('tet4', '0', ((0, 0, 1),
+            (1, 0, 1), (1, 1, 1), (0.5, 0.5, 1.5))) ])
+
+    def test_convert_errors(self):
+        with open(self.filename, 'a') as fileobj:
+            fileobj.write('*ELEMENT, TYPE=C3D20\n14, 1, 2\n')
+        self.assertRaises(KeyError, f._formats.pipeline.convert,
+            self.filename, StringIO())
+
+        with open(self.filename, 'w') as fileobj:
+            fileobj.write(inp_text + '*STEP\n')
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            out = StringIO()
+            f._formats.pipeline.convert(self.filename, out)
+        self.assertEqual(len(w), 1)
+        self.assertEqual(len(etree.fromstring(out.getvalue()).find(
+            'Geometry/Elements')), 3)
+
+        # A failed conversion leaves no output file.
+        outname = os.path.join(self.tmpdir, 'out.feb.gz')
+        self.assertRaises(IOError, f._formats.pipeline.convert,
+            os.path.join(self.tmpdir, 'missing.inp'), outname)
+        self.assertEqual(os.listdir(self.tmpdir), ['mesh.inp'])
+        f._formats.pipeline.convert(self.filename, outname)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+            ['mesh.inp', 'out.feb.gz'])
+
+
+if __name__ == '__main__':
+    unittest.main()
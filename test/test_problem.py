@@ -1,6 +1,6 @@
 import unittest
 
-import sys, os
+import sys, os, subprocess, tempfile, shutil
 # For Python 3, use the translated version of the library.
 # For Python 2, find the library one directory up.
 if sys.version < '3':
@@ -54,6 +54,97 @@ class TestFEproblem(unittest.TestCase):
         self.assertEqual(len(desc_s[None]), 3)
 
 
+    def test_clone(self):
+        p = f.problem.FEproblem(options={'a': 1})
+        Node = f.geometry.Node
+        nodes = [ Node((0,0,0)), Node((1,0,0)), Node((0,1,0)), Node((0,0,1)) ]
+        p.sets['nodes'] = set(nodes)
+        p.sets['elements'] = set([f.geometry.Tet4(nodes)])
+
+        c = p.clone()
+        # Objects other than elements are shared, but containers are not.
+        self.assertEqual(c.sets['nodes'], p.sets['nodes'])
+        self.assertEqual(c.options, p.options)
+        self.assertFalse(c.sets['nodes'] is p.sets['nodes'])
+        self.assertFalse(c.options is p.options)
+        self.assertFalse(c.timestepper is p.timestepper)
+        c.sets['nodes'].add(Node((1,1,1)))
+        c.sets['new'] = set()
+        c.options['a'] = 2
+        self.assertEqual(len(p.sets['nodes']), 4)
+        self.assertFalse('new' in p.sets)
+        self.assertEqual(p.options['a'], 1)
+
+        # Elements are copied, so each problem can give them its own
+        # material.
+        e, = p.sets['elements']
+        copy, = c.sets['elements']
+        self.assertFalse(copy is e)
+        self.assertEqual(list(copy), nodes)
+        copy.material = f.materials.NeoHookean(1, 0.3)
+        self.assertTrue(e.material is None)
+
+        # Copies keep their originals' fiber directions, in a copy of the
+        # material and its axis, leaving the original's alone.
+        axis = f.materials.ElementOrientation()
+        e.material = f.materials.TransIsoElastic(1, 2, 3, 4, axis,
+            f.materials.NeoHookean(1, 0.3))
+        axis.vectors[e] = (1, 0, 0)
+        for i in range(3):
+            copy, = p.clone().sets['elements']
+        self.assertEqual(axis.vectors, {e: (1, 0, 0)})
+        self.assertFalse(copy.material is e.material)
+        self.assertFalse(copy.material.axis is axis)
+        self.assertTrue(copy.material.base is e.material.base)
+        self.assertEqual(copy.material.axis.get_at_element(copy),
+            axis.get_at_element(e))
+
+
+    def test_formats(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            p = f.problem.FEproblem()
+            nodes = [ f.geometry.Node(x) for x in
+                ((0,0,0), (1,0,0), (0,1,0), (0,0,1)) ]
+            p.sets['elements'] = set([f.geometry.Tet4(nodes)])
+            for ext in ('feb', 'inp'):
+                # Files are recognized by their contents when their names
+                # don't give their format.
+                name = os.path.join(tmpdir, 'mesh.' + ext)
+                p.write(name)
+                os.rename(name, os.path.join(tmpdir, 'mesh'))
+                self.assertEqual(f._formats.sniff(os.path.join(tmpdir,
+                    'mesh')), ext)
+                q = f.problem.FEproblem()
+                q.read(os.path.join(tmpdir, 'mesh'))
+                self.assertEqual(len(q.sets['mesh:allelements']), 1)
+            self.assertRaises(ValueError, p.write,
+                os.path.join(tmpdir, 'mesh.txt'))
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertRaises(AttributeError, getattr, p, 'read_vtu')
+        self.assertRaises(AttributeError, getattr, p, 'write_txt')
+
+
+    def test_lazy_imports(self):
+        # Format modules, analysis modules and NumPy are only imported when
+        # first used.
+        code = ('import sys, febabel; print(" ".join(sorted(m for m,x in '
+            'sys.modules.items() if x is not None and (m == "numpy" or '
+            'm.startswith("febabel.")))))')
+        loaded = subprocess.check_output([sys.executable, '-c', code],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual(loaded.split(), ['febabel._formats',
+            'febabel._formats._common', 'febabel._formats._compress',
+            'febabel.common', 'febabel.constraints', 'febabel.geometry',
+            'febabel.instrument', 'febabel.materials', 'febabel.problem'])
+        p = f.problem.FEproblem()
+        self.assertTrue(callable(p.write_vtu))
+        self.assertTrue(callable(p.to_simplices))
+        self.assertTrue(callable(f.quality.volumes))
+        self.assertRaises(AttributeError, getattr, p, 'no_such_method')
+
+
 
 
 if __name__ == '__main__':
@@ -0,0 +1,96 @@
+#!/usr/bin/env python2
+import unittest
+
+import sys, os
+# For Python 3, use the translated version of the library.
+# For Python 2, find the library one directory up.
+if sys.version < '3':
+    sys.path.append(os.path.dirname(sys.path[0]))
+import febabel as f
+q = f.quality
+
+
+@unittest.skipIf(q.np is None, 'NumPy is not available')
+class TestQuality(unittest.TestCase):
+
+    def setUp(self):
+        Node = f.geometry.Node
+        # A 2x1x1 box, and a unit tetrahedron, wedge, triangle and square.
+        self.box = f.geometry.Hex8([ Node((2*x,y,z)) for x,y,z in ((0,0,0),
+            (1,0,0), (1,1,0), (0,1,0), (0,0,1), (1,0,1), (1,1,1), (0,1,1)) ])
+        self.tet = f.geometry.Tet4([ Node(p) for p in
+            ((0,0,0), (1,0,0), (0,1,0), (0,0,1)) ])
+        self.pent = f.geometry.Pent6([ Node(p) for p in ((0,0,0), (1,0,0),
+            (0,1,0), (0,0,1), (1,0,1), (0,1,1)) ])
+        self.tri = f.geometry.Shell3([ Node(p) for p in
+            ((0,0,0), (1,0,0), (0,1,0)) ])
+        self.quad = f.geometry.Surface4([ Node(p) for p in
+            ((0,0,0), (1,0,0), (1,1,0), (0,1,0)) ])
+        self.elements = [self.box, self.tet, self.pent, self.tri, self.quad]
+
+    def measure(self, element, func):
+        found = q.blocks([element])
+        coords = found[element.__class__][1]
+        return func(element.__class__, coords)[0]
+
+    def test_centroids(self):
+        found = q.blocks(self.elements)
+        self.assertEqual(sorted(found, key=lambda cls: cls.__name__),
+            [f.geometry.Hex8, f.geometry.Pent6, f.geometry.Shell3,
+            f.geometry.Surface4, f.geometry.Tet4])
+        for cls, (elements, coords) in found.iteritems():
+            self.assertEqual(coords.shape, (1, len(elements[0]), 3))
+            for a, b in zip(q.centroids(coords)[0],
+                    elements[0].get_vertex_avg()):
+                self.assertAlmostEqual(a, b)
+
+    def test_volumes(self):
+        self.assertAlmostEqual(self.measure(self.box, q.volumes), 2)
+        self.assertAlmostEqual(self.measure(self.tet, q.volumes), 1/6.0)
+        self.assertAlmostEqual(self.measure(self.pent, q.volumes), 0.5)
+        self.assertAlmostEqual(self.measure(self.tri, q.areas), 0.5)
+        self.assertAlmostEqual(self.measure(self.quad, q.areas), 1)
+        # A brick with one corner lowered has a bilinear top face, so its
+        # volume is its base area times its average height.
+        self.box[6] = f.geometry.Node((2,1,0.5))
+        self.assertAlmostEqual(self.measure(self.box, q.volumes), 2 * 0.875)
+
+    def test_scaled_jacobians(self):
+        for e in (self.box, self.quad):
+            self.assertAlmostEqual(self.measure(e, q.scaled_jacobians), 1)
+        # Right-angled corners are not ideal for simplices.
+        self.assertAlmostEqual(self.measure(self.tet, q.scaled_jacobians),
+            0.5**0.5 * 2**0.5 * 0.5**0.5)
+        self.assertAlmostEqual(self.measure(self.tri, q.scaled_jacobians),
+            2 / 3**0.5 * 0.5**0.5)
+        self.assertAlmostEqual(self.measure(self.pent, q.scaled_jacobians),
+            2 / 3**0.5 * 0.5**0.5)
+        # Swapping the top and bottom inverts an element.
+        self.box[0:8] = self.box[4:8] + self.box[0:4]
+        self.assertAlmostEqual(self.measure(self.box, q.scaled_jacobians), -1)
+        self.assertAlmostEqual(self.measure(self.box, q.volumes), -2)
+
+    def test_aspect_ratios(self):
+        self.assertAlmostEqual(self.measure(self.box, q.aspect_ratios), 2)
+        self.assertAlmostEqual(self.measure(self.tet, q.aspect_ratios),
+            2**0.5)
+
+    def test_check_elements(self):
+        p = f.problem.FEproblem()
+        p.sets['good'] = set(self.elements)
+        self.assertEqual(p.check_elements(), [])
+        self.assertEqual(len(p.check_elements(0.9)), 3)
+        self.assertEqual([ e for e,d in p.check_elements(
+            max_aspect_ratio=1.5) ], [self.box])
+
+        inverted = f.geometry.Tet4([ self.tet[i] for i in (0,2,1,3) ])
+        flat = f.geometry.Tet4(self.tet[0:3] + [f.geometry.Node((1,1,0))])
+        p.sets['bad'] = set([inverted, flat])
+        bad = p.check_elements()
+        self.assertEqual([ e for e,d in bad ], [inverted, flat])
+        self.assertTrue(bad[0][1].startswith('inverted Tet4'))
+        self.assertTrue(bad[1][1].startswith('degenerate Tet4'))
+
+
+if __name__ == '__main__':
+    unittest.main()
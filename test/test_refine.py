@@ -0,0 +1,124 @@
+#!/usr/bin/env python2
+import unittest
+
+import sys, os
+# For Python 3, use the translated version of the library.
+# For Python 2, find the library one directory up.
+if sys.version < '3':
+    sys.path.append(os.path.dirname(sys.path[0]))
+import febabel as f
+
+
+def coords(elements):
+    np = f.adjacency.np
+    return np.array([ [ n._pos for n in e ] for e in elements ], float)
+
+
+@unittest.skipIf(f.adjacency.np is None, 'NumPy is not available')
+class TestRefine(unittest.TestCase):
+
+    def test_hex(self):
+        geo, con, mat = f.geometry, f.constraints, f.materials
+        ValsDict = f._formats._common.ValsDict
+        p = f.problem.FEproblem()
+        grid = dict( ((x,y,z), geo.Node((x,y,z))) for x in range(3)
+            for y in range(2) for z in range(2) )
+        corners = ((0,0,0), (1,0,0), (1,1,0), (0,1,0), (0,0,1), (1,0,1),
+            (1,1,1), (0,1,1))
+        axis = mat.ElementOrientation()
+        m = mat.TransIsoElastic(1, 2, 3, 4, axis, mat.NeoHookean(1, 0.3))
+        hexes = [ geo.Hex8([ grid[x+a, b, c] for a,b,c in corners ], m)
+            for x in range(2) ]
+        axis.vectors[hexes[0]] = (1,0,0)
+        top = geo.Surface4([ grid[x,y,1] for x,y in
+            ((0,0), (1,0), (1,1), (0,1)) ])
+        rigid = mat.Rigid([0,0,0], 1)
+        interface = con.RigidInterface(rigid, [ n for (x,y,z),n in
+            grid.iteritems() if x == 0 ])
+        contact = con.SlidingContact([top], [])
+        p.sets['mesh:allnodes'] = ValsDict( (str(i+1), grid[k])
+            for i,k in enumerate(sorted(grid)) )
+        p.sets['mesh:allelements'] = ValsDict( (str(i+1), e)
+            for i,e in enumerate(hexes) )
+        p.sets['mesh:top'] = set( n for (x,y,z),n in grid.iteritems()
+            if z == 1 )
+        p.sets['mesh:surface'] = [top]
+        p.sets['contacts'] = set([interface, contact])
+
+        children = p.refine()
+        self.assertEqual(len(children[hexes[0]]), 8)
+        self.assertEqual(len(children[top]), 4)
+        elements = p.sets['mesh:allelements']
+        self.assertEqual(sorted(elements, key=id),
+            sorted(children[hexes[0]] + children[hexes[1]], key=id))
+        self.assertEqual([ elements[str(i+1)] for i in range(8) ],
+            children[hexes[0]])
+        self.assertTrue(all( e.material is m for e in elements ))
+        volumes = f.quality.volumes(geo.Hex8, coords(elements.values()))
+        self.assertTrue(all( abs(v - 0.125) < 1e-12 for v in volumes ))
+
+        # Neighbouring bricks and the surface share the new nodes.
+        nodes = set()
+        for e in elements:
+            nodes.update(e)
+        for e in p.sets['mesh:surface']:
+            self.assertTrue(set(e) <= nodes)
+        self.assertEqual(len(nodes), 5*3*3)
+        self.assertEqual(len(p.sets['mesh:allnodes']), 5*3*3)
+        self.assertEqual(p.sets['mesh:allnodes']['1'], grid[0,0,0])
+        self.assertEqual(sorted(p.sets['mesh:allnodes'].keys(), key=int),
+            [ str(i+1) for i in range(45) ])
+        self.assertEqual(len(p.sets['mesh:top']), 5*3)
+        self.assertTrue(all( n.z == 1 for n in p.sets['mesh:top'] ))
+        self.assertEqual(len(interface.nodes), 3*3)
+        self.assertTrue(all( n.x == 0 for n in interface.nodes ))
+        self.assertEqual(contact.master, set(children[top]))
+        self.assertEqual(set(axis.vectors), set(children[hexes[0]]))
+
+        # Refining again splits each of the children.
+        children = p.refine(2)
+        self.assertEqual(len(p.sets['mesh:allelements']), 2*8*8*8)
+        self.assertEqual(len(children[elements['1']]), 64)
+        self.assertEqual(len(p.sets['mesh:allnodes']), 17*9*9)
+
+
+    def test_tet(self):
+        geo = f.geometry
+        p = f.problem.FEproblem()
+        nodes = [ geo.Node(x) for x in
+            ((0,0,0), (1,0,0), (0,1,0), (0,0,1), (1,1,1)) ]
+        tets = [ geo.Tet4(nodes[:4]), geo.Tet4(nodes[1:]) ]
+        shell = geo.Shell3(nodes[1:4], thickness=0.5)
+        p.sets['tets'] = set(tets)
+        p.sets['shells'] = [shell]
+        p.sets['spring'] = set([ geo.Spring([nodes[0], nodes[4]]) ])
+
+        children = p.refine(2)
+        volumes = f.quality.volumes(geo.Tet4, coords(children[tets[0]]))
+        self.assertEqual(len(volumes), 64)
+        self.assertTrue(all( abs(v - 1/6./64) < 1e-12 for v in volumes ))
+        self.assertEqual(len(p.sets['shells']), 16)
+        self.assertTrue(all( s.thickness == 0.5 for s in p.sets['shells'] ))
+        nodes = set()
+        for e in p.sets['tets']:
+            nodes.update(e)
+        # Each tetrahedron has 5 nodes along each edge, and they share a face.
+        self.assertEqual(len(nodes), 35 + 35 - 15)
+        for s in p.sets['shells']:
+            self.assertTrue(set(s) <= nodes)
+        self.assertEqual(len(p.sets['spring']), 1)
+
+
+    def test_unsupported(self):
+        geo = f.geometry
+        p = f.problem.FEproblem()
+        nodes = [ geo.Node((i,0,0)) for i in range(6) ]
+        p.sets['mesh'] = set([ geo.Pent6(nodes), geo.Tet4(nodes[:4]) ])
+        contents = set(p.sets['mesh'])
+        self.assertRaises(ValueError, p.refine)
+        self.assertEqual(p.sets['mesh'], contents)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python2
+import unittest
+
+import sys, os, random
+# For Python 3, use the translated version of the library.
+# For Python 2, find the library one directory up.
+if sys.version < '3':
+    sys.path.append(os.path.dirname(sys.path[0]))
+import febabel as f
+
+
+def coords(elements):
+    np = f.adjacency.np
+    return np.array([ [ n._pos for n in e ] for e in elements ], float)
+
+
+@unittest.skipIf(f.adjacency.np is None, 'NumPy is not available')
+class TestSimplices(unittest.TestCase):
+
+    def test_hex(self):
+        geo, mat = f.geometry, f.materials
+        ValsDict = f._formats._common.ValsDict
+        random.seed(3)
+        for trial in range(10):
+            p = f.problem.FEproblem()
+            grid = dict( ((x,y,z), geo.Node((x,y,z))) for x in range(4)
+                for y in range(3) for z in range(3) )
+            # Number the nodes randomly, so the faces are cut every way.
+            keys = range(1, len(grid) + 1)
+            random.shuffle(keys)
+            p.sets['mesh:allnodes'] = ValsDict( (str(k), n)
+                for k,n in zip(keys, grid.itervalues()) )
+            corners = ((0,0,0), (1,0,0), (1,1,0), (0,1,0), (0,0,1), (1,0,1),
+                (1,1,1), (0,1,1))
+            m = mat.NeoHookean(1, 0.3)
+            hexes = [ geo.Hex8([ grid[x+a, y+b, z+c] for a,b,c in corners ],
+                m) for x in range(3) for y in range(2) for z in range(2) ]
+            top = [ geo.Surface4([ grid[x+a, y+b, 2] for a,b in
+                ((0,0), (1,0), (1,1), (0,1)) ]) for x in range(3)
+                for y in range(2) ]
+            p.sets['mesh:allelements'] = ValsDict( (str(i+1), e)
+                for i,e in enumerate(hexes) )
+            p.sets['mesh:top'] = set(top)
+
+            children = p.to_simplices()
+            tets = p.sets['mesh:allelements'].values()
+            self.assertEqual(len(tets), 6*len(hexes))
+            self.assertEqual([ p.sets['mesh:allelements'][str(i+1)]
+                for i in range(6) ], children[hexes[0]])
+            self.assertTrue(all( e.material is m for e in tets ))
+            volumes = f.quality.volumes(geo.Tet4, coords(tets))
+            self.assertTrue(all( v > 0 for v in volumes ))
+            self.assertAlmostEqual(sum(volumes), 12)
+            # Faces inside the block are shared by two tetrahedra, and the
+            # surface's triangles are faces of the tetrahedra.
+            faces = dict()
+            for t in tets:
+                for i in range(4):
+                    face = frozenset(t[:i] + t[i+1:])
+                    faces[face] = faces.get(face, 0) + 1
+            outside = [ face for face,count in faces.iteritems()
+                if count == 1 ]
+            self.assertEqual(len(outside), 2 * 2*(3*2 + 3*2 + 2*2))
+            self.assertEqual(len(p.sets['mesh:top']), 2*len(top))
+            for s in p.sets['mesh:top']:
+                self.assertTrue(frozenset(s) in faces)
+
+
+    def test_pent_and_shell(self):
+        geo = f.geometry
+        p = f.problem.FEproblem()
+        nodes = [ geo.Node(x) for x in ((0,0,0), (1,0,0), (0,1,0), (0,0,1),
+            (1,0,1), (0,1,1), (1,1,0)) ]
+        pent = geo.Pent6(nodes[:6])
+        shell = geo.Shell4([nodes[1], nodes[6], nodes[2], nodes[0]],
+            thickness=0.5)
+        tet = geo.Tet4(nodes[:4])
+        p.sets['solids'] = [pent, tet]
+        p.sets['shells'] = set([shell])
+        p.sets['base'] = set(nodes[:3])
+        p.sets['mesh:allnodes'] = f._formats._common.ValsDict( (str(i+1), n)
+            for i,n in enumerate(nodes) )
+
+        children = p.to_simplices()
+        self.assertEqual(len(children[pent]), 3)
+        self.assertEqual(p.sets['solids'][3], tet)
+        volumes = f.quality.volumes(geo.Tet4, coords(children[pent]))
+        self.assertTrue(all( v > 0 for v in volumes ))
+        self.assertAlmostEqual(sum(volumes), 0.5)
+        triangles = children[shell]
+        self.assertEqual(p.sets['shells'], set(triangles))
+        self.assertTrue(all( isinstance(s, geo.Shell3) and s.thickness == 0.5
+            for s in triangles ))
+        # The quadrilateral is cut through its lowest-numbered node.
+        self.assertTrue(all( nodes[0] in s for s in triangles ))
+        self.assertEqual(p.sets['base'], set(nodes[:3]))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
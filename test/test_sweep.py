@@ -0,0 +1,87 @@
+#!/usr/bin/env python2
+import unittest, xml.etree.ElementTree as etree
+
+import sys, os, tempfile, shutil
+# For Python 3, use the translated version of the library.
+# For Python 2, find the library one directory up.
+if sys.version < '3':
+    sys.path.append(os.path.dirname(sys.path[0]))
+import febabel as f
+
+
+class TestSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+        p = self.problem = f.problem.FEproblem()
+        Node = f.geometry.Node
+        nodes = [
+            Node((0,0,0)), Node((1,0,0)), Node((1,1,0)), Node((0,1,0)),
+            Node((0,0,1)), Node((1,0,1)), Node((1,1,1)), Node((0,1,1)),
+            Node((0,0,2)), Node((1,0,2)), Node((1,1,2)), Node((0,1,2)),
+        ]
+        self.soft = f.materials.MooneyRivlin(1, 0, 10)
+        self.rigid = f.materials.Rigid((0,0,0))
+        self.lc = f.constraints.LoadCurve({0:0, 1:2})
+        self.rigid.constraints['z'] = f.constraints.Force(self.lc, 1)
+        p.sets['soft'] = set([f.geometry.Hex8(nodes[0:8], self.soft)])
+        p.sets['rigid'] = set([f.geometry.Hex8(nodes[4:12], self.rigid)])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+    def check_sweep(self, processes):
+        pattern = os.path.join(self.tmpdir, 'variant_%s.feb')
+        written = f.sweep.write_sweep(self.problem, [
+            ((f.sweep.material_of(self.problem, 'soft'), 'c1'), [1.5, 2.5]),
+            ((self.lc, 'scale'), [1, 10]) ], pattern, processes)
+
+        self.assertEqual([w[0] for w in written],
+            [pattern % i for i in range(4)])
+        self.assertEqual([w[1] for w in written],
+            [(1.5,1), (1.5,10), (2.5,1), (2.5,10)])
+
+        geometry = None
+        for filename, (c1, scale) in written:
+            tree = etree.parse(filename).getroot()
+            matls = tree.find('Material').findall('material')
+            mr = [m for m in matls if m.get('type') == 'Mooney-Rivlin'][0]
+            self.assertEqual(mr.find('c1').text, str(c1))
+            self.assertEqual(mr.find('k').text, '10')
+            lcid = tree.find('Constraints').find('rigid_body').find(
+                'trans_z').get('lc')
+            lc = [lc for lc in tree.find('LoadData').findall('loadcurve')
+                if lc.get('id') == lcid][0]
+            self.assertEqual([p.text for p in lc.findall('loadpoint')],
+                ['0,0', '1,%s' % (2*scale)])
+            # Every variant has identical geometry.
+            g = etree.tostring(tree.find('Geometry'))
+            self.assertTrue(geometry is None or g == geometry)
+            geometry = g
+
+        # The original problem is unchanged.
+        self.assertEqual(self.soft.c1, 1)
+        self.assertEqual(self.lc.points, {0:0, 1:2})
+
+    def test_serial(self):
+        self.check_sweep(1)
+
+    def test_parallel(self):
+        self.check_sweep(2)
+
+
+    def test_bad_targets(self):
+        self.assertRaises(ValueError, f.sweep.write_sweep, self.problem,
+            {(self.soft, 'axis'): [None]}, 'unused')
+        self.problem.sets['mixed'] = (self.problem.sets['soft'] |
+            self.problem.sets['rigid'])
+        self.assertRaises(ValueError, f.sweep.material_of, self.problem,
+            'mixed')
+
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python2
+import unittest
+
+import sys, os, struct, zlib
+from array import array
+import xml.etree.ElementTree as etree
+# For Python 3, use the translated version of the library.
+# For Python 2, find the library one directory up.
+if sys.version < '3':
+    sys.path.append(os.path.dirname(sys.path[0]))
+import febabel as f
+from febabel._formats import vtu
+try: from cStringIO import StringIO
+except ImportError: from io import BytesIO as StringIO
+
+
+def read_vtu(text):
+    """Returns the XML header of a .vtu file written with appended raw data,
+    and a dict of its arrays by name."""
+    start = text.index(b'<AppendedData')
+    start = text.index(b'_', start) + 1
+    header = etree.fromstring(text[:start-1] + b'</AppendedData></VTKFile>')
+    compressed = header.get('compressor') is not None
+    typecodes = {'Float64': 'd', 'Int32': 'i', 'UInt8': 'B'}
+    arrays = dict()
+    for e in header.iter('DataArray'):
+        pos = start + int(e.get('offset'))
+        if compressed:
+            n = struct.unpack('=Q', text[pos:pos+8])[0]
+            sizes = struct.unpack('=%dQ' % n, text[pos+24:pos+24+8*n])
+            pos += 24 + 8*n
+            data = list()
+            for size in sizes:
+                data.append(zlib.decompress(text[pos:pos+size]))
+                pos += size
+            data = b''.join(data)
+        else:
+            size = struct.unpack('=Q', text[pos:pos+8])[0]
+            data = text[pos+8:pos+8+size]
+        a = array(typecodes[e.get('type')])
+        a.fromstring(data)
+        arrays[e.get('Name')] = a
+    return header, arrays
+
+
+
+class TestVtu(unittest.TestCase):
+
+    def setUp(self):
+        self.p = p = f.problem.FEproblem()
+        geo, mat = f.geometry, f.materials
+        nodes = [ geo.Node((x,y,z)) for z in (0,1) for y in (0,1)
+            for x in (0,1,2) ]
+        grid = lambda x,y,z: nodes[x + 3*y + 6*z]
+        matl = mat.TransIsoElastic(1, 2, 3, 1.1,
+            mat.VectorOrientation((0,0,1), (1,0,0)), mat.MooneyRivlin(1, 0, 10))
+        self.hex = geo.Hex8([ grid(a,b,c) for a,b,c in ((0,0,0), (1,0,0),
+            (1,1,0), (0,1,0), (0,0,1), (1,0,1), (1,1,1), (0,1,1)) ], matl)
+        self.pent = geo.Pent6([ grid(a,b,c) for a,b,c in ((1,0,0), (2,0,0),
+            (1,1,0), (1,0,1), (2,0,1), (1,1,1)) ], mat.NeoHookean(1, 0.3))
+        self.surf = geo.Surface4([ grid(0,b,c) for b,c in ((0,0), (0,1),
+            (1,1), (1,0)) ])
+        p.sets['mesh:allnodes'] = f._formats._common.ValsDict(
+            (str(i+1), n) for i,n in enumerate(nodes) )
+        p.sets['solids'] = set([self.hex, self.pent])
+        p.sets['end'] = set([self.surf])
+        p.sets['base'] = set( grid(x,y,0) for x in (0,1,2) for y in (0,1) )
+
+    def check(self, compress):
+        out = StringIO()
+        self.p.write_vtu(out, compress)
+        header, arrays = read_vtu(out.getvalue())
+
+        piece = header.find('UnstructuredGrid/Piece')
+        self.assertEqual(piece.get('NumberOfPoints'), '12')
+        self.assertEqual(piece.get('NumberOfCells'), '3')
+        points = arrays['Points']
+        self.assertEqual(len(points), 36)
+        # Nodes keep the order they were read in.
+        self.assertEqual(list(points[9:12]), [0.0, 1.0, 0.0])
+
+        # Cells are found from their connectivity.
+        cells = dict()
+        start = 0
+        for end, t in zip(arrays['offsets'], arrays['types']):
+            cells[t] = [ tuple(points[3*i:3*i+3])
+                for i in arrays['connectivity'][start:end] ]
+            start = end
+        self.assertEqual(sorted(cells), [9, 12, 13])
+        self.assertEqual(cells[12], [ tuple(n) for n in self.hex ])
+        self.assertEqual(cells[9], [ tuple(n) for n in self.surf ])
+        # Wedges are written with their first face pointing outward.
+        self.assertEqual(cells[13][:3], [ tuple(self.pent[i])
+            for i in (0,2,1) ])
+
+        index = dict( (t, i) for i,t in enumerate(arrays['types']) )
+        materials = arrays['material']
+        self.assertEqual(materials[index[9]], 0)
+        self.assertEqual(sorted(materials), [0, 1, 2])
+        self.assertEqual(list(arrays['fiber'][3*index[12]:3*index[12]+3]),
+            [0.0, 0.0, 1.0])
+        self.assertEqual(list(arrays['fiber'][3*index[13]:3*index[13]+3]),
+            [0.0, 0.0, 0.0])
+        self.assertEqual(list(arrays['solids']), [ int(t != 9)
+            for t in arrays['types'] ])
+        self.assertEqual(sum(arrays['end']), 1)
+        self.assertEqual(list(arrays['base']), [1]*6 + [0]*6)
+        self.assertFalse('mesh:allnodes' in arrays)
+
+    def test_write_vtu(self):
+        self.check(False)
+
+    def test_write_vtu_compressed(self):
+        f._formats.vtu.BLOCK_SIZE, block_size = 64, f._formats.vtu.BLOCK_SIZE
+        try:
+            self.check(True)
+        finally:
+            f._formats.vtu.BLOCK_SIZE = block_size
+
+
+if __name__ == '__main__':
+    unittest.main()